@@ -1,9 +1,15 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.utils.text import (
+    smart_split,
+    unescape_string_literal,
+)
 
 from checkin.models import (
     CheckIn,
     Tag,
 )
+from checkin.search import activity_search_condition
 
 
 class CheckInAdmin(admin.ModelAdmin):
@@ -22,6 +28,21 @@ class CheckInAdmin(admin.ModelAdmin):
     )
     raw_id_fields = ("tag",)
 
+    def get_search_results(self, request, queryset, search_term):
+        """Search activity through the search index, tags and usernames with ``icontains``."""
+        if not search_term:
+            return queryset, False
+
+        for term in smart_split(search_term):
+            if term.startswith(('"', "'")) and term[0] == term[-1]:
+                term = unescape_string_literal(term)
+            queryset = queryset.filter(
+                activity_search_condition(term, using=queryset.db)
+                | Q(tag__name__icontains=term)
+                | Q(user__username__icontains=term)
+            )
+        return queryset, False
+
 
 class TagAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,259 @@
+"""
+JSON API over the logged in user's check-ins and reports.
+
+GET responses carry a strong ETag made of the user's data version, which
+changes on every check-in change and tag rename, and the latest
+``CheckIn.modified``. A conditional GET whose ETag still matches is answered
+with ``304 Not Modified`` after one indexed lookup, without running the query
+or serializing anything. No ``Last-Modified`` is sent, deleting a check-in
+does not move it.
+"""
+import hashlib
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.paginator import PageNotAnInteger
+from django.db.models import (
+    Max,
+    Sum,
+)
+from django.http import (
+    HttpResponse,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
+from django.views.generic import View
+
+from checkin.cache import (
+    get_data_version,
+    get_or_compute_user_data,
+    normalize_params,
+)
+from checkin.filters import (
+    CheckInFilter,
+    CheckInReportsFilter,
+)
+from checkin.forms import (
+    CheckInBatchForm,
+    CheckInForm,
+)
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    Tag,
+    UserTag,
+)
+from checkin.paginators import KeysetPaginator
+
+
+# report output names of the grouping aliases
+REPORT_FIELDS = {"tag_name": "tag", "day": "date"}
+
+
+def serialize_group_value(value):
+    """JSON value of a report group: untagged stays ``None``, dates become ISO strings."""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def serialize_checkin(checkin):
+    return {
+        "id": checkin.pk,
+        "timestamp": timezone.localtime(checkin.timestamp).isoformat(),
+        "hours": f"{checkin.hours:.2f}",
+        "tag": checkin.tag.name if checkin.tag_id else None,
+        "activity": checkin.activity,
+        "modified": checkin.modified.isoformat(),
+    }
+
+
+class ApiViewMixin(LoginRequiredMixin):
+    """
+    View mixin for JSON endpoints: answers anonymous requests with 401, and
+    conditional GETs whose ETag still matches with 304.
+    """
+
+    etag_name = None
+
+    def handle_no_permission(self):
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    def get_etag(self):
+        latest = CheckIn.objects.filter(user=self.request.user).aggregate(latest=Max("modified"))["latest"]
+        version = [
+            self.etag_name,
+            self.kwargs,
+            get_data_version(self.request.user.pk),
+            latest.isoformat() if latest else None,
+            normalize_params(self.request.GET),
+        ]
+        return hashlib.md5(json.dumps(version, sort_keys=True).encode()).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = quote_etag(self.get_etag())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code == 200:
+                response["ETag"] = etag
+        # clients keep the response and revalidate it every time
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def json_body(self):
+        try:
+            return json.loads(self.request.body or b"{}")
+        except ValueError:
+            return None
+
+
+class CheckInListApiView(ApiViewMixin, View):
+    """
+    ``GET`` lists the user's check-ins, newest first, with the filters of the
+    my check-ins page and a ``cursor`` from the previous page's ``next``.
+    ``POST`` creates check-ins from ``{"checkin": "<string>"}`` or
+    ``{"checkins": ["<string>", ...]}``.
+    """
+
+    etag_name = "checkins"
+    default_limit = 100
+    max_limit = 1000
+
+    def get_queryset(self):
+        return CheckIn.objects.filter(user=self.request.user).select_related("tag")
+
+    def get(self, request, *args, **kwargs):
+        filterset = CheckInFilter(request.GET, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            return JsonResponse({"errors": filterset.errors}, status=400)
+        try:
+            limit = min(int(request.GET.get("limit", self.default_limit)), self.max_limit)
+        except ValueError:
+            return JsonResponse({"errors": {"limit": ["Enter a whole number."]}}, status=400)
+
+        paginator = KeysetPaginator(filterset.qs, max(limit, 1), ordering=("-timestamp",))
+        try:
+            page = paginator.page(request.GET.get("cursor", KeysetPaginator.first_page))
+        except PageNotAnInteger as e:
+            return JsonResponse({"errors": {"cursor": [str(e)]}}, status=400)
+        return JsonResponse(
+            {
+                "results": [serialize_checkin(checkin) for checkin in page],
+                "next": page.next_cursor,
+                "previous": page.previous_cursor,
+            }
+        )
+
+    def post(self, request, *args, **kwargs):
+        data = self.json_body()
+        if isinstance(data, dict) and isinstance(data.get("checkins"), list):
+            form = CheckInBatchForm({"checkin_lines": "\n".join(map(str, data["checkins"]))}, user=request.user)
+        elif isinstance(data, dict) and "checkin" in data:
+            form = CheckInForm({"checkin_string": data["checkin"]}, user=request.user)
+        else:
+            return JsonResponse({"error": 'Send {"checkin": "<string>"} or {"checkins": [...]}.'}, status=400)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+
+        checkins = form.save()
+        if isinstance(checkins, CheckIn):
+            checkins = [checkins]
+        tags = Tag.objects.in_bulk({checkin.tag_id for checkin in checkins})
+        for checkin in checkins:
+            checkin.tag = tags.get(checkin.tag_id)
+        return JsonResponse({"results": [serialize_checkin(checkin) for checkin in checkins]}, status=201)
+
+
+class CheckInDetailApiView(ApiViewMixin, View):
+    """``GET`` returns one of the user's check-ins, ``DELETE`` deletes it."""
+
+    etag_name = "checkin"
+
+    def get_object(self):
+        return get_object_or_404(CheckIn.objects.select_related("tag"), pk=self.kwargs["pk"], user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(serialize_checkin(self.get_object()))
+
+    def delete(self, request, *args, **kwargs):
+        self.get_object().delete()
+        return HttpResponse(status=204)
+
+
+class ReportsApiView(ApiViewMixin, View):
+    """
+    ``GET`` returns the user's hours with the filters of the reports page,
+    grouped by any of ``grouping=tag__name``, ``timestamp__date``, ``week``
+    and ``month``, or in total without a grouping. Unlike the chart, every
+    group is returned.
+    """
+
+    etag_name = "reports"
+
+    def get(self, request, *args, **kwargs):
+        filterset = CheckInReportsFilter(
+            request.GET, queryset=DailyCheckInTotal.objects.filter(user=request.user), request=request
+        )
+        if not filterset.is_valid():
+            return JsonResponse({"errors": filterset.errors}, status=400)
+        results = get_or_compute_user_data(
+            request.user.pk, "api_reports", request.GET, lambda: self.get_results(filterset)
+        )
+        return JsonResponse({"results": results})
+
+    def get_results(self, filterset):
+        if not filterset.form.cleaned_data.get("grouping"):
+            total = filterset.qs.aggregate(total_hours=Sum("hours"))["total_hours"] or 0
+            return [{"total_hours": f"{total:.2f}"}]
+        return [
+            {
+                REPORT_FIELDS.get(key, key): f"{value:.2f}" if key == "total_hours" else serialize_group_value(value)
+                for key, value in record.items()
+            }
+            for record in filterset.qs
+        ]
+
+
+class TagAutocompleteApiView(ApiViewMixin, View):
+    """
+    ``GET`` returns the user's tags starting with ``prefix``, the most used
+    first, for completing ``#tag`` in the check-in form.
+    """
+
+    etag_name = "tags"
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get("limit", self.default_limit)), self.max_limit)
+        except ValueError:
+            return JsonResponse({"errors": {"limit": ["Enter a whole number."]}}, status=400)
+
+        user_tags = UserTag.objects.filter(user=request.user).complete(request.GET.get("prefix", ""), max(limit, 1))
+        return JsonResponse(
+            {
+                "results": [
+                    {
+                        "tag": user_tag.name,
+                        "checkin_count": user_tag.checkin_count,
+                        "last_used": str(user_tag.last_used),
+                    }
+                    for user_tag in user_tags
+                ]
+            }
+        )
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from checkin.cache import auth_user_key
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ``ModelBackend`` that keeps the user of every authenticated request in the
+    cache, so requests do not load it from the database.
+
+    Cached users are dropped whenever the user is saved or deleted, which
+    covers password, ``is_active`` and ``is_superuser`` changes, so a changed
+    password still signs out other sessions on their next request.
+    ``CHECKIN_AUTH_USER_CACHE_TIMEOUT`` bounds how long a user written
+    without ``save()`` (e.g. ``QuerySet.update``) can be served stale.
+    """
+
+    def get_user(self, user_id):
+        key = auth_user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.CHECKIN_AUTH_USER_CACHE_TIMEOUT)
+        return user
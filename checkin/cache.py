@@ -0,0 +1,155 @@
+import hashlib
+import json
+import threading
+import uuid
+from collections import (
+    Counter,
+    OrderedDict,
+)
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    transaction,
+)
+
+from checkin import shards
+from checkin.models import Tag
+
+
+class TagIdCache:
+    """
+    Process-local, bounded LRU mapping tag names to ids.
+
+    Tags are only ever added on the write path, so a cached id stays valid
+    until a tag is renamed or deleted. Those bump a generation stored in the
+    Django cache, which makes every process drop its entries on the next lookup.
+    """
+
+    generation_key = "checkin:tag-ids:generation"
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get_ids(self, names):
+        """Return a ``{name: id}`` dict for ``names``, creating the missing tags."""
+        names = set(names)
+        generation = cache.get(self.generation_key)
+        tag_ids = {}
+        with self._lock:
+            if generation != self._generation:
+                self._ids.clear()
+                self._generation = generation
+            for name in names:
+                if name in self._ids:
+                    self._ids.move_to_end(name)
+                    tag_ids[name] = self._ids[name]
+
+        missing = names - tag_ids.keys()
+        if missing:
+            created = Tag.objects.using(DEFAULT_DB_ALIAS).get_ids_for_names(missing)
+            if shards.is_sharded():
+                # bulk inserts send no signals, copy the tags to the shards before check-ins refer to them
+                shards.copy_rows(Tag, created.values(), shards.get_shards()[1:])
+            tag_ids.update(created)
+            # tags created in a transaction that is rolled back must not stay cached
+            transaction.on_commit(lambda: self._remember(created, generation))
+        return tag_ids
+
+    def _remember(self, ids, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._ids.update(ids)
+                while len(self._ids) > self.maxsize:
+                    self._ids.popitem(last=False)
+
+    def get_id(self, name):
+        return self.get_ids([name])[name]
+
+    def invalidate(self):
+        cache.set(self.generation_key, uuid.uuid4().hex, None)
+        with self._lock:
+            self._ids.clear()
+
+
+tag_ids = TagIdCache(settings.CHECKIN_TAG_CACHE_SIZE)
+
+
+# Per-process hit and miss counts of the user data cache, keyed by (name, outcome)
+user_data_stats = Counter()
+user_data_stats_lock = threading.Lock()
+
+GLOBAL_DATA_VERSION_KEY = "checkin:data-version:global"
+
+
+def user_data_version_key(user_id):
+    return f"checkin:data-version:user:{user_id}"
+
+
+def bump_user_data_versions(user_ids):
+    """Invalidate the cached data of ``user_ids`` by giving them new data versions."""
+    version = uuid.uuid4().hex
+    cache.set_many({user_data_version_key(user_id): version for user_id in user_ids}, None)
+
+
+def bump_global_data_version():
+    """Invalidate the cached data of all users, e.g. after a tag is renamed."""
+    cache.set(GLOBAL_DATA_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_data_version(user_id):
+    """Return the combined global and per-user data version for ``user_id``."""
+    version_key = user_data_version_key(user_id)
+    versions = cache.get_many([GLOBAL_DATA_VERSION_KEY, version_key])
+    missing = {key: uuid.uuid4().hex for key in (GLOBAL_DATA_VERSION_KEY, version_key) if key not in versions}
+    for key, version in missing.items():
+        # another process may have set the version in the meantime, keep theirs
+        cache.add(key, version, None)
+    if missing:
+        versions.update(cache.get_many(list(missing)))
+    return "%s.%s" % (versions.get(GLOBAL_DATA_VERSION_KEY, ""), versions.get(version_key, ""))
+
+
+def auth_user_key(user_id):
+    return f"checkin:auth-user:{user_id}"
+
+
+def invalidate_auth_user(user_id):
+    """Drop the cached user loaded by `checkin.backends.CachedModelBackend` for every request."""
+    cache.delete(auth_user_key(user_id))
+
+
+def normalize_params(params, ignore=("submit",)):
+    """Return a stable string for request parameters, regardless of their order."""
+    if hasattr(params, "lists"):
+        items = params.lists()
+    else:
+        items = ((key, value if isinstance(value, (list, tuple)) else [value]) for key, value in params.items())
+    normalized = sorted((key, sorted(str(value) for value in values if value != "")) for key, values in items)
+    return json.dumps([(key, values) for key, values in normalized if key not in ignore and values])
+
+
+def get_or_compute_user_data(user_id, name, params, compute):
+    """
+    Return the cached result of ``compute()`` for ``user_id``.
+
+    Entries are keyed by the user's data version and the normalized ``params``.
+    Versions change whenever the user's check-ins do, so entries never need to
+    be deleted and are never served stale; old ones just expire.
+    """
+    params_hash = hashlib.md5(normalize_params(params).encode()).hexdigest()
+    key = f"checkin:data:{name}:{user_id}:{get_data_version(user_id)}:{params_hash}"
+
+    value = cache.get(key)
+    outcome = "hit"
+    if value is None:
+        outcome = "miss"
+        value = compute()
+        cache.set(key, value, settings.CHECKIN_USER_DATA_CACHE_TIMEOUT)
+    with user_data_stats_lock:
+        user_data_stats[(name, outcome)] += 1
+    return value
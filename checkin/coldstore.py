@@ -0,0 +1,226 @@
+"""
+Cold storage of old check-ins in column files.
+
+Check-ins of one local calendar month are stored under ``<root>/YYYY-MM/``
+in one or more segments, one directory per archive run. A segment holds one
+``.npy`` file per column with the narrowest type that fits, and the activity
+texts dictionary-encoded: an index per row plus the distinct values in a
+gzipped JSON file. Numeric columns are read memory-mapped, so aggregating a
+column only touches the pages of that column.
+
+Rows move between the check-in table and cold storage without changing the
+daily totals, which keep covering both.
+"""
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from checkin.models import day_bounds
+from checkin.partitions import (
+    add_months,
+    month_start,
+    partition_bounds,
+)
+
+
+FORMAT_VERSION = 1
+# segments being archived, skipped by readers until they are published
+STAGING_PREFIX = ".segment-"
+
+# column name: dtype of the .npy file
+COLUMNS = {
+    "id": np.int64,
+    "user_id": np.int32,
+    # -1 for untagged check-ins
+    "tag_id": np.int32,
+    # microseconds since the epoch, UTC
+    "timestamp": np.int64,
+    "created": np.int64,
+    "modified": np.int64,
+    # hundredths of an hour, the field has two decimal places
+    "hours": np.int32,
+    "activity": np.int32,
+}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + int(value) * MICROSECOND
+
+
+class ColdStore:
+    def __init__(self, root):
+        self.root = root
+
+    def month_path(self, month):
+        return os.path.join(self.root, f"{month:%Y-%m}")
+
+    def months(self):
+        """Return the months that have segments, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        months = []
+        for name in os.listdir(self.root):
+            try:
+                month = datetime.datetime.strptime(name, "%Y-%m").date()
+            except ValueError:
+                continue
+            if self.segments(month):
+                months.append(month)
+        return sorted(months)
+
+    def segments(self, month):
+        """Return the segment directories of ``month``, skipping unfinished ones."""
+        path = self.month_path(month)
+        if not os.path.isdir(path):
+            return []
+        return [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if not name.startswith(STAGING_PREFIX) and os.path.exists(os.path.join(path, name, "meta.json"))
+        ]
+
+    def staged_segments(self):
+        """Return the staged segments of all months, finished or not, that were never published."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            os.path.join(self.root, month, name)
+            for month in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, month))
+            for name in os.listdir(os.path.join(self.root, month))
+            if name.startswith(STAGING_PREFIX)
+        )
+
+    def stage_segment(self, month, rows):
+        """
+        Write ``rows`` of ``month`` to a staging directory and return its path.
+
+        ``rows`` are ``(id, user_id, tag_id, timestamp, created, modified,
+        hours, activity)`` tuples. Readers skip the staged segment until
+        `publish_segment` renames it into place, so they never see half of it,
+        nor rows that are still in the check-in table.
+        """
+        rows = sorted(rows, key=lambda row: (row[1], row[3]))
+        activities = {}
+        columns = {name: np.empty(len(rows), dtype=dtype) for name, dtype in COLUMNS.items()}
+        for index, (pk, user_id, tag_id, timestamp, created, modified, hours, activity) in enumerate(rows):
+            columns["id"][index] = pk
+            columns["user_id"][index] = user_id
+            columns["tag_id"][index] = -1 if tag_id is None else tag_id
+            columns["timestamp"][index] = to_micros(timestamp)
+            columns["created"][index] = to_micros(created)
+            columns["modified"][index] = to_micros(modified)
+            columns["hours"][index] = int(hours * 100)
+            columns["activity"][index] = activities.setdefault(activity, len(activities))
+
+        month_path = self.month_path(month)
+        os.makedirs(month_path, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=month_path, prefix=STAGING_PREFIX)
+        for name, values in columns.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        with gzip.open(os.path.join(tmp_path, "activity.json.gz"), "wt") as f:
+            json.dump(list(activities), f)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"version": FORMAT_VERSION, "month": f"{month:%Y-%m}", "rows": len(rows)}, f)
+
+        return tmp_path
+
+    def publish_segment(self, staged):
+        """Make the staged segment ``staged`` visible to readers and return its path."""
+        path = os.path.join(os.path.dirname(staged), timezone.now().strftime("%Y%m%dT%H%M%S%f"))
+        os.rename(staged, path)
+        return path
+
+    def read_columns(self, segment, names):
+        """Return the columns ``names`` of ``segment`` as read-only memory-mapped arrays."""
+        return {name: np.load(os.path.join(segment, f"{name}.npy"), mmap_mode="r") for name in names}
+
+    def iter_rows(self, segment):
+        """Yield the rows of ``segment`` in the form `stage_segment` takes them."""
+        columns = self.read_columns(segment, COLUMNS)
+        with gzip.open(os.path.join(segment, "activity.json.gz"), "rt") as f:
+            activities = json.load(f)
+        for index in range(len(columns["id"])):
+            tag_id = int(columns["tag_id"][index])
+            yield (
+                int(columns["id"][index]),
+                int(columns["user_id"][index]),
+                None if tag_id == -1 else tag_id,
+                from_micros(columns["timestamp"][index]),
+                from_micros(columns["created"][index]),
+                from_micros(columns["modified"][index]),
+                Decimal(int(columns["hours"][index])).scaleb(-2),
+                activities[columns["activity"][index]],
+            )
+
+    def remove_month(self, month):
+        shutil.rmtree(self.month_path(month))
+
+    def daily_totals(self, since=None):
+        """
+        Return ``{(user_id, tag_id, date): (hours, count)}`` of the stored
+        check-ins, by local date, from ``since`` on if given.
+
+        Rows are assigned to days by searching the month's local midnights,
+        then sorted by key and summed with ``np.add.reduceat``, without a
+        Python loop over the rows.
+        """
+        totals = {}
+        for month in self.months():
+            if since is not None and add_months(month, 1) <= since:
+                continue
+            days = [month + datetime.timedelta(days=offset) for offset in range((add_months(month, 1) - month).days)]
+            midnights = np.array(
+                [to_micros(day_bounds(day)[0]) for day in days] + [to_micros(partition_bounds(month)[1])]
+            )
+            first_day = (since - month).days if since is not None and since > month else 0
+
+            for segment in self.segments(month):
+                columns = self.read_columns(segment, ("user_id", "tag_id", "timestamp", "hours"))
+                day_index = np.searchsorted(midnights, columns["timestamp"], side="right") - 1
+                keep = day_index >= first_day
+                user_ids, tag_ids = columns["user_id"][keep], columns["tag_id"][keep]
+                day_index, hours = day_index[keep], columns["hours"][keep].astype(np.int64)
+                if not len(hours):
+                    continue
+
+                order = np.lexsort((day_index, tag_ids, user_ids))
+                user_ids, tag_ids, day_index, hours = user_ids[order], tag_ids[order], day_index[order], hours[order]
+                changes = (np.diff(user_ids) != 0) | (np.diff(tag_ids) != 0) | (np.diff(day_index) != 0)
+                starts = np.concatenate(([0], np.flatnonzero(changes) + 1))
+                sums = np.add.reduceat(hours, starts)
+                counts = np.diff(np.append(starts, len(hours)))
+
+                for start, hundredths, count in zip(starts, sums, counts):
+                    tag_id = int(tag_ids[start])
+                    key = (int(user_ids[start]), None if tag_id == -1 else tag_id, days[day_index[start]])
+                    stored_hours, stored_count = totals.get(key, (Decimal(0), 0))
+                    totals[key] = (stored_hours + Decimal(int(hundredths)).scaleb(-2), stored_count + int(count))
+        return totals
+
+
+def get_cold_store():
+    """Return the configured cold store, or None when cold storage is not set up."""
+    if not settings.CHECKIN_COLD_STORAGE_DIR:
+        return None
+    return ColdStore(settings.CHECKIN_COLD_STORAGE_DIR)
+
+
+def default_cutoff():
+    """First month kept in the check-in table by default."""
+    return month_start(timezone.localdate() - datetime.timedelta(days=settings.CHECKIN_COLD_STORAGE_AFTER_DAYS))
@@ -0,0 +1,96 @@
+import csv
+import datetime
+import heapq
+import json
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# output column: lookup
+EXPORT_COLUMNS = {
+    "timestamp": "timestamp",
+    "hours": "hours",
+    "tag": "tag__name",
+    "activity": "activity",
+}
+ADMIN_EXPORT_COLUMNS = dict(user="user__username", **EXPORT_COLUMNS)
+
+
+class Echo:
+    """File-like object that returns what is written instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).isoformat()
+    if isinstance(value, (datetime.date, Decimal)):
+        return str(value)
+    return value
+
+
+def iter_rows(queryset, lookups, chunk_size, databases=None):
+    """
+    Iterate over the ``values_list`` tuples of ``lookups`` of ``queryset``,
+    merged in the queryset's ascending ordering from each of ``databases``.
+    """
+    if not databases:
+        return queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+    ordering = list(queryset.query.order_by)
+    size = len(lookups)
+    rows = [
+        queryset.using(alias).values_list(*lookups, *ordering).iterator(chunk_size=chunk_size) for alias in databases
+    ]
+    return (row[:size] for row in heapq.merge(*rows, key=lambda row: row[size:]))
+
+
+def iter_export(queryset, columns, export_format="csv", chunk_size=2000, databases=None):
+    """
+    Yield ``queryset`` rows serialized as CSV or NDJSON, in chunks of
+    ``chunk_size`` rows.
+
+    ``columns`` maps output column names to lookups. Rows are read as
+    ``values_list`` tuples through ``iterator()``, which uses a server-side
+    cursor on PostgreSQL, so memory stays flat and the header is sent before
+    the query has finished. With ``databases``, the rows of each are merged
+    by the queryset's ordering, which must be ascending.
+    """
+    names = list(columns.keys())
+    rows = iter_rows(queryset, list(columns.values()), chunk_size, databases)
+
+    if export_format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        serialize = writer.writerow
+    else:
+
+        def serialize(row):
+            return json.dumps(dict(zip(names, row))) + "\n"
+
+    chunk = []
+    for row in rows:
+        chunk.append(serialize([format_value(value) for value in row]))
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def export_response(queryset, columns, export_format, filename, databases=None):
+    """Return a `StreamingHttpResponse` streaming ``queryset`` as an attachment."""
+    response = StreamingHttpResponse(
+        iter_export(queryset, columns, export_format, databases=databases),
+        content_type=EXPORT_CONTENT_TYPES[export_format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -1,3 +1,6 @@
+from collections import defaultdict
+from decimal import Decimal
+
 import django_filters
 from crispy_forms.bootstrap import InlineCheckboxes
 from crispy_forms.helper import FormHelper
@@ -10,26 +13,56 @@ from django import forms
 from django.contrib.auth.models import User
 from django.db.models import (
     DecimalField,
-    Exists,
-    OuterRef,
-    Subquery,
+    FilteredRelation,
+    Q,
     Sum,
 )
 from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from checkin.models import (
     CheckIn,
+    DailyCheckInTotal,
     Tag,
+    day_bounds,
 )
+from checkin.reports import group_totals
+from checkin.search import search_activity
 
 
 def owned_tags(request):
-    """Return a queryset of tags that the user has check-ins for."""
+    """Return a queryset of tags that the user has check-ins for, read from the user's tags."""
     if request is None:
         return Tag.objects.all()
 
-    user_checkins = request.user.checkins.filter(tag=OuterRef("pk"))
-    return Tag.objects.filter(Exists(user_checkins))
+    return Tag.objects.filter(user_tags__user=request.user).order_by("name")
+
+
+class HalfOpenDateRangeFilter(django_filters.DateFromToRangeFilter):
+    """
+    Date range filter that compares the raw timestamp against
+    ``[start of first day, start of the day after the last day)`` so the
+    lookup stays sargable on the timestamp indexes.
+    """
+
+    def get_range_lookups(self, value):
+        """Return the filter kwargs for the given date range slice."""
+        lookups = {}
+        if value.start is not None:
+            lookups["%s__gte" % self.field_name] = value.start
+        if value.stop is not None:
+            stop_date = timezone.localtime(value.stop).date()
+            lookups["%s__lt" % self.field_name] = day_bounds(stop_date)[1]
+        return lookups
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+
+        qs = qs.filter(**self.get_range_lookups(value))
+        if self.distinct:
+            qs = qs.distinct()
+        return qs
 
 
 class CheckInFilter(django_filters.FilterSet):
@@ -39,15 +72,18 @@ class CheckInFilter(django_filters.FilterSet):
         label="Tag",
         queryset=owned_tags,
     )
-    timestamp = django_filters.DateFromToRangeFilter(
+    timestamp = HalfOpenDateRangeFilter(
         label="Date range",
     )
-    activity = django_filters.CharFilter(label="Activity", lookup_expr="icontains")
+    activity = django_filters.CharFilter(label="Activity", method="filter_activity")
 
     class Meta:
         model = CheckIn
         fields = ("tag", "timestamp", "activity")
 
+    def filter_activity(self, queryset, name, value):
+        return search_activity(queryset, value)
+
     @property
     def form(self):
         form = super().form
@@ -87,31 +123,50 @@ class CheckInAdminFilter(CheckInFilter):
 
 
 class GroupingMultipleChoiceFilter(django_filters.MultipleChoiceFilter):
-    """Custom filter for grouping queryset and summing total hours."""
+    """Custom filter for grouping queryset and summing total hours, see `checkin.reports.GROUPINGS`."""
 
     def filter(self, qs, value):
-        return qs.values(*value).order_by(*value).annotate(total_hours=Sum("hours"))
+        if not value:
+            return qs
+        return group_totals(qs, value)
 
 
 class CheckInReportsFilter(django_filters.FilterSet):
-    """Filters for checkin report view."""
+    """Filters for checkin report view, evaluated against the daily totals."""
 
-    timestamp = django_filters.DateFromToRangeFilter(
+    timestamp = HalfOpenDateRangeFilter(
         label="Date range",
+        field_name="date",
     )
     grouping = GroupingMultipleChoiceFilter(
         label="Group by",
         choices=(
             ("tag__name", "Tag"),
-            ("timestamp__date", "Date"),
+            ("timestamp__date", "Day"),
+            ("week", "Week"),
+            ("month", "Month"),
         ),
         widget=forms.CheckboxSelectMultiple(),
     )
 
     class Meta:
-        model = CheckIn
+        model = DailyCheckInTotal
         fields = ["timestamp", "grouping"]
 
+    def get_totals(self):
+        """Return the daily totals within the filtered date range, before grouping."""
+        date_range = self.form.cleaned_data.get("timestamp")
+        return self.filters["timestamp"].filter(self.queryset.all(), date_range)
+
+    def get_date_range(self):
+        """Return the first and last day of the filtered date range, None where it is open."""
+        date_range = self.form.cleaned_data.get("timestamp")
+        if not date_range:
+            return None, None
+        start = timezone.localtime(date_range.start).date() if date_range.start is not None else None
+        end = timezone.localtime(date_range.stop).date() if date_range.stop is not None else None
+        return start, end
+
     @property
     def form(self):
         form = super().form
@@ -125,43 +180,32 @@ class CheckInReportsFilter(django_filters.FilterSet):
         return form
 
 
-class UserCheckInDateRangeFilter(django_filters.DateFromToRangeFilter):
-    """Custom filter for user check-ins and annotating total hours."""
+class CheckInAdminReportsFilter(CheckInReportsFilter):
+    """Filters for the report over all users' check-ins, which can also group by user."""
 
-    def filter(self, qs, value):
-        if not value:
-            return qs
+    grouping = GroupingMultipleChoiceFilter(
+        label="Group by",
+        choices=CheckInReportsFilter.base_filters["grouping"].extra["choices"] + (("user", "User"),),
+        widget=forms.CheckboxSelectMultiple(),
+    )
 
-        if value.start is not None and value.stop is not None:
-            self.lookup_expr = "range"
-            value = (value.start, value.stop)
-        elif value.start is not None:
-            self.lookup_expr = "gte"
-            value = value.start
-        elif value.stop is not None:
-            self.lookup_expr = "lte"
-            value = value.stop
-
-        lookup = "%s__%s" % (self.field_name, self.lookup_expr)
-
-        # filter checkins for user on date range and annotate total hours
-        # to user query
-        user_checkins_for_date_range = Subquery(
-            CheckIn.objects.filter(user=OuterRef("id"), **{lookup: value})
-            .order_by()
-            .values("user")
-            .annotate(total_hours=Sum("hours"))
-            .values("total_hours"),
-            output_field=DecimalField(),
-        )
-        return qs.annotate(total_hours=Coalesce(user_checkins_for_date_range, 0, output_field=DecimalField()))
+
+class UserCheckInDateRangeFilter(HalfOpenDateRangeFilter):
+    """
+    Date range of the daily totals summed into ``total_hours``. The sum is
+    annotated by `UserAdminFilter.filter_queryset`, so this filter leaves the
+    queryset alone.
+    """
+
+    def filter(self, qs, value):
+        return qs
 
 
 class UserAdminFilter(django_filters.FilterSet):
     """Filters for user list view for admins"""
 
     username = django_filters.CharFilter(label="Username", lookup_expr="icontains")
-    checkin_timestamp = UserCheckInDateRangeFilter(label="Checkin date range", field_name="timestamp")
+    checkin_timestamp = UserCheckInDateRangeFilter(label="Checkin date range", field_name="daily_totals__date")
     hours_logged = django_filters.RangeFilter(
         label="Hours logged range",
         field_name="total_hours",
@@ -171,6 +215,71 @@ class UserAdminFilter(django_filters.FilterSet):
         model = User
         fields = ["username"]
 
+    @property
+    def qs(self):
+        if not self.is_bound and not hasattr(self, "_qs"):
+            self._qs = self.annotate_total_hours(self.queryset.all())
+        return super().qs
+
+    def annotate_total_hours(self, queryset, date_range=None):
+        """
+        Annotate ``total_hours`` with one grouped aggregation over the daily
+        totals in ``date_range``. The username filter, the ``hours_logged``
+        range (as HAVING), sorting and pagination all work on that aggregate.
+        """
+        if date_range:
+            lookups = self.filters["checkin_timestamp"].get_range_lookups(date_range)
+            queryset = queryset.annotate(daily_totals_in_range=FilteredRelation("daily_totals", condition=Q(**lookups)))
+            hours = Sum("daily_totals_in_range__hours")
+        else:
+            hours = Sum("daily_totals__hours")
+        return queryset.annotate(total_hours=Coalesce(hours, 0, output_field=DecimalField()))
+
+    def filter_queryset(self, queryset):
+        queryset = self.annotate_total_hours(queryset, self.form.cleaned_data.get("checkin_timestamp"))
+        return super().filter_queryset(queryset)
+
+    def get_count_queryset(self):
+        """
+        Return the filtered users without ``total_hours`` for counting, or
+        None when the count depends on it (``hours_logged`` is set).
+        """
+        if not self.is_bound:
+            return self.queryset.all()
+        if not self.is_valid() or self.form.cleaned_data.get("hours_logged"):
+            return None
+        return super().filter_queryset(self.queryset.all())
+
+    def get_users_with_totals(self, databases):
+        """
+        Return the filtered users as a list, with ``total_hours`` summed from
+        the daily totals of each of ``databases``, for daily totals spread over
+        shards. Sorting and pagination then happen in Python.
+        """
+        cleaned_data = self.form.cleaned_data if self.is_bound and self.is_valid() else {}
+        users = self.filters["username"].filter(self.queryset.all(), cleaned_data.get("username"))
+        date_range = cleaned_data.get("checkin_timestamp")
+        lookups = self.filters["checkin_timestamp"].get_range_lookups(date_range) if date_range else {}
+        # the lookups of the filter go through the users' daily totals
+        lookups = {name.split("__", 1)[1]: value for name, value in lookups.items()}
+
+        hours = defaultdict(Decimal)
+        for db in databases:
+            totals = DailyCheckInTotal.objects.using(db).filter(**lookups).values("user_id").order_by()
+            for user_id, total in totals.annotate(total=Sum("hours")).values_list("user_id", "total"):
+                hours[user_id] += total
+
+        hours_logged = cleaned_data.get("hours_logged")
+        result = []
+        for user in users:
+            user.total_hours = hours[user.pk]
+            if hours_logged and hours_logged.start is not None and user.total_hours < hours_logged.start:
+                continue
+            if hours_logged and hours_logged.stop is not None and user.total_hours > hours_logged.stop:
+                continue
+            result.append(user)
+        return result
+
     @property
     def form(self):
         form = super().form
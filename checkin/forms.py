@@ -5,21 +5,44 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    router,
+    transaction,
+)
 from django.forms import models
+from django.urls import reverse_lazy
 from django.utils import timezone
 from django.utils.html import escape
 
-from checkin.models import (
-    CheckIn,
-    Tag,
+from checkin.cache import tag_ids
+from checkin.models import CheckIn
+from checkin.signals import record_checkin_changes
+
+
+CHECKIN_STRING_RE = re.compile(
+    r"(?P<hours>\d*\.?\d+) (hr|hrs) #(?P<tag>[a-z0-9]+(?:-[a-z0-9]+)*) (?P<activity>[a-zA-Z0-9_ ]*)"
 )
 
 
+def parse_checkin_string(checkin_string):
+    """Parse a ``<number> [hr | hrs] #<tag> <activities>`` string into its parts."""
+    if not checkin_string:
+        raise ValidationError("Check-in input is empty.")
+
+    # Match checkin input string into its own variables
+    m = CHECKIN_STRING_RE.match(checkin_string.lower())
+    if m is None:
+        raise ValidationError("Invalid check-in input string.")
+    return m.groupdict()
+
+
 class CheckInForm(models.ModelForm):
     """Form to create new check-ins"""
 
     checkin_string = forms.CharField(
-        help_text=escape("Use the following format: <number> [hr | hrs] #<tag> <activities>")
+        widget=forms.TextInput(attrs={"data-tag-autocomplete": reverse_lazy("checkin:TagAutocompleteApiView")}),
+        help_text=escape("Use the following format: <number> [hr | hrs] #<tag> <activities>"),
     )
 
     class Meta:
@@ -36,26 +59,71 @@ class CheckInForm(models.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         checkin_string = cleaned_data.pop("checkin_string", None)
-
-        if not checkin_string:
-            raise ValidationError("Check-in input is empty.")
-
-        checkin_string = checkin_string.lower()
-        # Match checkin input string into its own variables
-        m = re.match(
-            r"(?P<hours>\d*\.?\d+) (hr|hrs) #(?P<tag>[a-z0-9]+(?:-[a-z0-9]+)*) (?P<activity>[a-zA-Z0-9_ ]*)",
-            checkin_string,
-        )
-        if m is None:
-            raise ValidationError("Invalid check-in input string.")
-        self.cleaned_data.update(m.groupdict())
+        self.cleaned_data.update(parse_checkin_string(checkin_string))
         return self.cleaned_data
 
     def save(self, commit=True):
-        tag, _ = Tag.objects.get_or_create(name=self.cleaned_data["tag"])
         self.instance.user = self.user
         self.instance.timestamp = timezone.now()
         self.instance.activity = self.cleaned_data["activity"]
         self.instance.hours = Decimal(self.cleaned_data["hours"])
-        self.instance.tag = tag
+        self.instance.tag_id = tag_ids.get_id(self.cleaned_data["tag"])
         return super().save(commit)
+
+
+class CheckInBatchForm(forms.Form):
+    """Form to create several check-ins at once, one per line"""
+
+    checkin_lines = forms.CharField(
+        widget=forms.Textarea(
+            attrs={"rows": 8, "data-tag-autocomplete": reverse_lazy("checkin:TagAutocompleteApiView")}
+        ),
+        help_text=escape("One check-in per line, each in the format: <number> [hr | hrs] #<tag> <activities>"),
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop("user")
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper(self)
+        self.helper.form_show_labels = False
+        self.helper.add_input(Submit("submit", "Submit"))
+
+    def clean_checkin_lines(self):
+        entries = []
+        errors = []
+        for line_number, line in enumerate(self.cleaned_data["checkin_lines"].splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                entries.append(parse_checkin_string(line.strip()))
+            except ValidationError as e:
+                errors.extend(ValidationError(f"Line {line_number}: {message}") for message in e.messages)
+
+        if errors:
+            raise ValidationError(errors)
+        if not entries:
+            raise ValidationError("Check-in input is empty.")
+        return entries
+
+    def save(self):
+        entries = self.cleaned_data["checkin_lines"]
+        timestamp = timezone.now()
+        # the check-ins and their totals go to the user's shard, new tags to the default database; the
+        # batch commits or rolls back on both
+        using = router.db_for_write(CheckIn, instance=self.user)
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=using):
+            entry_tag_ids = tag_ids.get_ids(entry["tag"] for entry in entries)
+            checkins = CheckIn.objects.using(using).bulk_create(
+                [
+                    CheckIn(
+                        user=self.user,
+                        timestamp=timestamp,
+                        activity=entry["activity"],
+                        hours=Decimal(entry["hours"]),
+                        tag_id=entry_tag_ids[entry["tag"]],
+                    )
+                    for entry in entries
+                ]
+            )
+            record_checkin_changes(added=checkins, using=using)
+        return checkins
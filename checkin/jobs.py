@@ -0,0 +1,286 @@
+"""
+Background jobs for reports and exports too heavy for a request.
+
+Views hand the work to a `Job` with `enqueue_export` or
+`enqueue_admin_report` and send the user to the job's page, which polls its
+progress. ``manage.py run_workers`` runs the jobs in a pool of processes that
+claim the oldest pending job from the database, so no broker is needed. A
+job whose worker stops sending heartbeats is given to another worker, and
+finished jobs are reused by identical requests until they expire.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    close_old_connections,
+    connection,
+    transaction,
+)
+from django.db.models import (
+    F,
+    Q,
+)
+from django.http import QueryDict
+from django.utils import timezone
+
+from checkin.cache import get_data_version
+from checkin.exports import (
+    ADMIN_EXPORT_COLUMNS,
+    EXPORT_COLUMNS,
+    EXPORT_CONTENT_TYPES,
+    iter_export,
+)
+from checkin.filters import (
+    CheckInAdminFilter,
+    CheckInAdminReportsFilter,
+    CheckInFilter,
+)
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    Job,
+)
+from checkin.reports import (
+    build_chart_data,
+    build_merged_chart_data,
+)
+from checkin.routers import (
+    current_replica,
+    lag_monitor,
+)
+from checkin.shards import (
+    get_read_databases,
+    is_sharded,
+    shard_for_user,
+    use_shard,
+)
+
+
+ExportScope = namedtuple("ExportScope", ["filterset_class", "get_queryset", "columns", "filename", "per_user"])
+
+EXPORT_SCOPES = {
+    "my": ExportScope(CheckInFilter, lambda user: CheckIn.objects.filter(user=user), EXPORT_COLUMNS, "checkins", True),
+    "admin": ExportScope(
+        CheckInAdminFilter, lambda user: CheckIn.objects.all(), ADMIN_EXPORT_COLUMNS, "all-checkins", False
+    ),
+}
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def get_query(request, ignore=("format",)):
+    """Return the request's query parameters as a JSON-serializable ``{name: [values]}``."""
+    return {name: values for name, values in request.GET.lists() if name not in ignore}
+
+
+def to_query_dict(query):
+    data = QueryDict(mutable=True)
+    for name, values in query.items():
+        data.setlist(name, values)
+    return data
+
+
+def enqueue(user, kind, params, version="", max_age=None):
+    """
+    Return a pending, running or finished job of ``user`` for ``kind`` and
+    ``params``, creating one unless an identical job is queued or finished
+    within ``max_age`` seconds (default ``CHECKIN_JOB_RESULT_TIMEOUT``).
+    Pass the data ``version`` the result depends on to reuse it exactly as
+    long as the data is unchanged.
+    """
+    key = hashlib.md5(json.dumps([user.pk, kind, params, version], sort_keys=True).encode()).hexdigest()
+    max_age = settings.CHECKIN_JOB_RESULT_TIMEOUT if max_age is None else max_age
+    # job state changes under the workers, read it where it is written
+    jobs = Job.objects.using(DEFAULT_DB_ALIAS)
+    job = (
+        jobs.filter(key=key)
+        .filter(
+            Q(status__in=[Job.PENDING, Job.RUNNING])
+            | Q(status=Job.DONE, finished__gte=timezone.now() - datetime.timedelta(seconds=max_age))
+        )
+        .order_by("-created")
+        .first()
+    )
+    if job is None:
+        job = jobs.create(user=user, kind=kind, params=params, key=key)
+    return job
+
+
+def enqueue_export(user, scope, query, export_format):
+    """Queue an export of the check-ins of ``scope`` (see `EXPORT_SCOPES`) filtered by ``query``."""
+    if EXPORT_SCOPES[scope].per_user:
+        version, max_age = get_data_version(user.pk), None
+    else:
+        version, max_age = "", settings.CHECKIN_JOB_SHARED_RESULT_MAX_AGE
+    params = {"scope": scope, "query": query, "format": export_format}
+    return enqueue(user, "export", params, version, max_age)
+
+
+def enqueue_admin_report(user, query):
+    """Queue the chart data of the reports over all users, filtered and grouped by ``query``."""
+    return enqueue(user, "admin_report", {"query": query}, max_age=settings.CHECKIN_JOB_SHARED_RESULT_MAX_AGE)
+
+
+def set_progress(job, fraction):
+    """Record that ``fraction`` (0 to 1) of ``job`` is done, when that moved it by a percent."""
+    progress = min(99, max(0, int(fraction * 100)))
+    if progress != job.progress:
+        job.progress = progress
+        Job.objects.filter(pk=job.pk).update(progress=progress)
+
+
+def get_result_path(job):
+    return os.path.join(settings.CHECKIN_JOB_RESULT_DIR, job.result["file"])
+
+
+def run_export(job):
+    scope = EXPORT_SCOPES[job.params["scope"]]
+    export_format = job.params["format"]
+    filterset = scope.filterset_class(to_query_dict(job.params["query"]), queryset=scope.get_queryset(job.user))
+    queryset = filterset.qs.order_by("timestamp", "pk")
+    # exports over all users read every shard
+    databases = get_read_databases() if is_sharded() and not scope.per_user else None
+    total = sum(queryset.using(db).count() for db in databases) if databases else queryset.count()
+
+    os.makedirs(settings.CHECKIN_JOB_RESULT_DIR, exist_ok=True)
+    filename = f"{job.pk}.{export_format}"
+    path = os.path.join(settings.CHECKIN_JOB_RESULT_DIR, filename)
+    with open(f"{path}.part", "w", newline="") as f:
+        chunks = iter_export(queryset, scope.columns, export_format, EXPORT_CHUNK_SIZE, databases)
+        for number, chunk in enumerate(chunks):
+            f.write(chunk)
+            set_progress(job, number * EXPORT_CHUNK_SIZE / max(total, 1))
+    os.replace(f"{path}.part", path)
+    return {
+        "file": filename,
+        "filename": f"{scope.filename}.{export_format}",
+        "content_type": EXPORT_CONTENT_TYPES[export_format],
+        "rows": total,
+    }
+
+
+def run_admin_report(job):
+    filterset = CheckInAdminReportsFilter(to_query_dict(job.params["query"]), queryset=DailyCheckInTotal.objects.all())
+    if not filterset.is_valid():
+        raise ValueError(filterset.errors.as_json())
+    start, end = filterset.get_date_range()
+    grouping = filterset.form.cleaned_data.get("grouping", [])
+    if is_sharded():
+        return build_merged_chart_data(filterset.get_totals(), grouping, get_read_databases(), start, end)
+    return build_chart_data(filterset.get_totals(), grouping, start, end)
+
+
+# kind: function computing the JSON result of a job, every kind only reads check-in data
+JOB_KINDS = {
+    "export": run_export,
+    "admin_report": run_admin_report,
+}
+
+
+def claim_job():
+    """Mark the oldest pending job as running and return it, None when there is none."""
+    with transaction.atomic():
+        # other workers skip the locked row instead of waiting for it (PostgreSQL)
+        job = Job.objects.select_for_update(skip_locked=True).filter(status=Job.PENDING).order_by("created").first()
+        if job is None:
+            return None
+        now = timezone.now()
+        # the status condition keeps two workers from claiming one job where rows cannot be locked
+        claimed = Job.objects.filter(pk=job.pk, status=Job.PENDING).update(
+            status=Job.RUNNING, progress=0, started=now, heartbeat=now, attempts=F("attempts") + 1
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def send_heartbeats(job_id, stop):
+    """Keep the running job's heartbeat fresh until ``stop`` is set, also during long queries."""
+    interval = settings.CHECKIN_JOB_STALE_AFTER / 4
+    try:
+        while not stop.wait(interval):
+            Job.objects.filter(pk=job_id, status=Job.RUNNING).update(heartbeat=timezone.now())
+    finally:
+        connection.close()
+
+
+def run_job(job):
+    """Run ``job`` and store its result or error, return whether it succeeded."""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=send_heartbeats, args=(job.pk, stop), daemon=True)
+    heartbeat.start()
+    # jobs only read check-ins, a replica serves them when one is in sync
+    token = current_replica.set(lag_monitor.choose_replica())
+    try:
+        with use_shard(shard_for_user(job.user_id)):
+            result = JOB_KINDS[job.kind](job)
+    except Exception:
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, error=traceback.format_exc(), finished=timezone.now())
+        return False
+    else:
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE, progress=100, result=result, finished=timezone.now())
+        return True
+    finally:
+        current_replica.reset(token)
+        stop.set()
+        heartbeat.join()
+
+
+def requeue_stale_jobs():
+    """Give running jobs without a recent heartbeat to another worker, or fail them after the last attempt."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING, heartbeat__lt=now - datetime.timedelta(seconds=settings.CHECKIN_JOB_STALE_AFTER)
+    )
+    stale.filter(attempts__lt=settings.CHECKIN_JOB_MAX_ATTEMPTS).update(status=Job.PENDING)
+    stale.update(status=Job.FAILED, error="The worker running the job stopped.", finished=now)
+
+
+def delete_expired_jobs():
+    """Delete finished jobs older than ``CHECKIN_JOB_RESULT_TIMEOUT`` and their files."""
+    expired = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED],
+        finished__lt=timezone.now() - datetime.timedelta(seconds=settings.CHECKIN_JOB_RESULT_TIMEOUT),
+    )
+    for job in expired.filter(kind="export", status=Job.DONE):
+        try:
+            os.remove(get_result_path(job))
+        except FileNotFoundError:
+            pass
+    expired.delete()
+
+
+def run_worker(stop=None, poll_interval=None, exit_when_idle=False, log=None):
+    """
+    Run pending jobs one after the other until ``stop`` (a ``threading`` or
+    ``multiprocessing`` event) is set, or until no job is pending when
+    ``exit_when_idle``. Idle workers requeue stale jobs and delete expired ones.
+    """
+    poll_interval = settings.CHECKIN_JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        job = claim_job()
+        if job is None:
+            requeue_stale_jobs()
+            delete_expired_jobs()
+            if exit_when_idle:
+                return
+            if stop is None:
+                time.sleep(poll_interval)
+            else:
+                stop.wait(poll_interval)
+            continue
+
+        start = time.monotonic()
+        succeeded = run_job(job)
+        if log is not None:
+            log(f"{job.kind} job {job.pk} {'done' if succeeded else 'failed'} in {time.monotonic() - start:.1f}s")
@@ -0,0 +1,321 @@
+import contextlib
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connection,
+    transaction,
+)
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from checkin import urls as checkin_urls
+from checkin.metrics import (
+    QueryCollector,
+    current_collector,
+)
+from checkin.models import (
+    CheckIn,
+    Job,
+    Tag,
+)
+from checkin.shards import (
+    get_most_active_user,
+    get_shards,
+    shard_for_user,
+    use_shard,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every check-in view and the filter/table combinations through the Django test client, "
+        "recording latency and query counts. Run it against a seeded database (see seed_checkins). "
+        "Results can be written as JSON and compared with a previous run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="User for the personal views. Defaults to the most active user.")
+        parser.add_argument("--admin", help="Superuser for the admin views. Defaults to the first superuser.")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed requests per scenario.")
+        parser.add_argument("--only", nargs="*", default=None, help="Only run scenarios starting with these names.")
+        parser.add_argument(
+            "--cold-cache",
+            action="store_true",
+            help="Clear the cache before every request so cached report data is recomputed.",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="JSON results of a previous run to compare with.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help="Fail when a scenario's median is this fraction slower than in --compare, or issues more queries.",
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        admin = self.get_admin(options["admin"])
+        self.shard = shard_for_user(user.pk)
+        with use_shard(self.shard):
+            scenarios = self.get_scenarios(user)
+        if options["only"] is not None:
+            scenarios = [s for s in scenarios if any(s["name"].startswith(prefix) for prefix in options["only"])]
+
+        clients = {
+            "anonymous": self.get_client(),
+            "user": self.get_client(user),
+            "admin": self.get_client(admin),
+        }
+
+        results = {}
+        for scenario in scenarios:
+            results[scenario["name"]] = self.run_scenario(clients[scenario["client"]], scenario, options)
+            result = results[scenario["name"]]
+            self.stdout.write(
+                f"{scenario['name']:45} {result['status']:>4} {result['median_ms']:>9.2f} ms "
+                f"{result['p95_ms']:>9.2f} ms p95 {result['queries']:>4} queries"
+            )
+
+        report = {"meta": self.get_meta(user, admin), "results": results}
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        if options["compare"]:
+            self.compare(report, options["compare"], options["threshold"])
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user = get_most_active_user()
+        if user is None:
+            raise CommandError("No users found. Seed the database first.")
+        return user
+
+    def get_admin(self, username):
+        if username:
+            return User.objects.get(username=username, is_superuser=True)
+        admin = User.objects.filter(is_superuser=True).order_by("pk").first()
+        if admin is None:
+            raise CommandError("No superuser found. Seed the database first.")
+        return admin
+
+    def get_client(self, user=None):
+        hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"]
+        client = Client(HTTP_HOST=hosts[0] if hosts else "localhost")
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def get_scenarios(self, user):
+        """Return the requests to time, covering every URL in checkin/urls.py."""
+        today = timezone.localdate()
+        date_range = {
+            "timestamp_after": (today - datetime.timedelta(days=30)).strftime("%m/%d/%Y"),
+            "timestamp_before": today.strftime("%m/%d/%Y"),
+        }
+        checkin = CheckIn.objects.filter(user=user).order_by("-timestamp").first()
+        tag = Tag.objects.filter(checkins__user=user).first()
+        activity_word = checkin.activity.split()[0] if checkin and checkin.activity else "review"
+
+        def scenario(name, url_name, client="user", data=None, args=None, method="get"):
+            return {
+                "name": name,
+                "url_name": url_name,
+                "client": client,
+                "data": data or {},
+                "args": args,
+                "method": method,
+            }
+
+        scenarios = [
+            scenario("HomeView", "HomeView", client="anonymous"),
+            scenario("RegisterView", "RegisterView", client="anonymous"),
+            scenario("CheckinHomeView", "CheckinHomeView"),
+            scenario(
+                "CheckinHomeView:post",
+                "CheckinHomeView",
+                # one of the user's tags, a new one would be created and rolled back on every run
+                data={"checkin_string": f"1 hr #{tag.name if tag else 'benchmark'} timing the check-in form"},
+                method="post",
+            ),
+            scenario("CheckinBatchView", "CheckinBatchView"),
+            scenario("MyCheckinView", "MyCheckinView"),
+            scenario("MyCheckinView:per_page=500", "MyCheckinView", data={"per_page": 500}),
+            scenario("MyCheckinView:sort=-hours", "MyCheckinView", data={"sort": "-hours"}),
+            scenario("MyCheckinView:sort=tag", "MyCheckinView", data={"sort": "tag"}),
+            scenario("MyCheckinView:date_range", "MyCheckinView", data=date_range),
+            scenario("MyCheckinView:activity", "MyCheckinView", data={"activity": activity_word}),
+            scenario("MyCheckinExportView", "MyCheckinExportView", data=date_range),
+            scenario("MyReportsView", "MyReportsView"),
+            scenario("MyReportsView:grouping=tag", "MyReportsView", data={"grouping": ["tag__name"]}),
+            scenario("MyReportsView:grouping=date", "MyReportsView", data={"grouping": ["timestamp__date"]}),
+            scenario(
+                "MyReportsView:grouping=tag,date:date_range",
+                "MyReportsView",
+                data=dict(date_range, grouping=["tag__name", "timestamp__date"]),
+            ),
+            scenario("CheckInListAdminView", "CheckInListAdminView", client="admin"),
+            scenario(
+                "CheckInListAdminView:per_page=500", "CheckInListAdminView", client="admin", data={"per_page": 500}
+            ),
+            scenario("CheckInListAdminView:sort=user", "CheckInListAdminView", client="admin", data={"sort": "user"}),
+            scenario(
+                "CheckInListAdminView:user:date_range",
+                "CheckInListAdminView",
+                client="admin",
+                data=dict(date_range, user=user.username),
+            ),
+            scenario(
+                "CheckInListAdminView:activity",
+                "CheckInListAdminView",
+                client="admin",
+                data={"activity": activity_word},
+            ),
+            scenario(
+                "CheckInExportAdminView:user",
+                "CheckInExportAdminView",
+                client="admin",
+                data={"user": user.username},
+            ),
+            scenario("ReportsAdminView", "ReportsAdminView", client="admin"),
+            scenario("ReportsAdminView:grouping=user", "ReportsAdminView", client="admin", data={"grouping": ["user"]}),
+            scenario("UserListAdminView", "UserListAdminView", client="admin"),
+            scenario(
+                "UserListAdminView:sort=-total_hours",
+                "UserListAdminView",
+                client="admin",
+                data={"sort": "-total_hours"},
+            ),
+            scenario(
+                "UserListAdminView:date_range:hours_logged",
+                "UserListAdminView",
+                client="admin",
+                data={
+                    "checkin_timestamp_after": date_range["timestamp_after"],
+                    "checkin_timestamp_before": date_range["timestamp_before"],
+                    "hours_logged_min": 1,
+                },
+            ),
+            scenario("MetricsView", "MetricsView", client="admin"),
+            scenario("CheckInListApiView", "CheckInListApiView"),
+            scenario("CheckInListApiView:date_range", "CheckInListApiView", data=date_range),
+            scenario("ReportsApiView:grouping=tag", "ReportsApiView", data={"grouping": ["tag__name"]}),
+            scenario("TagAutocompleteApiView", "TagAutocompleteApiView", data={"prefix": "t"}),
+        ]
+        if tag is not None:
+            scenarios.append(scenario("MyCheckinView:tag", "MyCheckinView", data={"tag": tag.pk}))
+        if checkin is not None:
+            scenarios.append(scenario("DeleteCheckinView", "DeleteCheckinView", args=[checkin.pk]))
+            scenarios.append(scenario("CheckInDetailApiView", "CheckInDetailApiView", args=[checkin.pk]))
+        job = Job.objects.filter(user=user).order_by("-created").first()
+        if job is not None:
+            scenarios.append(scenario("JobDetailView", "JobDetailView", args=[job.pk]))
+            scenarios.append(scenario("JobStatusView", "JobStatusView", args=[job.pk]))
+            if job.kind == "export" and job.status == Job.DONE:
+                scenarios.append(scenario("JobDownloadView", "JobDownloadView", args=[job.pk]))
+
+        covered = {s["url_name"] for s in scenarios}
+        for pattern in checkin_urls.urlpatterns:
+            if pattern.name not in covered:
+                self.stderr.write(f"No benchmark scenario for {pattern.name}.")
+        return scenarios
+
+    def run_scenario(self, client, scenario, options):
+        url = reverse(f"checkin:{scenario['url_name']}", args=scenario["args"])
+        timings = []
+        queries = 0
+        status = None
+        # one untimed request to warm up connections, templates and caches
+        for run in range(options["repeat"] + 1):
+            if options["cold_cache"]:
+                cache.clear()
+            # counts the queries of all threads, the async views run theirs concurrently
+            collector = QueryCollector()
+            token = current_collector.set(collector)
+            try:
+                # posts are rolled back so the benchmark leaves the database, and the user's shard, as it was
+                databases = {DEFAULT_DB_ALIAS, self.shard} if scenario["method"] == "post" else set()
+                with contextlib.ExitStack() as transactions:
+                    for alias in databases:
+                        transactions.enter_context(transaction.atomic(using=alias))
+                    start = time.perf_counter()
+                    response = getattr(client, scenario["method"])(url, scenario["data"])
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                    elapsed = (time.perf_counter() - start) * 1000
+                    for alias in databases:
+                        transaction.set_rollback(True, using=alias)
+            finally:
+                current_collector.reset(token)
+            if run:
+                timings.append(elapsed)
+            queries = collector.count
+            status = response.status_code
+
+        timings.sort()
+        return {
+            "status": status,
+            "queries": queries,
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "min_ms": round(timings[0], 3),
+            "runs": len(timings),
+        }
+
+    def get_meta(self, user, admin):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=settings.BASE_DIR
+            ).stdout.strip()
+        except OSError:
+            commit = ""
+        return {
+            "commit": commit,
+            "vendor": connection.vendor,
+            "python": platform.python_version(),
+            "created": timezone.now().isoformat(),
+            "user": user.username,
+            "admin": admin.username,
+            "users": User.objects.count(),
+            "checkins": sum(CheckIn.objects.using(alias).count() for alias in get_shards()),
+        }
+
+    def compare(self, report, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = []
+        for name, result in report["results"].items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            ratio = result["median_ms"] / previous["median_ms"] if previous["median_ms"] else 1
+            self.stdout.write(
+                f"{name:45} {previous['median_ms']:>9.2f} -> {result['median_ms']:>9.2f} ms ({ratio - 1:+.0%}), "
+                f"{previous['queries']} -> {result['queries']} queries"
+            )
+            if ratio > 1 + threshold:
+                regressions.append(f"{name} is {ratio - 1:.0%} slower")
+            if result["queries"] > previous["queries"]:
+                regressions.append(f"{name} issues {result['queries'] - previous['queries']} more queries")
+
+        if regressions:
+            raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions."))
@@ -0,0 +1,56 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from checkin.models import CheckIn
+from checkin.search import search_activity
+
+
+class Command(BaseCommand):
+    help = "Compare activity search through the search index with the plain icontains lookup."
+
+    def add_arguments(self, parser):
+        parser.add_argument("terms", nargs="+", help="Search terms to time.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per term and search mode.")
+        parser.add_argument("--page-size", type=int, default=10, help="Rows fetched per search, like a table page.")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        modes = {
+            "icontains": lambda term: CheckIn.objects.filter(activity__icontains=term),
+            "indexed": lambda term: search_activity(CheckIn.objects.all(), term),
+        }
+
+        results = []
+        for term in options["terms"]:
+            for mode, search in modes.items():
+                timings = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    rows = list(search(term).order_by("-timestamp", "-pk")[: options["page_size"]])
+                    matches = search(term).count()
+                    timings.append((time.perf_counter() - start) * 1000)
+                results.append(
+                    {
+                        "term": term,
+                        "mode": mode,
+                        "rows": len(rows),
+                        "matches": matches,
+                        "median_ms": round(statistics.median(timings), 2),
+                        "max_ms": round(max(timings), 2),
+                    }
+                )
+
+        if options["json"]:
+            self.stdout.write(json.dumps({"vendor": connection.vendor, "results": results}, indent=2))
+            return
+
+        self.stdout.write(f"{'term':20} {'mode':10} {'matches':>10} {'median ms':>10} {'max ms':>10}")
+        for result in results:
+            self.stdout.write(
+                f"{result['term']:20} {result['mode']:10} {result['matches']:>10} "
+                f"{result['median_ms']:>10} {result['max_ms']:>10}"
+            )
@@ -0,0 +1,131 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connections
+from django.test import RequestFactory
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+)
+from django_tables2 import RequestConfig
+
+from checkin.shards import (
+    get_most_active_user,
+    shard_for_user,
+    use_shard,
+)
+from checkin.tables import (
+    AdminCheckInTable,
+    MyCheckInTable,
+    TodayCheckInTable,
+)
+from checkin.views import (
+    CheckInListAdminView,
+    MyCheckinView,
+)
+
+
+# template loaders without the cached loader, every render reads and parses the templates again
+UNCACHED_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time rendering the check-in tables over pages of --rows check-ins, with the configured template "
+        "loaders and without template caching. Rows are fetched once with the views' querysets, so only "
+        "rendering is timed, along with the queries the first render issues. Run it against a seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="User whose check-ins are rendered. Defaults to the most active user.")
+        parser.add_argument("--rows", type=int, default=500, help="Rows per rendered page.")
+        parser.add_argument("--repeat", type=int, default=10, help="Timed renders per table and loader setup.")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        request = RequestFactory().get("/", {"per_page": options["rows"]})
+        request.user = user
+        # rows, and what rendering loads for them, come from the user's shard
+        self.shard = shard_for_user(user.pk)
+        with use_shard(self.shard):
+            my_rows = self.get_rows(MyCheckinView, request, options["rows"])
+            admin_rows = self.get_rows(CheckInListAdminView, request, options["rows"])
+        tables = {
+            "TodayCheckInTable": (TodayCheckInTable, my_rows),
+            "MyCheckInTable": (MyCheckInTable, my_rows),
+            "AdminCheckInTable": (AdminCheckInTable, admin_rows),
+        }
+        loaders = {
+            "configured": settings.TEMPLATES,
+            "uncached": [dict(settings.TEMPLATES[0], APP_DIRS=False, OPTIONS=self.uncached_options())],
+        }
+
+        results = []
+        for loader, templates in loaders.items():
+            # replaces the template engines, and with them their caches
+            with override_settings(TEMPLATES=templates):
+                for name, (table_class, rows) in tables.items():
+                    results.append(
+                        dict(self.time_table(table_class, rows, request, options), table=name, loader=loader)
+                    )
+
+        if options["json"]:
+            self.stdout.write(json.dumps({"vendor": connections[self.shard].vendor, "results": results}, indent=2))
+            return
+
+        self.stdout.write(f"{'table':20} {'loader':12} {'rows':>6} {'median ms':>10} {'max ms':>10} {'queries':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['table']:20} {result['loader']:12} {result['rows']:>6} "
+                f"{result['median_ms']:>10} {result['max_ms']:>10} {result['queries']:>8}"
+            )
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user = get_most_active_user()
+        if user is None:
+            raise CommandError("No users found. Seed the database first.")
+        return user
+
+    def get_rows(self, view_class, request, rows):
+        view = view_class()
+        view.setup(request)
+        return list(view.get_queryset().filter(user=request.user).order_by("-timestamp", "-pk")[:rows])
+
+    def uncached_options(self):
+        return dict(settings.TEMPLATES[0]["OPTIONS"], loaders=UNCACHED_LOADERS)
+
+    def time_table(self, table_class, rows, request, options):
+        timings = []
+        queries = 0
+        # one untimed render to warm up the template engine
+        for run in range(options["repeat"] + 1):
+            with CaptureQueriesContext(connections[self.shard]) as captured, use_shard(self.shard):
+                start = time.perf_counter()
+                table = table_class(rows)
+                RequestConfig(request, paginate={"per_page": options["rows"]}).configure(table)
+                html = table.as_html(request)
+                elapsed = (time.perf_counter() - start) * 1000
+            if run:
+                timings.append(elapsed)
+            # the first render loads what the rows lack and caches it on them
+            queries = max(queries, len(captured))
+        return {
+            "rows": len(rows),
+            "bytes": len(html),
+            "median_ms": round(statistics.median(timings), 2),
+            "max_ms": round(max(timings), 2),
+            "queries": queries,
+        }
@@ -0,0 +1,144 @@
+import datetime
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models import (
+    Count,
+    Max,
+    Sum,
+)
+from django.utils import timezone
+
+from checkin import partitions
+from checkin.models import CheckIn
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the check-in table to monthly partitions, create a partition for rows waiting in the default "
+        "partition and detach the oldest partition, checking the rows, indexes and constraints after every step, "
+        "then roll everything back. Run it on a copy of the production database: it holds the table's locks "
+        "until it is done."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=2, help="Partitions created ahead by convert.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+        if partitions.is_partitioned():
+            raise CommandError(f"{partitions.TABLE} is already partitioned, run this on an unpartitioned copy.")
+        if not CheckIn.objects.exists():
+            raise CommandError("The check-in table is empty, seed it first (see seed_checkins).")
+
+        try:
+            with transaction.atomic():
+                self.check_convert(options["months_ahead"])
+                self.check_create(options["months_ahead"])
+                self.check_detach()
+                raise Rollback
+        except Rollback:
+            pass
+        if partitions.is_partitioned():
+            raise CommandError(f"{partitions.TABLE} is still partitioned after the rollback.")
+        self.stdout.write(self.style.SUCCESS("convert, create and detach work, everything was rolled back."))
+
+    def get_totals(self):
+        return CheckIn.objects.aggregate(count=Count("id"), hours=Sum("hours"), max_id=Max("id"))
+
+    def get_schema(self):
+        """Names of the check-in table's indexes and foreign keys, and its id sequence."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [partitions.TABLE])
+            indexes = {row[0] for row in cursor.fetchall()}
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                [partitions.TABLE],
+            )
+            foreign_keys = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [partitions.TABLE])
+            sequence = cursor.fetchone()[0]
+        return indexes, foreign_keys, sequence
+
+    def check_convert(self, months_ahead):
+        totals = self.get_totals()
+        indexes, foreign_keys, sequence = self.get_schema()
+        partitions.convert_to_partitioned(months_ahead)
+
+        if not partitions.is_partitioned():
+            raise CommandError("convert left the table unpartitioned.")
+        if self.get_totals() != totals:
+            raise CommandError(f"convert changed the rows: {totals} != {self.get_totals()}.")
+        new_indexes, new_foreign_keys, new_sequence = self.get_schema()
+        if new_indexes != indexes:
+            raise CommandError(f"convert changed the indexes: {sorted(indexes ^ new_indexes)}.")
+        if new_foreign_keys != foreign_keys:
+            raise CommandError(f"convert changed the foreign keys: {sorted(foreign_keys ^ new_foreign_keys)}.")
+        if new_sequence != sequence:
+            raise CommandError(f"convert left the id sequence {new_sequence}, not {sequence}.")
+
+        # new rows keep taking ids from the sequence
+        checkin = CheckIn.objects.order_by("pk").first()
+        copy = CheckIn.objects.bulk_create(
+            [CheckIn(user_id=checkin.user_id, tag_id=checkin.tag_id, hours=checkin.hours, timestamp=checkin.timestamp)]
+        )[0]
+        if copy.pk <= totals["max_id"]:
+            raise CommandError(f"A check-in inserted after convert got id {copy.pk}, not above {totals['max_id']}.")
+        monthly, has_default = partitions.get_partitions()
+        self.stdout.write(f"convert: {totals['count']} rows in {len(monthly)} monthly partitions.")
+        if not has_default:
+            raise CommandError("convert created no default partition.")
+
+    def check_create(self, months_ahead):
+        # a month past the partitions convert created, its rows land in the default partition
+        month = partitions.add_months(partitions.month_start(timezone.localdate()), months_ahead + 2)
+        timestamp = partitions.partition_bounds(month)[0] + datetime.timedelta(hours=12)
+        checkin = CheckIn.objects.order_by("pk").first()
+        stranded = CheckIn.objects.bulk_create(
+            [CheckIn(user_id=checkin.user_id, tag_id=checkin.tag_id, hours=checkin.hours, timestamp=timestamp)]
+        )[0]
+        if self.count_rows(partitions.DEFAULT_PARTITION, stranded.pk) != 1:
+            raise CommandError("A check-in past the partitions did not land in the default partition.")
+
+        name = partitions.create_partition(month)
+        if partitions.get_partitions()[0].get(month) != name:
+            raise CommandError(f"create did not attach {name}.")
+        if self.count_rows(name, stranded.pk) != 1 or self.count_rows(partitions.DEFAULT_PARTITION, stranded.pk):
+            raise CommandError(f"create did not move the default partition's rows of {month:%Y-%m} to {name}.")
+        if not partitions.get_partitions()[1]:
+            raise CommandError("create did not reattach the default partition.")
+        self.stdout.write(f"create: {name} took over its rows from the default partition.")
+
+    def check_detach(self):
+        monthly, _ = partitions.get_partitions()
+        month, name = min(monthly.items())
+        count = self.get_totals()["count"]
+        rows = self.count_rows(name)
+        partitions.detach_partition(name)
+
+        if month in partitions.get_partitions()[0]:
+            raise CommandError(f"detach left {name} attached.")
+        if self.get_totals()["count"] != count - rows:
+            raise CommandError(f"The table still lists rows of the detached {name}.")
+        if self.count_rows(name) != rows:
+            raise CommandError(f"The detached {name} lost rows.")
+        self.stdout.write(f"detach: {name} detached with its {rows} rows.")
+
+    def count_rows(self, table, pk=None):
+        with connection.cursor() as cursor:
+            if pk is None:
+                cursor.execute(f"SELECT count(*) FROM {partitions.quote(table)}")
+            else:
+                cursor.execute(f"SELECT count(*) FROM {partitions.quote(table)} WHERE id = %s", [pk])
+            return cursor.fetchone()[0]
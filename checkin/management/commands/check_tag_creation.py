@@ -0,0 +1,71 @@
+import random
+import threading
+import uuid
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connection
+
+from checkin.cache import TagIdCache
+from checkin.models import Tag
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the same new tags from many threads at once, the way concurrent check-ins do, and fail unless "
+        "every thread succeeded, got the same ids and each tag has exactly one row. Run it against PostgreSQL, "
+        "where the inserts race into the ON CONFLICT path. The tags are deleted afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Threads creating the tags at once.")
+        parser.add_argument("--tags", type=int, default=50, help="New tags per round.")
+        parser.add_argument("--rounds", type=int, default=5, help="Rounds of new tags.")
+        parser.add_argument("--keep", action="store_true", help="Keep the created tags.")
+
+    def handle(self, *args, **options):
+        prefix = f"tag-race-{uuid.uuid4().hex[:8]}-"
+        try:
+            for round_number in range(options["rounds"]):
+                names = [f"{prefix}{round_number}-{index}" for index in range(options["tags"])]
+                self.run_round(names, options["threads"])
+                self.stdout.write(f"Round {round_number + 1}: {len(names)} tags from {options['threads']} threads.")
+        finally:
+            if not options["keep"]:
+                Tag.objects.filter(name__startswith=prefix).delete()
+        self.stdout.write(self.style.SUCCESS("No errors, one row per tag."))
+
+    def run_round(self, names, thread_count):
+        barrier = threading.Barrier(thread_count)
+        results = [None] * thread_count
+        errors = []
+
+        def create(index):
+            # a cache per thread, so no thread skips the insert because another one already cached the ids
+            cache = TagIdCache(len(names))
+            shuffled = random.sample(names, len(names))
+            try:
+                barrier.wait()
+                results[index] = cache.get_ids(shuffled)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=(index,)) for index in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise CommandError(f"{len(errors)} of {thread_count} threads failed, e.g. {errors[0]}")
+        rows = dict(Tag.objects.filter(name__in=names).values_list("name", "id"))
+        row_count = Tag.objects.filter(name__in=names).count()
+        if row_count != len(names) or rows.keys() != set(names):
+            raise CommandError(f"{row_count} rows for {len(names)} tags.")
+        differing = sum(result != rows for result in results)
+        if differing:
+            raise CommandError(f"{differing} of {thread_count} threads got ids that differ from the stored tags.")
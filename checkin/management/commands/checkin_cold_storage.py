@@ -0,0 +1,181 @@
+import contextlib
+import datetime
+import os
+import shutil
+
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import transaction
+from django.utils import timezone
+
+from checkin.coldstore import (
+    default_cutoff,
+    get_cold_store,
+)
+from checkin.models import (
+    CheckIn,
+    Tag,
+)
+from checkin.partitions import (
+    add_months,
+    month_start,
+    partition_bounds,
+)
+from checkin.shards import (
+    chunked,
+    group_by_shard,
+)
+
+
+ROW_FIELDS = ("id", "user_id", "tag_id", "timestamp", "created", "modified", "hours", "activity")
+
+
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Invalid month {value!r}, expected YYYY-MM.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Move check-ins of whole months out of the check-in table into column files in "
+        "CHECKIN_COLD_STORAGE_DIR ('archive'), move them back ('restore'), or list the stored months ('status'). "
+        "Daily totals keep covering archived check-ins, so reports and user totals do not change, and "
+        "rebuild_checkin_totals reads the cold store as well."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=("status", "archive", "restore"))
+        parser.add_argument(
+            "--before",
+            help="Archive the months before this one, as YYYY-MM. Defaults to the months older than "
+            "CHECKIN_COLD_STORAGE_AFTER_DAYS.",
+        )
+        parser.add_argument("--month", help="Month to restore, as YYYY-MM.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.store = get_cold_store()
+        if self.store is None:
+            raise CommandError("Set CHECKIN_COLD_STORAGE_DIR to use cold storage.")
+        getattr(self, options["action"])(options)
+
+    def status(self, options):
+        for month in self.store.months():
+            segments = self.store.segments(month)
+            self.stdout.write(f"{month:%Y-%m} {len(segments)} segments")
+
+    def archive(self, options):
+        self.recover_staged(options["batch_size"])
+        before = month_start(parse_month(options["before"])) if options["before"] else default_cutoff()
+        first = CheckIn.objects.filter(timestamp__lt=partition_bounds(before)[0]).order_by("timestamp").first()
+        if first is None:
+            self.stdout.write(self.style.SUCCESS(f"No check-ins before {before:%Y-%m}."))
+            return
+
+        month = month_start(timezone.localdate(first.timestamp))
+        archived = 0
+        while month < before:
+            archived += self.archive_month(month, options["batch_size"])
+            month = add_months(month, 1)
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} check-ins before {before:%Y-%m}."))
+
+    def archive_month(self, month, batch_size):
+        start, end = partition_bounds(month)
+        staged = None
+
+        def publish():
+            nonlocal staged
+            # published, or left staged for recover_staged if the rename fails, never removed from here on
+            segment, staged = staged, None
+            self.store.publish_segment(segment)
+
+        try:
+            with transaction.atomic():
+                checkins = CheckIn.objects.filter(timestamp__gte=start, timestamp__lt=end)
+                rows = list(checkins.select_for_update().values_list(*ROW_FIELDS))
+                if not rows:
+                    return 0
+
+                staged = self.store.stage_segment(month, rows)
+                ids = [row[0] for row in rows]
+                while ids:
+                    # a plain DELETE without the post_delete handlers, the daily totals keep the archived rows
+                    CheckIn.objects.filter(pk__in=ids[:batch_size])._raw_delete(CheckIn.objects.db)
+                    ids = ids[batch_size:]
+                # readers only see the segment once its rows are gone from the table
+                transaction.on_commit(publish)
+        finally:
+            # the transaction was rolled back or its commit failed, the rows are still in the table
+            if staged is not None:
+                shutil.rmtree(staged)
+
+        self.stdout.write(f"{month:%Y-%m}: {len(rows)} check-ins.")
+        return len(rows)
+
+    def recover_staged(self, batch_size):
+        """
+        Publish or remove the segments an interrupted archive run left staged.
+
+        The rows of a staged segment were deleted in one transaction, so the
+        segment is published when none of them is left in the check-in table.
+        """
+        for staged in self.store.staged_segments():
+            if os.path.exists(os.path.join(staged, "meta.json")):
+                ids = self.store.read_columns(staged, ["id"])["id"].tolist()
+                committed = not any(CheckIn.objects.filter(pk__in=chunk).exists() for chunk in chunked(ids, batch_size))
+            else:
+                committed = False
+            if committed:
+                self.stdout.write(f"Published the segment staged in {staged}.")
+                self.store.publish_segment(staged)
+            else:
+                self.stdout.write(f"Removed the segment staged in {staged}.")
+                shutil.rmtree(staged)
+
+    def restore(self, options):
+        if not options["month"]:
+            raise CommandError("restore needs --month YYYY-MM.")
+        month = parse_month(options["month"])
+        segments = self.store.segments(month)
+        if not segments:
+            raise CommandError(f"No check-ins of {month:%Y-%m} in cold storage.")
+
+        rows = [row for segment in segments for row in self.store.iter_rows(segment)]
+        # daily totals of deleted users and tags are gone or moved to untagged, do the same with their check-ins
+        user_ids = set(User.objects.filter(pk__in={row[1] for row in rows}).values_list("pk", flat=True))
+        tag_ids = set(Tag.objects.filter(pk__in={row[2] for row in rows}).values_list("pk", flat=True))
+        kept_rows = [row for row in rows if row[1] in user_ids]
+        checkins = []
+        for pk, user_id, tag_id, timestamp, created, modified, hours, activity in kept_rows:
+            checkin = CheckIn(
+                id=pk,
+                user_id=user_id,
+                tag_id=tag_id if tag_id in tag_ids else None,
+                timestamp=timestamp,
+                created=created,
+                modified=modified,
+                hours=hours,
+                activity=activity,
+            )
+            checkin.update_modified = False
+            checkins.append(checkin)
+
+        created = {row[0]: row[4] for row in kept_rows}
+        with contextlib.ExitStack() as transactions:
+            transactions.enter_context(transaction.atomic())
+            # back to the shard each user is on now, every shard commits before the files are removed
+            for using, shard_checkins in group_by_shard(checkins).items():
+                transactions.enter_context(transaction.atomic(using=using))
+                # bulk_create skips the post_save handlers, the daily totals already cover these rows
+                CheckIn.objects.using(using).bulk_create(shard_checkins, batch_size=options["batch_size"])
+                # created is auto_now_add and overwritten on insert, write the archived value back
+                for checkin in shard_checkins:
+                    checkin.created = created[checkin.pk]
+                CheckIn.objects.using(using).bulk_update(shard_checkins, ["created"], batch_size=options["batch_size"])
+            transaction.on_commit(lambda: self.store.remove_month(month))
+        self.stdout.write(self.style.SUCCESS(f"Restored {len(checkins)} check-ins of {month:%Y-%m}."))
@@ -0,0 +1,106 @@
+import datetime
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connections
+from django.utils import timezone
+
+from checkin.filters import (
+    CheckInAdminFilter,
+    CheckInFilter,
+    CheckInReportsFilter,
+    UserAdminFilter,
+)
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    UserTag,
+)
+from checkin.shards import (
+    get_most_active_user,
+    shard_for_user,
+    use_shard,
+)
+
+
+SEQUENTIAL_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on checkin_checkin\b"),
+    "sqlite": re.compile(r"SCAN checkin_checkin\b(?! USING)"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on the check-in list, report and filter queries and fail if any of them "
+        "falls back to a sequential scan of the check-in table. Run it against a seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Username to build the queries for. Defaults to the most active user.")
+        parser.add_argument("--days", type=int, default=30, help="Length of the date range filters in days.")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        today = timezone.localdate()
+        date_range = {
+            "timestamp_after": (today - datetime.timedelta(days=options["days"])).strftime("%m/%d/%Y"),
+            "timestamp_before": today.strftime("%m/%d/%Y"),
+        }
+        user_checkins = CheckIn.objects.filter(user=user)
+
+        querysets = {
+            "CheckinHomeView": user_checkins.for_date(today).select_related("tag"),
+            "MyCheckinView": CheckInFilter(date_range, queryset=user_checkins.select_related("tag")).qs,
+            "MyReportsView": CheckInReportsFilter(
+                dict(date_range, grouping=["tag__name", "timestamp__date"]),
+                queryset=DailyCheckInTotal.objects.filter(user=user),
+            ).qs,
+            "CheckInListAdminView": CheckInAdminFilter(
+                dict(date_range, user=user.username),
+                queryset=CheckIn.objects.select_related("tag"),
+            ).qs,
+            "UserListAdminView": UserAdminFilter(
+                {
+                    "checkin_timestamp_after": date_range["timestamp_after"],
+                    "checkin_timestamp_before": date_range["timestamp_before"],
+                    "hours_logged_min": 1,
+                },
+                queryset=User.objects.all(),
+            ).qs.order_by("-total_hours")[:25],
+            "TagAutocompleteApiView": UserTag.objects.filter(user=user).complete("t"),
+        }
+
+        # the check-in queries run on the user's shard
+        shard = shard_for_user(user.pk)
+        vendor = connections[shard].vendor
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(vendor)
+        if pattern is None:
+            self.stderr.write(f"Sequential scan detection is not supported on {vendor}.")
+
+        failures = []
+        for name, queryset in querysets.items():
+            with use_shard(shard):
+                plan = queryset.explain()
+            self.stdout.write(f"== {name}\n{plan}\n")
+            if pattern is not None and pattern.search(plan):
+                failures.append(name)
+
+        if failures:
+            raise CommandError(f"Sequential scan on checkin_checkin in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("No sequential scans on checkin_checkin."))
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"User {username} does not exist.")
+
+        user = get_most_active_user()
+        if user is None:
+            raise CommandError("No users found. Seed the database first.")
+        return user
@@ -0,0 +1,330 @@
+import contextlib
+import csv
+import datetime
+import io
+import os
+import time
+from decimal import (
+    ROUND_HALF_UP,
+    Decimal,
+)
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import (
+    connections,
+    transaction,
+)
+from django.utils import timezone
+
+from checkin.cache import (
+    bump_user_data_versions,
+    tag_ids,
+)
+from checkin.forms import parse_checkin_string
+from checkin.models import (
+    CheckIn,
+    CheckInImport,
+    DailyCheckInTotal,
+    Tag,
+    UserTag,
+)
+from checkin.shards import group_by_shard
+from checkin.signals import record_checkin_changes
+
+
+CENT = Decimal("0.01")
+# CheckIn.hours has 8 digits, 2 of them decimal places
+MAX_HOURS = Decimal("999999.99")
+ACTIVITY_MAX_LENGTH = CheckIn._meta.get_field("activity").max_length
+
+
+class RecordError(Exception):
+    pass
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 date or datetime. Naive values are in the current timezone and left naive."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise RecordError(f"Invalid timestamp {value!r}.")
+
+
+def iter_text_records(f):
+    """
+    Yield ``(line number, input, username, timestamp, check-in string)`` of
+    the lines of a plaintext file, ``[<date or datetime> ]<number> hrs #<tag> <activity>``.
+    """
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        first, _, rest = line.partition(" ")
+        # check-in strings start with a number, never with a date
+        if "-" in first:
+            yield line_number, line, None, first, rest
+        else:
+            yield line_number, line, None, None, line
+
+
+def iter_csv_records(f):
+    """
+    Yield ``(line number, input, username, timestamp, check-in string)`` of
+    the rows of a CSV file with a header row.
+
+    The check-in is read from a ``checkin`` column, or from ``hours``, ``tag``
+    and ``activity`` columns. ``user`` and ``timestamp`` columns are optional.
+    """
+    reader = csv.reader(f)
+    header = [name.strip().lower() for name in next(reader, [])]
+    if "checkin" not in header and not {"hours", "tag", "activity"} <= set(header):
+        raise CommandError("The CSV header needs a checkin column, or hours, tag and activity columns.")
+    columns = {name: index for index, name in enumerate(header)}
+    user_index, timestamp_index = columns.get("user"), columns.get("timestamp")
+    checkin_index = columns.get("checkin")
+    hours_index, tag_index, activity_index = columns.get("hours"), columns.get("tag"), columns.get("activity")
+
+    for row in reader:
+        if not any(row):
+            continue
+        if len(row) != len(header):
+            yield reader.line_num, ",".join(row), None, None, None
+            continue
+        if checkin_index is not None:
+            checkin_string = row[checkin_index]
+        else:
+            checkin_string = f"{row[hours_index]} hrs #{row[tag_index]} {row[activity_index]}"
+        username = row[user_index] if user_index is not None else None
+        timestamp = row[timestamp_index] if timestamp_index is not None else None
+        yield reader.line_num, ",".join(row), username or None, timestamp or None, checkin_string
+
+
+class Command(BaseCommand):
+    help = (
+        "Import check-ins from a CSV file or a plaintext file of check-in strings, e.g. historical timesheets. "
+        "Lines are parsed with the check-in form's grammar, users and tags are resolved per batch, and each batch "
+        "is loaded with COPY on PostgreSQL (bulk inserts elsewhere) together with its daily totals. Progress is "
+        "saved with every batch, so an interrupted import resumes after the last imported line when run again. "
+        "Rejected lines are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=("csv", "text"), help="Defaults to csv for .csv files, else text.")
+        parser.add_argument("--user", help="Username of check-ins without a user column, required for text files.")
+        parser.add_argument(
+            "--timestamp",
+            help="Timestamp of check-ins without one, as an ISO 8601 date or datetime. Defaults to now.",
+        )
+        parser.add_argument("--batch-size", type=int, default=50000)
+        parser.add_argument("--name", help="Name the progress is saved under. Defaults to the absolute path.")
+        parser.add_argument("--restart", action="store_true", help="Start from the first line again.")
+        parser.add_argument("--errors", help="Append the rejected lines to this CSV file instead of printing them.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.isfile(path):
+            raise CommandError(f"No such file: {path}")
+        file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "text")
+        try:
+            self.default_timestamp = parse_timestamp(options["timestamp"]) if options["timestamp"] else timezone.now()
+        except RecordError as e:
+            raise CommandError(str(e))
+        self.default_username = options["user"]
+        self.user_ids = {}
+
+        progress, _ = CheckInImport.objects.get_or_create(name=options["name"] or os.path.abspath(path))
+        if options["restart"]:
+            progress.position = progress.imported = progress.failed = 0
+            progress.save()
+        elif progress.position:
+            self.stdout.write(f"Resuming after line {progress.position}.")
+
+        error_file = open(options["errors"], "a", newline="") if options["errors"] else None
+        try:
+            self.error_writer = csv.writer(error_file) if error_file else None
+            if error_file and error_file.tell() == 0:
+                self.error_writer.writerow(["line", "error", "input"])
+            with open(path, newline="" if file_format == "csv" else None, encoding="utf-8-sig") as f:
+                records = iter_csv_records(f) if file_format == "csv" else iter_text_records(f)
+                self.import_records(progress, records, options["batch_size"])
+        finally:
+            if error_file:
+                error_file.close()
+
+    def import_records(self, progress, records, batch_size):
+        started = time.perf_counter()
+        imported = failed = 0
+        entries, errors = [], []
+        last_line = progress.position
+        for line_number, text, username, timestamp, checkin_string in records:
+            if line_number <= progress.position:
+                continue
+            last_line = line_number
+            try:
+                entries.append((line_number, text, *self.parse_record(username, timestamp, checkin_string)))
+            except RecordError as e:
+                errors.append((line_number, str(e), text))
+            if len(entries) + len(errors) >= batch_size:
+                batch_imported, batch_failed = self.import_batch(progress, last_line, entries, errors)
+                imported, failed = imported + batch_imported, failed + batch_failed
+                entries, errors = [], []
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"line {last_line}: {imported} imported, {failed} rejected, {imported / elapsed:.0f} rows/s"
+                )
+
+        if last_line > progress.position:
+            batch_imported, batch_failed = self.import_batch(progress, last_line, entries, errors)
+            imported, failed = imported + batch_imported, failed + batch_failed
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} check-ins in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s), "
+                f"rejected {failed} lines."
+            )
+        )
+
+    def parse_record(self, username, timestamp, checkin_string):
+        """Return ``(username, tag, hours, timestamp, activity)`` of a record, as `CheckInForm` would save it."""
+        if checkin_string is None:
+            raise RecordError("Wrong number of columns.")
+        username = username or self.default_username
+        if not username:
+            raise RecordError("No user, add a user column or pass --user.")
+        try:
+            entry = parse_checkin_string(checkin_string)
+        except ValidationError as e:
+            raise RecordError(" ".join(e.messages))
+        # rounded like PostgreSQL rounds numeric values, so the daily totals match the stored hours
+        hours = Decimal(entry["hours"]).quantize(CENT, ROUND_HALF_UP)
+        if hours > MAX_HOURS:
+            raise RecordError(f"Too many hours: {entry['hours']}.")
+        if len(entry["activity"]) > ACTIVITY_MAX_LENGTH:
+            raise RecordError(f"Activity longer than {ACTIVITY_MAX_LENGTH} characters.")
+        timestamp = parse_timestamp(timestamp) if timestamp else self.default_timestamp
+        return username, entry["tag"], hours, timestamp, entry["activity"]
+
+    def get_user_ids(self, usernames):
+        """Return ``{username: id}`` of the existing users among ``usernames``, cached across batches."""
+        missing = set(usernames) - self.user_ids.keys()
+        if missing:
+            found = dict(User.objects.filter(username__in=missing).values_list("username", "id"))
+            self.user_ids.update({username: found.get(username) for username in missing})
+        return self.user_ids
+
+    def import_batch(self, progress, last_line, entries, errors):
+        """Insert ``entries`` and their daily totals and move ``progress`` to ``last_line``, in one transaction."""
+        user_ids = self.get_user_ids(entry[2] for entry in entries)
+        valid = []
+        for entry in entries:
+            if user_ids[entry[2]] is None:
+                errors.append((entry[0], f"Unknown user {entry[2]!r}.", entry[1]))
+            else:
+                valid.append(entry)
+        # outside the transaction, so the cached ids are those of committed tags
+        entry_tag_ids = tag_ids.get_ids(entry[3] for entry in valid)
+        rows = [
+            (user_ids[username], entry_tag_ids[tag], hours, timestamp, activity)
+            for _, _, username, tag, hours, timestamp, activity in valid
+        ]
+
+        with contextlib.ExitStack() as transactions:
+            transactions.enter_context(transaction.atomic())
+            # every shard commits before the progress does, see checkin/shards.py
+            for using, shard_rows in group_by_shard(rows, lambda row: row[0]).items():
+                transactions.enter_context(transaction.atomic(using=using))
+                if connections[using].vendor == "postgresql":
+                    self.copy_rows(shard_rows, using)
+                else:
+                    self.create_rows(shard_rows, using)
+            progress.position = last_line
+            progress.imported += len(rows)
+            progress.failed += len(errors)
+            progress.save()
+            batch_user_ids = {row[0] for row in rows}
+            transaction.on_commit(lambda: bump_user_data_versions(batch_user_ids))
+
+        errors.sort()
+        for line_number, message, text in errors:
+            if self.error_writer:
+                self.error_writer.writerow([line_number, message, text])
+            else:
+                self.stderr.write(f"line {line_number}: {message} {text!r}")
+        return len(rows), len(errors)
+
+    def create_rows(self, rows, using):
+        checkins = []
+        for user_id, tag_id, hours, timestamp, activity in rows:
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            checkins.append(
+                CheckIn(user_id=user_id, tag_id=tag_id, hours=hours, timestamp=timestamp, activity=activity)
+            )
+        CheckIn.objects.using(using).bulk_create(checkins)
+        record_checkin_changes(added=checkins, using=using)
+
+    def copy_rows(self, rows, using):
+        """
+        Load ``rows`` into a temporary table with COPY, then insert them into
+        the check-in table and add them to the daily totals and the users' tags
+        with one upsert each, instead of the locking read and bulk update of
+        `apply_deltas` that are slow for the many keys of a large batch. PostgreSQL reads naive
+        timestamps in the current timezone and works out the local dates.
+        """
+        buffer = io.StringIO()
+        # the check-in grammar keeps tabs, newlines and backslashes out of activities, nothing needs escaping
+        buffer.writelines(
+            f"{user_id}\t{tag_id}\t{hours}\t{timestamp.isoformat()}\t{activity}\n"
+            for user_id, tag_id, hours, timestamp, activity in rows
+        )
+        buffer.seek(0)
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        checkin_table = quote_name(CheckIn._meta.db_table)
+        totals_table = quote_name(DailyCheckInTotal._meta.db_table)
+        tags_table = quote_name(Tag._meta.db_table)
+        user_tags_table = quote_name(UserTag._meta.db_table)
+        timezone_name = timezone.get_current_timezone_name()
+        # the staged columns take the types of the check-in table's columns, e.g. bigint tag ids
+        column_types = {
+            field: CheckIn._meta.get_field(field).db_type(connection)
+            for field in ("user", "tag", "hours", "timestamp", "activity")
+        }
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('TimeZone', %s, true)", [timezone_name])
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE import_checkins_batch (user_id {column_types['user']}, "
+                f"tag_id {column_types['tag']}, hours {column_types['hours']}, "
+                f"\"timestamp\" {column_types['timestamp']}, activity {column_types['activity']}) ON COMMIT DROP"
+            )
+            cursor.copy_expert("COPY import_checkins_batch FROM STDIN", buffer)
+            cursor.execute(
+                f'INSERT INTO {checkin_table} (user_id, tag_id, hours, "timestamp", activity, created, modified) '
+                'SELECT user_id, tag_id, hours, "timestamp", activity, now(), now() FROM import_checkins_batch'
+            )
+            # imports only add tagged check-ins, the conflict target is the tagged totals' unique constraint
+            cursor.execute(
+                f"INSERT INTO {totals_table} (user_id, tag_id, date, hours, checkin_count) "
+                'SELECT user_id, tag_id, ("timestamp" AT TIME ZONE %s)::date, sum(hours), count(*) '
+                "FROM import_checkins_batch GROUP BY 1, 2, 3 "
+                "ON CONFLICT (user_id, tag_id, date) WHERE tag_id IS NOT NULL DO UPDATE SET "
+                f"hours = {totals_table}.hours + EXCLUDED.hours, "
+                f"checkin_count = {totals_table}.checkin_count + EXCLUDED.checkin_count",
+                [timezone_name],
+            )
+            cursor.execute(
+                f"INSERT INTO {user_tags_table} (user_id, tag_id, name, checkin_count, last_used) "
+                'SELECT batch.user_id, batch.tag_id, tag.name, count(*), max(("timestamp" AT TIME ZONE %s)::date) '
+                f"FROM import_checkins_batch AS batch JOIN {tags_table} AS tag ON tag.id = batch.tag_id "
+                "GROUP BY 1, 2, 3 "
+                "ON CONFLICT (user_id, tag_id) DO UPDATE SET "
+                f"checkin_count = {user_tags_table}.checkin_count + EXCLUDED.checkin_count, "
+                f"last_used = greatest({user_tags_table}.last_used, EXCLUDED.last_used)",
+                [timezone_name],
+            )
@@ -0,0 +1,409 @@
+import datetime
+import http.client
+import itertools
+import json
+import random
+import shlex
+import socket
+import statistics
+import subprocess
+import threading
+import time
+from collections import (
+    Counter,
+    defaultdict,
+)
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import (
+    urlencode,
+    urlsplit,
+)
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+)
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connection as db_connection
+from django.urls import reverse
+
+from checkin.management.commands.seed_checkins import (
+    HOURS,
+    WORDS,
+)
+from checkin.models import Tag
+
+
+# the 9am rush: check-ins posted through the form and the API, users looking at their check-ins and
+# reports, and managers refreshing the admin lists
+DEFAULT_MIX = [
+    {
+        "name": "checkin:post",
+        "method": "POST",
+        "path": "/checkin/",
+        "weight": 25,
+        "form": {"checkin_string": "{checkin}"},
+    },
+    {
+        "name": "api-checkins:post",
+        "method": "POST",
+        "path": "/api/checkins/",
+        "weight": 10,
+        "json": {"checkin": "{checkin}"},
+    },
+    {"name": "checkin", "path": "/checkin/", "weight": 20},
+    {"name": "my-checkins", "path": "/checkin/my/", "weight": 10},
+    {"name": "my-reports", "path": "/checkin/my/reports/?grouping=tag__name", "weight": 5},
+    {"name": "api-checkins", "path": "/api/checkins/?limit=50", "weight": 5},
+    {"name": "api-tags", "path": "/api/tags/?prefix=t", "weight": 10},
+    {"name": "admin-checkins", "path": "/checkin-admin/checkins/", "weight": 8, "admin": True},
+    {"name": "admin-users", "path": "/checkin-admin/users/", "weight": 5, "admin": True},
+    {"name": "admin-reports", "path": "/checkin-admin/reports/?grouping=user", "weight": 2, "admin": True},
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def summarize(timings, statuses, wall_time):
+    """Throughput, latency percentiles and error rate of one route's requests, or of all of them."""
+    timings = sorted(timings)
+    errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "error_rate": round(errors / len(timings), 4),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(len(timings) / wall_time, 2),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a running server with many logged in users at once, replaying a weighted mix of the check-in "
+        "routes (posts included), and report throughput, latency percentiles and error rates per route. "
+        "Results can be written as JSON and compared with a previous run. Sessions are created with the "
+        "server's session engine, so run it with the server's settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the server.")
+        parser.add_argument(
+            "--mix",
+            help='JSON file of the routes to request, as a list of {"name", "method", "path", "weight", "admin", '
+            '"form" or "json"}, "{checkin}" in the data is replaced by a random check-in. '
+            "Defaults to a mix of check-in posts, the users' pages and the admin lists.",
+        )
+        parser.add_argument("--path", nargs="+", help="Request only these paths with GET, in equal shares.")
+        parser.add_argument("--users", type=int, default=50, help="Distinct users to log in as.")
+        parser.add_argument("--admins", type=int, default=5, help="Distinct superusers for the admin routes.")
+        parser.add_argument("--user-prefix", default="seed-user-", help="Username prefix of the users.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Simultaneous clients.")
+        parser.add_argument("--requests", type=int, default=2000, help="Total requests.")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed of the route and check-in choice.")
+        parser.add_argument(
+            "--serve",
+            help='Start this server command before the run and stop it afterwards, e.g. "gunicorn -c '
+            'gunicorn.conf.py timetracker.wsgi". It has to listen on --url.',
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="JSON results of a previous run to compare with.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help="Fail when a route's p95 is this fraction slower than in --compare, the throughput this fraction "
+            "lower, or a route's error rate higher.",
+        )
+
+    def handle(self, *args, **options):
+        routes = self.get_routes(options["mix"], options["path"])
+        session_keys = self.create_sessions(options["users"], options["user_prefix"], admin=False)
+        admin_session_keys = []
+        if any(route["admin"] for route in routes):
+            admin_session_keys = self.create_sessions(options["admins"], options["user_prefix"], admin=True)
+        self.checkins = self.get_checkin_strings(random.Random(options["seed"]))
+        # only the sampler below uses the database from here on
+        db_connection.close()
+
+        server = self.start_server(options["serve"], options["url"]) if options["serve"] else None
+        try:
+            report = self.run(routes, session_keys, admin_session_keys, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=60)
+
+        self.write_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}.")
+        if options["compare"]:
+            self.compare(report, options["compare"], options["threshold"])
+
+    def get_routes(self, mix_path, paths):
+        if paths:
+            routes = [{"path": path} for path in paths]
+        elif mix_path:
+            with open(mix_path) as f:
+                routes = json.load(f)
+        else:
+            routes = DEFAULT_MIX
+        routes = [
+            {
+                "name": route.get("name") or route["path"],
+                "method": route.get("method", "GET").upper(),
+                "path": route["path"],
+                "weight": route.get("weight", 1),
+                "admin": route.get("admin", False),
+                "form": route.get("form"),
+                "json": route.get("json"),
+            }
+            for route in routes
+        ]
+        if not routes or sum(route["weight"] for route in routes) <= 0:
+            raise CommandError("The route mix needs at least one route with a positive weight.")
+        return routes
+
+    def run(self, routes, session_keys, admin_session_keys, options):
+        url = urlsplit(options["url"])
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        cum_weights = list(itertools.accumulate(route["weight"] for route in routes))
+        needs_csrf = any(route["method"] != "GET" for route in routes)
+        remaining = iter(range(options["requests"]))
+        lock = threading.Lock()
+        timings = defaultdict(list)
+        statuses = defaultdict(Counter)
+
+        def client(index):
+            rng = random.Random(None if options["seed"] is None else options["seed"] + index)
+            connection = connection_class(url.hostname, url.port, timeout=60)
+            cookies = {False: self.session_cookie(session_keys, index)}
+            if admin_session_keys:
+                cookies[True] = self.session_cookie(admin_session_keys, index)
+            csrf_token = self.get_csrf_token(connection, cookies[False]) if needs_csrf else None
+            while True:
+                with lock:
+                    number = next(remaining, None)
+                if number is None:
+                    break
+                route = rng.choices(routes, cum_weights=cum_weights)[0]
+                method, body, headers = self.build_request(route, rng, cookies[route["admin"]], csrf_token)
+                headers["Referer"] = options["url"]
+                start = time.perf_counter()
+                try:
+                    connection.request(method, route["path"], body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    status = type(e).__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    timings[route["name"]].append(elapsed)
+                    statuses[route["name"]][status] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(options["concurrency"])]
+        done = threading.Event()
+        connection_counts = []
+        sampler = threading.Thread(target=self.sample_connections, args=(done, connection_counts))
+        sampler.start()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - started
+        done.set()
+        sampler.join()
+
+        all_timings = [elapsed for route_timings in timings.values() for elapsed in route_timings]
+        if not all_timings:
+            raise CommandError("No requests were made.")
+        return {
+            "meta": {
+                "url": options["url"],
+                "commit": self.get_commit(),
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "concurrency": options["concurrency"],
+                "users": len(session_keys),
+                "admins": len(admin_session_keys),
+                "wall_time_s": round(wall_time, 3),
+                "max_db_connections": max(connection_counts) if connection_counts else None,
+            },
+            "total": summarize(all_timings, sum(statuses.values(), Counter()), wall_time),
+            "routes": {
+                route["name"]: summarize(timings[route["name"]], statuses[route["name"]], wall_time)
+                for route in routes
+                if timings[route["name"]]
+            },
+        }
+
+    def session_cookie(self, session_keys, index):
+        return f"{settings.SESSION_COOKIE_NAME}={session_keys[index % len(session_keys)]}"
+
+    def get_csrf_token(self, connection, cookie):
+        """Load the check-in page once, untimed, for the CSRF cookie the posts have to send back."""
+        try:
+            connection.request("GET", reverse("checkin:CheckinHomeView"), headers={"Cookie": cookie})
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            return None
+        for header in response.msg.get_all("Set-Cookie") or []:
+            morsel = SimpleCookie(header).get(settings.CSRF_COOKIE_NAME)
+            if morsel is not None:
+                return morsel.value
+        return None
+
+    def build_request(self, route, rng, cookie, csrf_token):
+        """Return the method, body and headers of one request of ``route``."""
+        headers = {"Cookie": cookie}
+        if route["method"] == "GET":
+            return "GET", None, headers
+        if csrf_token:
+            headers["Cookie"] += f"; {settings.CSRF_COOKIE_NAME}={csrf_token}"
+            headers["X-CSRFToken"] = csrf_token
+        checkin = rng.choice(self.checkins)
+        if route["json"] is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps({key: value.replace("{checkin}", checkin) for key, value in route["json"].items()})
+        else:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            body = urlencode({key: value.replace("{checkin}", checkin) for key, value in (route["form"] or {}).items()})
+        return route["method"], body, headers
+
+    def get_checkin_strings(self, rng, count=1000):
+        """Random check-in strings over the existing tags, to post."""
+        tag_names = list(Tag.objects.order_by("pk").values_list("name", flat=True)[:200]) or ["loadtest"]
+        return [
+            f"{rng.choice(HOURS)} hrs #{rng.choice(tag_names)} {' '.join(rng.sample(WORDS, rng.randint(1, 4)))}"
+            for _ in range(count)
+        ]
+
+    def start_server(self, command, url):
+        """Start ``command`` and wait until it accepts connections on ``url``."""
+        url = urlsplit(url)
+        server = subprocess.Popen(shlex.split(command), cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"The server exited with status {server.returncode} before accepting connections.")
+            try:
+                socket.create_connection((url.hostname, url.port or 80), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"The server did not accept connections on {url.netloc} within 60 seconds.")
+
+    def write_report(self, report):
+        meta = report["meta"]
+        total = report["total"]
+        self.stdout.write(
+            f"{total['requests']} requests in {meta['wall_time_s']:.2f}s, {total['throughput_rps']:.1f} req/s, "
+            f"{total['errors']} errors"
+        )
+        self.stdout.write(f"{'route':24} {'req':>6} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+        for name, result in [*report["routes"].items(), ("total", total)]:
+            self.stdout.write(
+                f"{name:24} {result['requests']:>6} {result['throughput_rps']:>8.1f} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['error_rate']:>7.1%}"
+            )
+        if meta["max_db_connections"] is not None:
+            self.stdout.write(f"database connections: max {meta['max_db_connections']}, besides this command's own")
+        for name, result in report["routes"].items():
+            if result["errors"]:
+                failed = {
+                    status: count
+                    for status, count in result["statuses"].items()
+                    if not status.isdigit() or int(status) >= 400
+                }
+                self.stderr.write(f"{name}: {result['errors']} failed requests, statuses {failed}")
+
+    def compare(self, report, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, result in report["routes"].items():
+            previous = baseline["routes"].get(name)
+            if previous is None:
+                continue
+            ratio = result["p95_ms"] / previous["p95_ms"] if previous["p95_ms"] else 1
+            self.stdout.write(
+                f"{name:24} p95 {previous['p95_ms']:>9.1f} -> {result['p95_ms']:>9.1f} ms ({ratio - 1:+.0%}), "
+                f"errors {previous['error_rate']:.1%} -> {result['error_rate']:.1%}"
+            )
+            if ratio > 1 + threshold:
+                regressions.append(f"{name} p95 is {ratio - 1:.0%} slower")
+            if result["error_rate"] > previous["error_rate"]:
+                regressions.append(f"{name} fails {result['error_rate']:.1%} of requests")
+
+        throughput, previous_throughput = report["total"]["throughput_rps"], baseline["total"]["throughput_rps"]
+        self.stdout.write(f"throughput {previous_throughput:.1f} -> {throughput:.1f} req/s")
+        if throughput < previous_throughput * (1 - threshold):
+            regressions.append(f"throughput dropped to {throughput:.1f} from {previous_throughput:.1f} req/s")
+
+        if regressions:
+            raise CommandError("Load test regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions."))
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=settings.BASE_DIR
+            ).stdout.strip()
+        except OSError:
+            return ""
+
+    def sample_connections(self, done, counts):
+        """Record how many other connections the database has, on PostgreSQL, until ``done`` is set."""
+        if db_connection.vendor != "postgresql":
+            return
+        try:
+            while not done.wait(0.25):
+                with db_connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() "
+                        "AND backend_type = 'client backend' AND pid <> pg_backend_pid()"
+                    )
+                    counts.append(cursor.fetchone()[0])
+        finally:
+            db_connection.close()
+
+    def create_sessions(self, count, prefix, admin):
+        """Log in ``count`` users, or superusers with ``admin``, by creating their sessions, return the keys."""
+        users = User.objects.filter(username__startswith=prefix, is_superuser=admin).order_by("pk")[:count]
+        users = list(users)
+        if not users:
+            kind = "superusers" if admin else "users"
+            raise CommandError(f"No {kind} starting with {prefix!r}. Seed the database first.")
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        session_keys = []
+        for user in users:
+            session = session_store()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            session_keys.append(session.session_key)
+        return session_keys
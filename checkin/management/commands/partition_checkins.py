@@ -0,0 +1,84 @@
+import datetime
+import os
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connection
+
+from checkin import partitions
+
+
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Invalid month {value!r}, expected YYYY-MM.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage monthly partitions of the check-in table on PostgreSQL. "
+        "'convert' turns the table into a partitioned one (blocks writes while it copies, reads for the final swap), "
+        "'create' adds the partitions for the coming months (run it daily, it also runs after migrate), "
+        "'detach' detaches the partitions before --before and optionally archives them to gzipped CSV "
+        "and drops them. Daily totals of detached months are kept, see rebuild_checkin_totals --since. "
+        "'status' lists the partitions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=("status", "convert", "create", "detach"))
+        parser.add_argument("--months-ahead", type=int, default=None, help="Partitions to keep ready ahead.")
+        parser.add_argument("--before", help="Detach the partitions of the months before this one, as YYYY-MM.")
+        parser.add_argument("--archive-dir", help="Write detached partitions here as gzipped CSV, then drop them.")
+        parser.add_argument("--drop", action="store_true", help="Drop detached partitions without archiving them.")
+        parser.add_argument("--lock-timeout", default="5s", help="lock_timeout of each detach attempt.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+        if options["action"] == "convert":
+            if partitions.is_partitioned():
+                raise CommandError(f"{partitions.TABLE} is already partitioned.")
+            partitions.convert_to_partitioned(options["months_ahead"])
+            self.stdout.write(self.style.SUCCESS(f"{partitions.TABLE} is now partitioned by month."))
+            return
+
+        if not partitions.is_partitioned():
+            raise CommandError(f"{partitions.TABLE} is not partitioned, run 'partition_checkins convert' first.")
+        getattr(self, options["action"])(options)
+
+    def status(self, options):
+        monthly, has_default = partitions.get_partitions()
+        for month, name in sorted(monthly.items()):
+            self.stdout.write(f"{month:%Y-%m} {name}")
+        if has_default:
+            self.stdout.write(f"default {partitions.DEFAULT_PARTITION}")
+
+    def create(self, options):
+        created = partitions.create_future_partitions(options["months_ahead"])
+        for name in created:
+            self.stdout.write(f"Created {name}.")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created."))
+
+    def detach(self, options):
+        if not options["before"]:
+            raise CommandError("detach needs --before YYYY-MM.")
+        if options["archive_dir"]:
+            os.makedirs(options["archive_dir"], exist_ok=True)
+        before = partitions.month_start(parse_month(options["before"]))
+        monthly, _ = partitions.get_partitions()
+
+        for month, name in sorted(monthly.items()):
+            if month >= before:
+                continue
+            partitions.detach_partition(name, lock_timeout=options["lock_timeout"])
+            self.stdout.write(f"Detached {name}.")
+            if options["archive_dir"]:
+                path = os.path.join(options["archive_dir"], f"{name}.csv.gz")
+                partitions.archive_table(name, path)
+                self.stdout.write(f"Archived {name} to {path}.")
+            if options["archive_dir"] or options["drop"]:
+                partitions.drop_table(name)
+                self.stdout.write(f"Dropped {name}.")
@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from checkin.cache import bump_user_data_versions
+from checkin.shards import (
+    get_shard_sizes,
+    get_shards,
+    is_sharded,
+    move_users,
+    plan_rebalance,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users with their check-ins, daily totals and tags between the shards until the shards hold "
+        "similar numbers of check-ins, or move one user with --user and --to. The moved users' writes are "
+        "refused while they move, see checkin/shards.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Move only this user, to the shard given with --to.")
+        parser.add_argument("--to", help="Shard alias to move --user to, e.g. shard_1 or default.")
+        parser.add_argument("--max-moves", type=int, default=None, help="Move at most this many users.")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows copied per insert.")
+        parser.add_argument("--dry-run", action="store_true", help="Only print the shard sizes and the moves.")
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError("No shards configured, set DATABASE_SHARD_URLS.")
+
+        sizes = get_shard_sizes()
+        self.write_sizes(sizes)
+        if options["user"]:
+            moves = self.get_user_move(options["user"], options["to"])
+        else:
+            moves = plan_rebalance(sizes, options["max_moves"])
+
+        owners = {user_id: alias for alias, users in sizes.items() for user_id in users}
+        for user_id, target in moves.items():
+            self.stdout.write(f"user {user_id}: {owners.get(user_id, '?')} -> {target}")
+        if not moves:
+            self.stdout.write("Nothing to move.")
+            return
+        if options["dry_run"]:
+            return
+
+        move_users(moves, options["batch_size"], log=self.stdout.write)
+        # the users' cached data stays valid, new versions keep it from outliving a failed move
+        bump_user_data_versions(moves.keys())
+        self.write_sizes(get_shard_sizes())
+        self.stdout.write(self.style.SUCCESS(f"Moved {len(moves)} users."))
+
+    def get_user_move(self, username, target):
+        if target not in get_shards():
+            raise CommandError(f"--to must be one of {', '.join(get_shards())}.")
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User {username} does not exist.")
+        return {user.pk: target}
+
+    def write_sizes(self, sizes):
+        for alias, users in sizes.items():
+            self.stdout.write(f"{alias:12} {len(users):>8} users {sum(users.values()):>12} check-ins")
@@ -0,0 +1,179 @@
+import argparse
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import transaction
+from django.db.models import (
+    Count,
+    Sum,
+)
+from django.db.models.functions import TruncDate
+
+from checkin.coldstore import get_cold_store
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    Tag,
+    UserTag,
+    day_bounds,
+)
+from checkin.shards import (
+    get_shards,
+    group_by_shard,
+    is_sharded,
+)
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily check-in totals from the check-in table and the check-ins in cold storage, "
+        "and the users' tags from the totals, or check them against both. Runs on every shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only compare the stored totals with the check-in table and fail on any difference.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--since",
+            type=parse_date,
+            help="Only rebuild or check the totals from this date on, as YYYY-MM-DD. Totals of earlier dates, "
+            "e.g. of check-in partitions that were detached, are kept.",
+        )
+
+    def handle(self, *args, **options):
+        self.since = options["since"]
+        # the check-ins in cold storage are added to the totals of the shard their user is on
+        cold_totals = group_by_shard(self.get_cold_totals().items(), lambda item: item[0][0])
+        for using in get_shards():
+            self.using = using
+            self.label = f"{using}: " if is_sharded() else ""
+            if options["check"]:
+                self.check_totals(dict(cold_totals.get(using, [])))
+            else:
+                self.rebuild_totals(options["batch_size"], dict(cold_totals.get(using, [])))
+
+    def get_stored_totals(self):
+        totals = DailyCheckInTotal.objects.using(self.using).all()
+        if self.since:
+            totals = totals.filter(date__gte=self.since)
+        return totals
+
+    def get_checkin_totals(self):
+        """Aggregate the check-in table by user, tag and local date."""
+        checkins = CheckIn.objects.using(self.using).all()
+        if self.since:
+            checkins = checkins.filter(timestamp__gte=day_bounds(self.since)[0])
+        return (
+            checkins.annotate(date=TruncDate("timestamp"))
+            .order_by()
+            .values("user_id", "tag_id", "date")
+            .annotate(hours=Sum("hours"), checkin_count=Count("id"))
+        )
+
+    def get_cold_totals(self):
+        """
+        Aggregate the check-ins in cold storage, as ``{(user_id, tag_id, date): (hours, count)}``.
+
+        Check-ins of deleted users are skipped and those of deleted tags
+        counted as untagged, the way the daily totals were updated on delete.
+        """
+        store = get_cold_store()
+        if store is None:
+            return {}
+        totals = store.daily_totals(since=self.since)
+        user_ids = set(User.objects.filter(pk__in={key[0] for key in totals}).values_list("pk", flat=True))
+        tag_ids = set(Tag.objects.filter(pk__in={key[1] for key in totals}).values_list("pk", flat=True))
+
+        merged = {}
+        for (user_id, tag_id, date), (hours, count) in totals.items():
+            if user_id not in user_ids:
+                continue
+            key = (user_id, tag_id if tag_id in tag_ids else None, date)
+            merged_hours, merged_count = merged.get(key, (Decimal(0), 0))
+            merged[key] = (merged_hours + hours, merged_count + count)
+        return merged
+
+    def iter_totals(self, cold_totals):
+        """Yield the totals of the check-in table combined with ``cold_totals`` from cold storage, emptying it."""
+        for total in self.get_checkin_totals().iterator():
+            hours, count = cold_totals.pop((total["user_id"], total["tag_id"], total["date"]), (0, 0))
+            total["hours"] += hours
+            total["checkin_count"] += count
+            yield total
+        for (user_id, tag_id, date), (hours, count) in cold_totals.items():
+            yield {"user_id": user_id, "tag_id": tag_id, "date": date, "hours": hours, "checkin_count": count}
+
+    def rebuild_totals(self, batch_size, cold_totals):
+        with transaction.atomic(using=self.using):
+            self.get_stored_totals().delete()
+            batch = []
+            created = 0
+            for total in self.iter_totals(cold_totals):
+                batch.append(DailyCheckInTotal(**total))
+                if len(batch) >= batch_size:
+                    created += len(DailyCheckInTotal.objects.using(self.using).bulk_create(batch))
+                    batch = []
+            created += len(DailyCheckInTotal.objects.using(self.using).bulk_create(batch))
+            user_tags = UserTag.objects.using(self.using).rebuild()
+
+        self.stdout.write(self.style.SUCCESS(f"{self.label}Rebuilt {created} daily totals and {user_tags} user tags."))
+
+    def check_totals(self, cold_totals):
+        expected = {
+            (total["user_id"], total["tag_id"], total["date"]): (total["hours"], total["checkin_count"])
+            for total in self.iter_totals(cold_totals)
+        }
+        stored = {
+            (total["user_id"], total["tag_id"], total["date"]): (total["hours"], total["checkin_count"])
+            for total in self.get_stored_totals()
+            .values("user_id", "tag_id", "date", "hours", "checkin_count")
+            .iterator()
+        }
+
+        mismatches = 0
+        for key in expected.keys() | stored.keys():
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                self.stderr.write(f"user={key[0]} tag={key[1]} date={key[2]}: {stored.get(key)} != {expected.get(key)}")
+
+        if mismatches:
+            raise CommandError(f"{self.label}{mismatches} of {len(expected)} daily totals differ from the check-ins.")
+        self.stdout.write(self.style.SUCCESS(f"{self.label}All {len(expected)} daily totals match the check-ins."))
+        if not self.since:
+            self.check_user_tags(expected)
+
+    def check_user_tags(self, totals):
+        """Compare the users' tag counts with the daily totals ``totals``, ``last_used`` only moves forward."""
+        expected = defaultdict(int)
+        for (user_id, tag_id, _), (_, count) in totals.items():
+            if tag_id is not None:
+                expected[(user_id, tag_id)] += count
+        user_tags = UserTag.objects.using(self.using).values_list("user_id", "tag_id", "checkin_count")
+        stored = {(user_id, tag_id): count for user_id, tag_id, count in user_tags.iterator()}
+
+        mismatches = 0
+        for key in expected.keys() | stored.keys():
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                self.stderr.write(f"user={key[0]} tag={key[1]}: {stored.get(key)} != {expected.get(key)} check-ins")
+
+        if mismatches:
+            raise CommandError(f"{self.label}{mismatches} of {len(expected)} user tags differ from the check-ins.")
+        self.stdout.write(self.style.SUCCESS(f"{self.label}All {len(expected)} user tags match the check-ins."))
@@ -0,0 +1,82 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from checkin.jobs import run_worker
+
+
+def work(stop, poll_interval, stdout):
+    # the parent process handles Ctrl+C and SIGTERM and tells the workers through stop,
+    # so a running job is finished instead of interrupted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    def log(message):
+        stdout.write(message)
+        # output still buffered in a forked worker is lost when it exits
+        stdout.flush()
+
+    run_worker(stop, poll_interval, log=log)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background report and export jobs in a pool of worker processes until stopped with Ctrl+C or "
+        "SIGTERM, which lets the running jobs finish. Jobs are queued in the database, see checkin/jobs.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.CHECKIN_JOB_WORKERS,
+            help="Worker processes, each running one job at a time (default: CHECKIN_JOB_WORKERS).",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.CHECKIN_JOB_POLL_INTERVAL,
+            help="Seconds an idle worker waits before looking for jobs again.",
+        )
+        parser.add_argument("--once", action="store_true", help="Run the pending jobs in this process, then exit.")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            run_worker(poll_interval=options["poll_interval"], exit_when_idle=True, log=self.stdout.write)
+            return
+
+        # forked workers must open their own connections
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        stop = context.Event()
+        # the handler only flags the request, setting the event could deadlock with the main
+        # thread holding the event's lock
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.request_stop)
+
+        workers = {}
+        self.stdout.write(f"Starting {options['processes']} workers.")
+        while not self.stopping:
+            for number in range(options["processes"]):
+                worker = workers.get(number)
+                if worker is not None and worker.is_alive():
+                    continue
+                if worker is not None:
+                    self.stderr.write(f"Worker {number} exited with code {worker.exitcode}, restarting it.")
+                worker = context.Process(target=work, args=(stop, options["poll_interval"], self.stdout), daemon=True)
+                worker.start()
+                workers[number] = worker
+            time.sleep(1)
+
+        stop.set()
+        self.stdout.write("Waiting for the running jobs to finish.")
+        for worker in workers.values():
+            worker.join()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,126 @@
+import datetime
+import itertools
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from checkin.cache import (
+    bump_global_data_version,
+    tag_ids,
+)
+from checkin.models import CheckIn
+from checkin.shards import (
+    group_by_shard,
+    place_users,
+)
+
+
+WORDS = (
+    "review design fix bug write tests deploy meeting planning refactor docs support call sync research "
+    "migrate update cleanup report pairing onboarding estimate release hotfix triage api frontend backend"
+).split()
+HOURS = [Decimal(value) for value in ("0.25", "0.5", "1", "1.5", "2", "3", "4", "6", "8")]
+HOURS_WEIGHTS = [4, 10, 20, 12, 16, 10, 8, 3, 2]
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights of a Zipf distribution over ``count`` items."""
+    return list(itertools.accumulate(1 / (rank**exponent) for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, tags and check-ins for benchmarking, e.g. "
+        "--users 10000 --tags 5000 --checkins 50000000. Activity per user and tag "
+        "popularity follow Zipf distributions, check-ins fall on working hours."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--checkins", type=int, default=10000)
+        parser.add_argument("--days", type=int, default=365, help="Spread check-ins over this many past days.")
+        parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of user activity and tag use.")
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--prefix", default="seed-user-", help="Username prefix of the generated users.")
+        parser.add_argument("--password", default="seed-password", help="Password of the generated users.")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed, for reproducible data sets.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        started = time.perf_counter()
+
+        user_ids = self.create_users(options)
+        self.stdout.write(f"{len(user_ids)} users ready.")
+        tag_id_list = list(tag_ids.get_ids(f"tag-{index}" for index in range(options["tags"])).values())
+        self.stdout.write(f"{len(tag_id_list)} tags ready.")
+
+        self.create_checkins(rng, user_ids, tag_id_list, options)
+        call_command("rebuild_checkin_totals", stdout=self.stdout)
+        bump_global_data_version()
+
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s."))
+
+    def create_users(self, options):
+        password = make_password(options["password"])
+        usernames = [f"{options['prefix']}{index}" for index in range(options["users"])]
+        User.objects.bulk_create(
+            [User(username=username, password=password) for username in usernames],
+            batch_size=options["batch_size"],
+            ignore_conflicts=True,
+        )
+        User.objects.update_or_create(
+            username=f"{options['prefix']}admin",
+            defaults={"password": password, "is_superuser": True, "is_staff": True},
+        )
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+        # bulk inserts send no signals, place the users on the shards here
+        place_users(user_ids.values())
+        return [user_ids[username] for username in usernames]
+
+    def create_checkins(self, rng, user_ids, tag_id_list, options):
+        # shuffle so the busiest users and tags are not simply the oldest rows
+        rng.shuffle(user_ids)
+        rng.shuffle(tag_id_list)
+        user_weights = zipf_cum_weights(len(user_ids), options["skew"])
+        tag_weights = zipf_cum_weights(len(tag_id_list), options["skew"])
+        today = timezone.localdate()
+        days = [today - datetime.timedelta(days=offset) for offset in range(options["days"])]
+        # weekdays are five times busier than weekends
+        day_weights = list(itertools.accumulate(1 if day.weekday() >= 5 else 5 for day in days))
+
+        remaining = options["checkins"]
+        created = 0
+        while remaining > 0:
+            size = min(remaining, options["batch_size"])
+            users = rng.choices(user_ids, cum_weights=user_weights, k=size)
+            tags = rng.choices(tag_id_list, cum_weights=tag_weights, k=size)
+            dates = rng.choices(days, cum_weights=day_weights, k=size)
+            hours = rng.choices(HOURS, weights=HOURS_WEIGHTS, k=size)
+            checkins = []
+            for user_id, tag_id, date, hour in zip(users, tags, dates, hours):
+                timestamp = timezone.make_aware(
+                    datetime.datetime.combine(date, datetime.time(rng.randint(8, 18), rng.randint(0, 59)))
+                )
+                checkins.append(
+                    CheckIn(
+                        user_id=user_id,
+                        tag_id=tag_id,
+                        hours=hour,
+                        timestamp=timestamp,
+                        activity=" ".join(rng.sample(WORDS, rng.randint(1, 4))),
+                    )
+                )
+            for using, shard_checkins in group_by_shard(checkins).items():
+                with transaction.atomic(using=using):
+                    CheckIn.objects.using(using).bulk_create(shard_checkins)
+            remaining -= size
+            created += size
+            self.stdout.write(f"{created} check-ins created.")
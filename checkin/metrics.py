@@ -0,0 +1,331 @@
+import contextvars
+import fcntl
+import functools
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from checkin.cache import (
+    user_data_stats,
+    user_data_stats_lock,
+)
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# snapshot of the processes that exited, see MetricsRegistry.retire_snapshots
+RETIRED_SNAPSHOT = "metrics-retired.json"
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_LIST_RE = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+_SQL_SPACE_RE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Replace literals and placeholder lists so statements group by shape, not by values."""
+    sql = _SQL_LITERAL_RE.sub("?", sql)
+    sql = _SQL_LIST_RE.sub("(...)", sql)
+    return _SQL_SPACE_RE.sub(" ", sql).strip()
+
+
+def _empty_view_metrics():
+    return {"count": 0, "duration": 0.0, "buckets": [0] * len(LATENCY_BUCKETS), "queries": 0, "db_duration": 0.0}
+
+
+class QueryCollector:
+    """
+    Query count, database time and statements of one request, possibly run
+    across several threads. Queries are also added to ``parent``, the
+    collector of an enclosing context.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def add(self, sql, duration):
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.statements.append((sql, duration))
+        if self.parent is not None:
+            self.parent.add(sql, duration)
+
+
+# Collector of the current request, copied into the threads the request runs queries in
+current_collector = contextvars.ContextVar("checkin_query_collector", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection, counting queries for the current request."""
+    collector = current_collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.add(sql, time.perf_counter() - start)
+
+
+class MetricsRegistry:
+    """
+    Process-local request metrics, periodically written to ``directory``.
+
+    Every process writes its own snapshot file, `collect` merges them, so the
+    metrics cover all gunicorn workers without any locking between processes.
+    Snapshots of workers that exited, e.g. recycled after ``max_requests``,
+    are merged into one retired snapshot, so the counters never go back.
+    """
+
+    def __init__(self, directory=None, flush_interval=10, max_statements=200):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # identifies this process's snapshot file, set on the first flush
+        self._token = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+            self.statements = {}
+
+    def record(self, view, method, duration, collector):
+        with self._lock:
+            metrics = self.views.setdefault((view, method), _empty_view_metrics())
+            metrics["count"] += 1
+            metrics["duration"] += duration
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    metrics["buckets"][index] += 1
+                    break
+            metrics["queries"] += collector.count
+            metrics["db_duration"] += collector.duration
+
+            for sql, sql_duration in collector.statements:
+                statement = self.statements.setdefault(normalize_sql(sql), [0, 0.0, 0.0])
+                statement[0] += 1
+                statement[1] += sql_duration
+                statement[2] = max(statement[2], sql_duration)
+            if len(self.statements) > self.max_statements * 2:
+                self.statements = dict(self._top_statements(self.statements, self.max_statements))
+
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @staticmethod
+    def _top_statements(statements, limit):
+        """Return the ``limit`` statements with the most total time."""
+        return sorted(statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                "views": [
+                    [view, method, dict(metrics, buckets=list(metrics["buckets"]))]
+                    for (view, method), metrics in self.views.items()
+                ],
+                "statements": self._top_statements(self.statements, self.max_statements),
+            }
+        with user_data_stats_lock:
+            snapshot["user_data_cache"] = [[name, outcome, count] for (name, outcome), count in user_data_stats.items()]
+        return snapshot
+
+    def snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f"metrics-{pid or os.getpid()}.json")
+
+    def flush(self):
+        """Atomically replace this process's snapshot file."""
+        self._last_flush = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.snapshot_path()
+        if self._token is None:
+            # a file under this pid was left by an exited process whose pid was reused
+            self._token = uuid.uuid4().hex
+            if os.path.exists(path):
+                self.retire_snapshots([path])
+        snapshot = dict(self.snapshot(), token=self._token)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def retire_snapshots(self, paths):
+        """
+        Merge the snapshot files ``paths`` of exited processes into the
+        retired snapshot and delete them, so the directory does not grow with
+        every recycled worker and their counts are kept.
+        """
+        retired_path = os.path.join(self.directory, RETIRED_SNAPSHOT)
+        with open(os.path.join(self.directory, ".retire.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = _read_snapshot(retired_path) or {"views": [], "statements": []}
+            # files merged by a retirement that was interrupted before it removed them
+            merged_tokens = set(retired.get("tokens", ()))
+            snapshots = [retired]
+            tokens = []
+            for path in paths:
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                tokens.append(snapshot.get("token"))
+                if snapshot.get("token") not in merged_tokens:
+                    snapshots.append(snapshot)
+            merged = _merge_snapshots(snapshots)
+            merged_snapshot = {
+                "views": [[view, method, metrics] for (view, method), metrics in merged["views"].items()],
+                "statements": self._top_statements(merged["statements"], self.max_statements),
+                "user_data_cache": [
+                    [name, outcome, count] for (name, outcome), count in merged["user_data_cache"].items()
+                ],
+                "tokens": tokens,
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(merged_snapshot, f)
+            os.replace(tmp_path, retired_path)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def collect(self):
+        """Merge the snapshots of all processes, including the current state of this one."""
+        snapshots = []
+        if self.directory:
+            own_path = self.snapshot_path()
+            exited = []
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+                pid = _snapshot_pid(path)
+                if pid is None or path == own_path:
+                    continue
+                if not _is_running(pid):
+                    exited.append(path)
+                    continue
+                snapshots.append(_read_snapshot(path))
+            if exited:
+                self.retire_snapshots(exited)
+            snapshots.append(_read_snapshot(os.path.join(self.directory, RETIRED_SNAPSHOT)))
+        snapshots.append(self.snapshot())
+
+        merged = _merge_snapshots(snapshot for snapshot in snapshots if snapshot is not None)
+        return dict(
+            merged, statements=self._top_statements(merged["statements"], settings.CHECKIN_METRICS_TOP_STATEMENTS)
+        )
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # a file being replaced, or removed by another process
+        return None
+
+
+def _snapshot_pid(path):
+    """Pid of the process that writes snapshot ``path``, None for the retired snapshot."""
+    match = re.match(r"^metrics-(\d+)\.json$", os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # another user's process
+        return True
+    return True
+
+
+def _merge_snapshots(snapshots):
+    """Sum ``snapshots`` into ``views``, ``statements`` and ``user_data_cache`` dicts."""
+    views = {}
+    statements = {}
+    user_data_cache = {}
+    for snapshot in snapshots:
+        for view, method, metrics in snapshot["views"]:
+            merged = views.setdefault((view, method), _empty_view_metrics())
+            for name in ("count", "duration", "queries", "db_duration"):
+                merged[name] += metrics[name]
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], metrics["buckets"])]
+        for sql, (count, duration, max_duration) in snapshot["statements"]:
+            merged = statements.setdefault(sql, [0, 0.0, 0.0])
+            merged[0] += count
+            merged[1] += duration
+            merged[2] = max(merged[2], max_duration)
+        for name, outcome, count in snapshot.get("user_data_cache", ()):
+            user_data_cache[(name, outcome)] = user_data_cache.get((name, outcome), 0) + count
+    return {"views": views, "statements": statements, "user_data_cache": user_data_cache}
+
+
+registry = MetricsRegistry(settings.CHECKIN_METRICS_DIR, settings.CHECKIN_METRICS_FLUSH_INTERVAL)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus(metrics):
+    """Render the merged metrics returned by `MetricsRegistry.collect` in the Prometheus text format."""
+    views = metrics["views"]
+    statements = metrics["statements"]
+    lines = [
+        "# HELP checkin_request_duration_seconds Request latency by view.",
+        "# TYPE checkin_request_duration_seconds histogram",
+    ]
+    for (view, method), view_metrics in sorted(views.items()):
+        labels = f'view="{_escape(view)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, view_metrics["buckets"]):
+            cumulative += count
+            lines.append(f'checkin_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'checkin_request_duration_seconds_bucket{{{labels},le="+Inf"}} {view_metrics["count"]}')
+        lines.append(f"checkin_request_duration_seconds_sum{{{labels}}} {view_metrics['duration']:.6f}")
+        lines.append(f"checkin_request_duration_seconds_count{{{labels}}} {view_metrics['count']}")
+
+    for name, key, help_text in (
+        ("checkin_request_queries_total", "queries", "SQL queries issued, by view."),
+        ("checkin_request_db_seconds_total", "db_duration", "Time spent in SQL queries, by view."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for (view, method), view_metrics in sorted(views.items()):
+            lines.append(f'{name}{{view="{_escape(view)}",method="{method}"}} {view_metrics[key]}')
+
+    lines.append("# HELP checkin_sql_statement_seconds_total Time spent in the slowest normalized SQL statements.")
+    lines.append("# TYPE checkin_sql_statement_seconds_total counter")
+    for sql, (count, duration, max_duration) in statements:
+        lines.append(f'checkin_sql_statement_seconds_total{{sql="{_escape(sql)}"}} {duration:.6f}')
+    lines.append("# HELP checkin_sql_statement_calls_total Calls of the slowest normalized SQL statements.")
+    lines.append("# TYPE checkin_sql_statement_calls_total counter")
+    for sql, (count, duration, max_duration) in statements:
+        lines.append(f'checkin_sql_statement_calls_total{{sql="{_escape(sql)}"}} {count}')
+    lines.append("# HELP checkin_sql_statement_max_seconds Slowest single call of the normalized SQL statements.")
+    lines.append("# TYPE checkin_sql_statement_max_seconds gauge")
+    for sql, (count, duration, max_duration) in statements:
+        lines.append(f'checkin_sql_statement_max_seconds{{sql="{_escape(sql)}"}} {max_duration:.6f}')
+
+    lines.append("# HELP checkin_user_data_cache_total Report and dashboard cache lookups by outcome.")
+    lines.append("# TYPE checkin_user_data_cache_total counter")
+    for (name, outcome), count in sorted(metrics["user_data_cache"].items()):
+        lines.append(f'checkin_user_data_cache_total{{name="{_escape(name)}",outcome="{outcome}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,278 @@
+import asyncio
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import (
+    Resolver404,
+    resolve,
+)
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from checkin.metrics import (
+    QueryCollector,
+    current_collector,
+    registry,
+)
+from checkin.routers import (
+    current_replica,
+    get_replicas,
+    lag_monitor,
+)
+from checkin.shards import (
+    current_shard,
+    get_user_shard,
+    is_sharded,
+)
+
+
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that works in both sync and async chains, the way
+    ``django.utils.deprecation.MiddlewareMixin`` does.
+
+    Under ASGI, Django 3.2 runs all sync middleware of a process on one
+    thread, so a single sync-only middleware would serialize every request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # mark the instance as a coroutine function for the handler
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.call(request)
+
+    def call(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Record latency, query count and database time of every request, by URL name.
+
+    Queries are counted by `record_query`, an execute wrapper on every
+    connection that reports to the collector of the current context, so
+    queries the request runs in other threads are counted as well. It only
+    costs a function call per query, so this is cheap enough to keep on in
+    production. Queries a streaming response runs while it is being sent are
+    not counted.
+    """
+
+    def __init__(self, get_response):
+        if not settings.CHECKIN_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        collector = QueryCollector(parent=current_collector.get())
+        token = current_collector.set(collector)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        self.record(request, time.perf_counter() - start, collector)
+        return response
+
+    async def __acall__(self, request):
+        collector = QueryCollector(parent=current_collector.get())
+        token = current_collector.set(collector)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        self.record(request, time.perf_counter() - start, collector)
+        return response
+
+    def record(self, request, duration, collector):
+        match = request.resolver_match
+        registry.record(match.view_name if match else "<unresolved>", request.method, duration, collector)
+
+
+class AsyncWhiteNoiseMiddleware(AsyncCapableMiddleware, WhiteNoiseMiddleware):
+    """`WhiteNoiseMiddleware` that does not force async chains onto the sync thread."""
+
+    def __init__(self, get_response=None, settings=settings):
+        WhiteNoiseMiddleware.__init__(self, get_response, settings=settings)
+        AsyncCapableMiddleware.__init__(self, get_response)
+
+    def call(self, request):
+        return WhiteNoiseMiddleware.__call__(self, request)
+
+    async def __acall__(self, request):
+        # static files are looked up in memory, or on disk with autorefresh in development
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Let views with ``read_from_replica = True`` read from a replica, see
+    `checkin.routers`.
+
+    Requests with unsafe methods set a cookie that keeps the reads of that
+    browser on the primary for ``CHECKIN_REPLICA_PIN_SECONDS``, so users always
+    see their own writes on the next page.
+    """
+
+    pin_cookie_name = "checkin_read_primary"
+
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def reads_from_replica(self, request):
+        if request.method not in ("GET", "HEAD") or self.pin_cookie_name in request.COOKIES:
+            return False
+        try:
+            match = resolve(request.path_info, getattr(request, "urlconf", None))
+        except Resolver404:
+            return False
+        return getattr(getattr(match.func, "view_class", None), "read_from_replica", False)
+
+    def call(self, request):
+        replica = lag_monitor.choose_replica() if self.reads_from_replica(request) else None
+        token = current_replica.set(replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.process_response(request, response, replica)
+
+    async def __acall__(self, request):
+        replica = None
+        if self.reads_from_replica(request):
+            # may measure the replication lag, off the event loop and the sync thread
+            replica = await sync_to_async(self.choose_replica, thread_sensitive=False)()
+        token = current_replica.set(replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.process_response(request, response, replica)
+
+    def choose_replica(self):
+        try:
+            return lag_monitor.choose_replica()
+        finally:
+            close_old_connections()
+
+    def process_response(self, request, response, replica):
+        if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE"):
+            response.set_cookie(
+                self.pin_cookie_name,
+                "1",
+                max_age=settings.CHECKIN_REPLICA_PIN_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        if replica is not None and response.streaming:
+            response.streaming_content = self.iter_from_replica(response.streaming_content, replica)
+        return response
+
+    @staticmethod
+    def iter_from_replica(content, replica):
+        """Keep reading from ``replica`` while a streaming response is sent."""
+        iterator = iter(content)
+        while True:
+            token = current_replica.set(replica)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                current_replica.reset(token)
+            yield chunk
+
+
+class ShardRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Send the queries of the logged in user's check-ins to the user's shard,
+    see `checkin.shards`.
+
+    While the user's data is moved to another shard, requests with unsafe
+    methods are answered with 503 and a ``Retry-After``.
+    """
+
+    def __init__(self, get_response):
+        if not is_sharded():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def get_shard(self, request):
+        """Return ``(alias, moving)`` of the user's shard, ``(None, False)`` for anonymous requests."""
+        if not request.user.is_authenticated:
+            return None, False
+        return get_user_shard(request.user.pk)
+
+    def call(self, request):
+        shard, moving = self.get_shard(request)
+        if moving and request.method not in ("GET", "HEAD", "OPTIONS", "TRACE"):
+            return self.moving_response()
+        token = current_shard.set(shard)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_shard.reset(token)
+        return self.process_response(response, shard)
+
+    async def __acall__(self, request):
+        # loads the user and may read the user's shard, off the event loop and the sync thread
+        shard, moving = await sync_to_async(self.lookup_shard, thread_sensitive=False)(request)
+        if moving and request.method not in ("GET", "HEAD", "OPTIONS", "TRACE"):
+            return self.moving_response()
+        token = current_shard.set(shard)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_shard.reset(token)
+        return self.process_response(response, shard)
+
+    def lookup_shard(self, request):
+        try:
+            return self.get_shard(request)
+        finally:
+            close_old_connections()
+
+    def moving_response(self):
+        response = HttpResponse("Your check-ins are being moved, try again in a moment.", status=503)
+        response["Retry-After"] = str(math.ceil(settings.CHECKIN_SHARD_MOVE_GRACE) + 1)
+        return response
+
+    def process_response(self, response, shard):
+        if shard is not None and response.streaming:
+            response.streaming_content = self.iter_on_shard(response.streaming_content, shard)
+        return response
+
+    @staticmethod
+    def iter_on_shard(content, shard):
+        """Keep routing to ``shard`` while a streaming response is sent."""
+        iterator = iter(content)
+        while True:
+            token = current_shard.set(shard)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                current_shard.reset(token)
+            yield chunk
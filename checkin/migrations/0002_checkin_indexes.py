@@ -0,0 +1,25 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['user', 'timestamp'], include=('hours', 'tag'), name='checkin_user_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['user', 'tag', 'timestamp'], name='checkin_user_tag_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['timestamp'], name='checkin_timestamp_idx'),
+        ),
+    ]
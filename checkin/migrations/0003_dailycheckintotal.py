@@ -0,0 +1,58 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_totals(apps, schema_editor):
+    CheckIn = apps.get_model('checkin', 'CheckIn')
+    DailyCheckInTotal = apps.get_model('checkin', 'DailyCheckInTotal')
+    totals = (
+        CheckIn.objects.using(schema_editor.connection.alias)
+        .annotate(date=TruncDate('timestamp'))
+        .order_by()
+        .values('user_id', 'tag_id', 'date')
+        .annotate(hours=Sum('hours'), checkin_count=Count('id'))
+    )
+    DailyCheckInTotal.objects.using(schema_editor.connection.alias).bulk_create(
+        (DailyCheckInTotal(**total) for total in totals.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('checkin', '0002_checkin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCheckInTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Hours')),
+                ('checkin_count', models.IntegerField(default=0, verbose_name='Check-in count')),
+                ('tag', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_totals', to='checkin.tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_totals', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailycheckintotal',
+            index=models.Index(fields=['user', 'date'], name='checkin_daily_user_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycheckintotal',
+            constraint=models.UniqueConstraint(condition=models.Q(('tag__isnull', False)), fields=('user', 'tag', 'date'), name='checkin_daily_total_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycheckintotal',
+            constraint=models.UniqueConstraint(condition=models.Q(('tag__isnull', True)), fields=('user', 'date'), name='checkin_daily_total_untagged_unique'),
+        ),
+        migrations.RunPython(populate_daily_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+POSTGRESQL_FORWARDS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS checkin_activity_trgm_idx '
+    'ON checkin_checkin USING gin (activity gin_trgm_ops)',
+]
+POSTGRESQL_BACKWARDS = [
+    'DROP INDEX CONCURRENTLY IF EXISTS checkin_activity_trgm_idx',
+]
+
+# External content FTS5 table over checkin_checkin.activity, kept in sync by triggers
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS checkin_checkin_fts USING fts5("
+    "activity, content='checkin_checkin', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS checkin_checkin_fts_ai AFTER INSERT ON checkin_checkin BEGIN "
+    "INSERT INTO checkin_checkin_fts(rowid, activity) VALUES (new.id, new.activity); END",
+    "CREATE TRIGGER IF NOT EXISTS checkin_checkin_fts_ad AFTER DELETE ON checkin_checkin BEGIN "
+    "INSERT INTO checkin_checkin_fts(checkin_checkin_fts, rowid, activity) VALUES ('delete', old.id, old.activity); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS checkin_checkin_fts_au AFTER UPDATE OF activity ON checkin_checkin BEGIN "
+    "INSERT INTO checkin_checkin_fts(checkin_checkin_fts, rowid, activity) VALUES ('delete', old.id, old.activity); "
+    "INSERT INTO checkin_checkin_fts(rowid, activity) VALUES (new.id, new.activity); END",
+    "INSERT INTO checkin_checkin_fts(checkin_checkin_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS checkin_checkin_fts_ai',
+    'DROP TRIGGER IF EXISTS checkin_checkin_fts_ad',
+    'DROP TRIGGER IF EXISTS checkin_checkin_fts_au',
+    'DROP TABLE IF EXISTS checkin_checkin_fts',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('checkin', '0003_dailycheckintotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRESQL_FORWARDS, 'sqlite': SQLITE_FORWARDS}),
+            run_for_vendor({'postgresql': POSTGRESQL_BACKWARDS, 'sqlite': SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:30
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0004_activity_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckInImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Name')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Last imported line')),
+                ('imported', models.BigIntegerField(default=0, verbose_name='Check-ins imported')),
+                ('failed', models.BigIntegerField(default=0, verbose_name='Lines rejected')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
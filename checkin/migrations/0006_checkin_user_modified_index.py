@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkin', '0005_checkinimport'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['user', 'modified'], name='checkin_user_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('checkin', '0006_checkin_user_modified_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('kind', models.CharField(max_length=50, verbose_name='Kind')),
+                ('params', models.JSONField(default=dict, verbose_name='Parameters')),
+                ('key', models.CharField(max_length=32, verbose_name='Key')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Progress (%)')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Result')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='Heartbeat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'created'], name='checkin_job_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['key', 'status'], name='checkin_job_key_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Max, Sum
+
+
+def populate_user_tags(apps, schema_editor):
+    DailyCheckInTotal = apps.get_model("checkin", "DailyCheckInTotal")
+    UserTag = apps.get_model("checkin", "UserTag")
+    user_tags = (
+        DailyCheckInTotal.objects.using(schema_editor.connection.alias)
+        .filter(tag__isnull=False)
+        .order_by()
+        .values("user_id", "tag_id", name=F("tag__name"))
+        .annotate(checkin_count=Sum("checkin_count"), last_used=Max("date"))
+    )
+    UserTag.objects.using(schema_editor.connection.alias).bulk_create(
+        (UserTag(**user_tag) for user_tag in user_tags.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("checkin", "0007_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserTag",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, verbose_name="Name")),
+                ("checkin_count", models.IntegerField(default=0, verbose_name="Check-in count")),
+                ("last_used", models.DateField(verbose_name="Last used")),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="user_tags", to="checkin.tag"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_tags",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="usertag",
+            index=models.Index(
+                fields=["user", "name"], name="checkin_user_tag_name_idx", opclasses=["int4_ops", "varchar_pattern_ops"]
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="usertag",
+            constraint=models.UniqueConstraint(fields=("user", "tag"), name="checkin_user_tag_unique"),
+        ),
+        migrations.RunPython(populate_user_tags, migrations.RunPython.noop),
+    ]
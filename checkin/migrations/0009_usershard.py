@@ -0,0 +1,32 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("checkin", "0008_usertag"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserShard",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="shard",
+                        serialize=False,
+                        to="auth.user",
+                    ),
+                ),
+                ("alias", models.CharField(max_length=100, verbose_name="Database")),
+                ("moving", models.BooleanField(default=False, verbose_name="Moving")),
+            ],
+        ),
+    ]
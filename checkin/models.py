@@ -1,14 +1,63 @@
+import datetime
+from collections import namedtuple
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import (
+    IntegrityError,
+    models,
+    router,
+    transaction,
+)
+from django.db.models import (
+    F,
+    Max,
+    Q,
+    Sum,
+)
 from django.template.defaultfilters import slugify
 from django.urls import reverse
+from django.utils import timezone
 from django_extensions.db.models import TimeStampedModel
 
 
+def day_bounds(date):
+    """
+    Return the aware datetimes for the start of ``date`` and the start of the
+    following day in the current timezone.
+    """
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def format_hours(hours):
+    """Format ``hours`` without trailing zeros: 2, 2.5, 10 (``Decimal.normalize`` gives 1E+1)."""
+    return f"{hours:.2f}".rstrip("0").rstrip(".")
+
+
+class TagQuerySet(models.QuerySet):
+    def get_ids_for_names(self, names):
+        """
+        Return a ``{name: id}`` dict for ``names``, creating the missing tags.
+
+        Costs one select when all tags exist, plus one conflict-tolerant insert
+        and one select for the new ones otherwise.
+        """
+        names = set(names)
+        tag_ids = dict(self.filter(name__in=names).values_list("name", "id"))
+        missing = names - tag_ids.keys()
+        if missing:
+            self.bulk_create([Tag(name=name, slug=slugify(name)) for name in missing], ignore_conflicts=True)
+            tag_ids.update(self.filter(name__in=missing).values_list("name", "id"))
+        return tag_ids
+
+
 class Tag(models.Model):
     name = models.CharField("Name", max_length=255, unique=True)
     slug = models.SlugField(editable=False)
 
+    objects = TagQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -18,6 +67,32 @@ class Tag(models.Model):
         return super().save(*args, **kwargs)
 
 
+class CheckInQuerySet(models.QuerySet):
+    def for_date(self, date):
+        """
+        Filter check-ins made on ``date``.
+
+        Uses a half-open timestamp range instead of ``timestamp__date`` so the
+        lookup can be answered from the ``(user, timestamp)`` index.
+        """
+        start, end = day_bounds(date)
+        return self.filter(timestamp__gte=start, timestamp__lt=end)
+
+    def for_date_range(self, start_date=None, end_date=None):
+        """Filter check-ins made from ``start_date`` up to and including ``end_date``."""
+        queryset = self
+        if start_date is not None:
+            queryset = queryset.filter(timestamp__gte=day_bounds(start_date)[0])
+        if end_date is not None:
+            queryset = queryset.filter(timestamp__lt=day_bounds(end_date)[1])
+        return queryset
+
+
+# Values of a check-in as last read from or written to the database, used to
+# work out how an edit changes the daily totals.
+CheckInSnapshot = namedtuple("CheckInSnapshot", ["user_id", "tag_id", "timestamp", "hours"])
+
+
 class CheckIn(TimeStampedModel):
     user = models.ForeignKey(
         User,
@@ -35,13 +110,343 @@ class CheckIn(TimeStampedModel):
     )
     activity = models.CharField("Activity", max_length=255)
 
+    objects = CheckInQuerySet.as_manager()
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            # today's list, my check-ins and reports: user=... and a timestamp range,
+            # covering the hours and tag columns for the totals
+            models.Index(
+                fields=["user", "timestamp"],
+                include=["hours", "tag"],
+                name="checkin_user_timestamp_idx",
+            ),
+            # my check-ins filtered by tag and date range
+            models.Index(fields=["user", "tag", "timestamp"], name="checkin_user_tag_ts_idx"),
+            # admin list filtered or sorted by date only
+            models.Index(fields=["timestamp"], name="checkin_timestamp_idx"),
+            # latest change of a user's check-ins, for the API's ETags
+            models.Index(fields=["user", "modified"], name="checkin_user_modified_idx"),
+        ]
+
     def __str__(self):
         return f"#{self.tag} | {self.activity}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in CheckInSnapshot._fields):
+            instance._snapshot = instance.get_snapshot()
+        return instance
+
+    def save(self, **kwargs):
+        # daily totals are updated from the post_save handler, keep them in
+        # the same transaction as the check-in itself, on the user's shard
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(CheckIn, instance=self)):
+            super().save(**kwargs)
+
+    def get_snapshot(self):
+        return CheckInSnapshot(self.user_id, self.tag_id, self.timestamp, self.hours)
+
     @property
     def get_check_in_display(self):
         hour_string = "hr" if self.hours == 1 else "hrs"
-        return f"{self.hours.normalize()} {hour_string} #{self.tag.name} {self.activity}"
+        return f"{format_hours(self.hours)} {hour_string} #{self.tag.name} {self.activity}"
 
     def get_delete_url(self):
         return reverse("checkin:DeleteCheckinView", args=(self.pk,))
+
+
+class DailyCheckInTotalQuerySet(models.QuerySet):
+    def apply_deltas(self, deltas):
+        """
+        Add ``deltas`` to the stored totals.
+
+        ``deltas`` maps ``(user_id, tag_id, date)`` to ``(hours, count)``. The
+        affected rows are locked and written back in bulk, so the cost does not
+        grow with the number of keys. Rows are created for positive deltas only
+        and removed once their count drops to zero, so a late delete can never
+        leave a negative total behind.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+        if not deltas:
+            return
+
+        with transaction.atomic(using=self.db):
+            user_ids = {user_id for user_id, _, _ in deltas}
+            dates = {date for _, _, date in deltas}
+            existing = {
+                total.key: total
+                for total in self.select_for_update().filter(user_id__in=user_ids, date__in=dates)
+                if total.key in deltas
+            }
+
+            changed, emptied, created = [], [], []
+            for key, (hours, count) in deltas.items():
+                total = existing.get(key)
+                if total is not None:
+                    total.hours += hours
+                    total.checkin_count += count
+                    (changed if total.checkin_count > 0 else emptied).append(total)
+                elif count > 0:
+                    user_id, tag_id, date = key
+                    created.append(
+                        DailyCheckInTotal(user_id=user_id, tag_id=tag_id, date=date, hours=hours, checkin_count=count)
+                    )
+
+            if changed:
+                self.bulk_update(changed, ["hours", "checkin_count"])
+            if emptied:
+                self.filter(pk__in=[total.pk for total in emptied]).delete()
+            if created:
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.bulk_create(created)
+                except IntegrityError:
+                    # some rows were created by a concurrent transaction in the
+                    # meantime, they are locked and updated on the second pass
+                    self.apply_deltas({total.key: deltas[total.key] for total in created})
+
+
+class DailyCheckInTotal(models.Model):
+    """Check-in hours and count per user, tag and local date."""
+
+    user = models.ForeignKey(
+        User,
+        related_name="daily_totals",
+        on_delete=models.CASCADE,
+    )
+    tag = models.ForeignKey(
+        Tag,
+        related_name="daily_totals",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+    date = models.DateField("Date")
+    hours = models.DecimalField("Hours", default=0, max_digits=12, decimal_places=2)
+    checkin_count = models.IntegerField("Check-in count", default=0)
+
+    objects = DailyCheckInTotalQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "tag", "date"],
+                condition=Q(tag__isnull=False),
+                name="checkin_daily_total_unique",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "date"],
+                condition=Q(tag__isnull=True),
+                name="checkin_daily_total_untagged_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "date"], name="checkin_daily_user_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} | #{self.tag} | {self.date}"
+
+    @property
+    def key(self):
+        return (self.user_id, self.tag_id, self.date)
+
+
+class UserTagQuerySet(models.QuerySet):
+    def apply_deltas(self, deltas):
+        """
+        Add ``deltas`` to the users' tags.
+
+        ``deltas`` maps ``(user_id, tag_id)`` to ``(count, last_used)``, the
+        change in check-ins and the latest date of the added ones (None when
+        only check-ins were removed). Like `DailyCheckInTotalQuerySet.apply_deltas`,
+        rows are locked and written back in bulk, created for positive counts
+        only and removed once their count drops to zero. Removing check-ins
+        does not move ``last_used`` back.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if key[1] is not None and (delta[0] or delta[1])}
+        if not deltas:
+            return
+
+        with transaction.atomic(using=self.db):
+            user_ids = {user_id for user_id, _ in deltas}
+            tag_ids = {tag_id for _, tag_id in deltas}
+            existing = {
+                user_tag.key: user_tag
+                for user_tag in self.select_for_update().filter(user_id__in=user_ids, tag_id__in=tag_ids)
+                if user_tag.key in deltas
+            }
+
+            changed, emptied, created = [], [], []
+            for key, (count, last_used) in deltas.items():
+                user_tag = existing.get(key)
+                if user_tag is not None:
+                    user_tag.checkin_count += count
+                    if last_used is not None and last_used > user_tag.last_used:
+                        user_tag.last_used = last_used
+                    (changed if user_tag.checkin_count > 0 else emptied).append(user_tag)
+                elif count > 0:
+                    user_id, tag_id = key
+                    created.append(UserTag(user_id=user_id, tag_id=tag_id, checkin_count=count, last_used=last_used))
+
+            if changed:
+                self.bulk_update(changed, ["checkin_count", "last_used"])
+            if emptied:
+                self.filter(pk__in=[user_tag.pk for user_tag in emptied]).delete()
+            if created:
+                names = dict(Tag.objects.using(self.db).filter(pk__in=tag_ids).values_list("pk", "name"))
+                for user_tag in created:
+                    user_tag.name = names[user_tag.tag_id]
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.bulk_create(created)
+                except IntegrityError:
+                    # created by a concurrent transaction in the meantime, locked
+                    # and updated on the second pass
+                    self.apply_deltas({user_tag.key: deltas[user_tag.key] for user_tag in created})
+
+    def rebuild(self):
+        """Replace the users' tags with those counted from the daily totals, return how many there are."""
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            user_tags = (
+                DailyCheckInTotal.objects.using(self.db)
+                .filter(tag__isnull=False)
+                .order_by()
+                .values("user_id", "tag_id", name=F("tag__name"))
+                .annotate(checkin_count=Sum("checkin_count"), last_used=Max("date"))
+            )
+            return len(self.bulk_create((UserTag(**user_tag) for user_tag in user_tags.iterator()), batch_size=5000))
+
+    def complete(self, prefix, limit=10):
+        """Return the tags starting with ``prefix``, the most used first."""
+        return self.filter(name__startswith=prefix.lower()).order_by("-checkin_count", "-last_used", "name")[:limit]
+
+
+class UserTag(models.Model):
+    """
+    Tags a user has check-ins for, with how often and when last, for the tag
+    filter and the autocomplete of the check-in form.
+    """
+
+    # looked up through the unique constraint's and the name index, both start with the user
+    user = models.ForeignKey(
+        User,
+        related_name="user_tags",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    tag = models.ForeignKey(
+        Tag,
+        related_name="user_tags",
+        on_delete=models.CASCADE,
+    )
+    # copy of the tag's name, so prefixes are looked up in the user's index
+    name = models.CharField("Name", max_length=255)
+    checkin_count = models.IntegerField("Check-in count", default=0)
+    last_used = models.DateField("Last used")
+
+    objects = UserTagQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tag"], name="checkin_user_tag_unique"),
+        ]
+        indexes = [
+            # prefix lookups with LIKE 'prefix%' need the pattern operator class
+            # on PostgreSQL unless the database uses the C collation
+            models.Index(
+                fields=["user", "name"],
+                name="checkin_user_tag_name_idx",
+                opclasses=["int4_ops", "varchar_pattern_ops"],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} | #{self.name}"
+
+    @property
+    def key(self):
+        return (self.user_id, self.tag_id)
+
+
+class CheckInImport(TimeStampedModel):
+    """Progress of an ``import_checkins`` run, saved in the same transaction as each imported batch."""
+
+    name = models.CharField("Name", max_length=255, unique=True)
+    position = models.BigIntegerField("Last imported line", default=0)
+    imported = models.BigIntegerField("Check-ins imported", default=0)
+    failed = models.BigIntegerField("Lines rejected", default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class Job(TimeStampedModel):
+    """Report or export computed by a ``run_workers`` process, see `checkin.jobs`."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        related_name="jobs",
+        on_delete=models.CASCADE,
+    )
+    kind = models.CharField("Kind", max_length=50)
+    params = models.JSONField("Parameters", default=dict)
+    # identifies jobs whose result can be reused, see checkin.jobs.enqueue
+    key = models.CharField("Key", max_length=32)
+    status = models.CharField("Status", max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField("Progress (%)", default=0)
+    result = models.JSONField("Result", blank=True, null=True)
+    error = models.TextField("Error", blank=True)
+    attempts = models.PositiveSmallIntegerField("Attempts", default=0)
+    started = models.DateTimeField("Started", blank=True, null=True)
+    finished = models.DateTimeField("Finished", blank=True, null=True)
+    # last sign of life of the worker running the job
+    heartbeat = models.DateTimeField("Heartbeat", blank=True, null=True)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            # workers claim the oldest pending job
+            models.Index(fields=["status", "created"], name="checkin_job_status_idx"),
+            models.Index(fields=["key", "status"], name="checkin_job_key_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_absolute_url(self):
+        return reverse("checkin:JobDetailView", args=(self.pk,))
+
+
+class UserShard(models.Model):
+    """Database holding a user's check-ins and the data derived from them, see `checkin.shards`."""
+
+    user = models.OneToOneField(
+        User,
+        related_name="shard",
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    alias = models.CharField("Database", max_length=100)
+    # writes are refused while the user's data is copied to another shard
+    moving = models.BooleanField("Moving", default=False)
+
+    def __str__(self):
+        return f"{self.user} | {self.alias}"
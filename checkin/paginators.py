@@ -0,0 +1,317 @@
+import base64
+import binascii
+import datetime
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+
+from django.core.cache import cache
+from django.core.exceptions import (
+    FieldDoesNotExist,
+    ValidationError,
+)
+from django.core.paginator import (
+    PageNotAnInteger,
+    Paginator,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import (
+    F,
+    Q,
+)
+from django.utils.functional import cached_property
+from django_tables2.rows import BoundRows
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """Keep full microsecond precision, cursors must match the stored values exactly."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def estimate_count(queryset, timeout=300):
+    """
+    Return an estimate of ``queryset.count()``.
+
+    On PostgreSQL the estimate comes from the planner. Other backends run the
+    exact count once and cache it for ``timeout`` seconds.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    key = "checkin:count:%s" % hashlib.md5(str(queryset.query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetOrderingKey:
+    """One column of a keyset ordering, with NULLs sorted last in both directions."""
+
+    def __init__(self, model, ordering):
+        self.descending = ordering.startswith("-")
+        self.path = ordering.lstrip("-").split("__")
+        self.nullable = self._resolve(model)
+        self.name = "__".join(self.path)
+
+    def _resolve(self, model):
+        """Return whether the column can be NULL, ordering a trailing relation by its key column."""
+        opts = model._meta
+        nullable = False
+        for index, part in enumerate(self.path):
+            if part == "pk":
+                break
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                break
+            nullable = nullable or field.null
+            if field.is_relation:
+                if index == len(self.path) - 1:
+                    self.path[index] = field.attname
+                opts = field.related_model._meta
+        return nullable
+
+    def order_by(self, reverse=False):
+        descending = self.descending != reverse
+        if not self.nullable:
+            return ("-" if descending else "") + self.name
+        # NULLs stay last going forward, so they come first going backwards
+        if descending:
+            return F(self.name).desc(nulls_last=not reverse, nulls_first=reverse)
+        return F(self.name).asc(nulls_last=not reverse, nulls_first=reverse)
+
+    def value(self, obj):
+        for part in self.path:
+            if obj is None:
+                return None
+            obj = getattr(obj, part)
+        return obj
+
+    def compare(self, a, b, reverse=False):
+        """Compare two values of this column the way `order_by` sorts them, -1 when ``a`` comes first."""
+        if a == b:
+            return 0
+        if a is None:
+            result = 1
+        elif b is None:
+            result = -1
+        else:
+            result = -1 if (a < b) != self.descending else 1
+        return -result if reverse else result
+
+    def equal(self, value):
+        if value is None:
+            return Q(**{f"{self.name}__isnull": True})
+        return Q(**{self.name: value})
+
+    def after(self, value):
+        """Rows strictly after ``value`` in this column's ordering, ``None`` if there are none."""
+        if value is None:
+            return None
+        condition = Q(**{f"{self.name}__{'lt' if self.descending else 'gt'}": value})
+        if self.nullable:
+            condition |= Q(**{f"{self.name}__isnull": True})
+        return condition
+
+    def before(self, value):
+        """Rows strictly before ``value`` in this column's ordering, ``None`` if there are none."""
+        if value is None:
+            return Q(**{f"{self.name}__isnull": False})
+        return Q(**{f"{self.name}__{'gt' if self.descending else 'lt'}": value})
+
+
+class KeysetPage:
+    """Page of a `KeysetPaginator`. Page "numbers" are opaque cursors."""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f"<KeysetPage of {len(self)} rows>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return list(self.object_list)[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.next_cursor
+
+    def previous_page_number(self):
+        return self.previous_cursor
+
+
+class KeysetPaginator:
+    """
+    Cursor paginator over a queryset ordered by unique keys.
+
+    The queryset ordering (or ``ordering`` if it has none) gets the primary key
+    appended as a tiebreaker. Pages are fetched with ``WHERE keys > cursor
+    LIMIT n`` instead of ``OFFSET``, so every page costs the same and no
+    ``COUNT(*)`` is needed. `count` is only run when something asks for it, and
+    is an estimate when ``estimate_count`` is set.
+
+    Accepts a queryset or the `BoundRows` of a django-tables2 table, in which
+    case pages hold `BoundRows` as well.
+
+    With ``databases``, every page is fetched from each of them and the pages
+    are merged, e.g. to list the check-ins of all shards (see
+    `checkin.shards`). Text columns are then merged in Python's order, which
+    can differ from the database collation.
+    """
+
+    first_page = "1"
+
+    def __init__(self, object_list, per_page, orphans=0, ordering=("-pk",), estimate_count=False, databases=None):
+        if isinstance(object_list, BoundRows):
+            self.queryset = object_list.data.data
+            self.table = object_list.table
+        else:
+            self.queryset = object_list
+            self.table = None
+        self.per_page = int(per_page)
+        self.estimate_count = estimate_count
+        self.databases = databases
+
+        orderings = [name for name in self.queryset.query.order_by if isinstance(name, str)]
+        orderings = orderings or list(self.queryset.model._meta.ordering) or list(ordering)
+        if not {"pk", "-pk", "id", "-id"} & set(orderings):
+            orderings.append("-pk" if orderings[-1].startswith("-") else "pk")
+        self.keys = [KeysetOrderingKey(self.queryset.model, name) for name in orderings]
+        self.ordering_hash = hashlib.md5(",".join(orderings).encode()).hexdigest()[:8]
+
+    @property
+    def count(self):
+        querysets = [self.queryset.using(alias) for alias in self.databases] if self.databases else [self.queryset]
+        if self.estimate_count:
+            return sum(estimate_count(queryset) for queryset in querysets)
+        return sum(queryset.count() for queryset in querysets)
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def encode_cursor(self, direction, obj):
+        values = [self.ordering_hash] + [key.value(obj) for key in self.keys]
+        data = json.dumps(values, cls=CursorJSONEncoder).encode()
+        return direction + base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """Return ``(direction, values)`` for a cursor, ``(None, None)`` for the first page."""
+        cursor = str(cursor)
+        if cursor == self.first_page:
+            return None, None
+        direction, data = cursor[:1], cursor[1:]
+        try:
+            values = json.loads(base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)))
+        except (binascii.Error, ValueError):
+            raise PageNotAnInteger("Invalid cursor.")
+        if direction not in ("n", "p") or not isinstance(values, list) or len(values) != len(self.keys) + 1:
+            raise PageNotAnInteger("Invalid cursor.")
+        if values[0] != self.ordering_hash:
+            # the cursor belongs to a different sort order, start over
+            return None, None
+        return direction, values[1:]
+
+    def seek(self, values, forward):
+        """Build the condition for rows after (or before) ``values``."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for key, value in zip(self.keys, values):
+            step = key.after(value) if forward else key.before(value)
+            if step is not None:
+                condition |= equal & step
+            equal &= key.equal(value)
+        return condition
+
+    def page(self, number):
+        direction, values = self.decode_cursor(number)
+        forward = direction != "p"
+        queryset = self.queryset.order_by(*[key.order_by(reverse=not forward) for key in self.keys])
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.seek(values, forward))
+            except (ValidationError, ValueError, TypeError):
+                raise PageNotAnInteger("Invalid cursor.")
+
+        records = self.fetch(queryset, self.per_page + 1, forward)
+        has_more = len(records) > self.per_page
+        records = records[: self.per_page]
+        if not forward:
+            records.reverse()
+
+        next_cursor = previous_cursor = None
+        if records:
+            if has_more or not forward:
+                next_cursor = self.encode_cursor("n", records[-1])
+            if (has_more and not forward) or (forward and values is not None):
+                previous_cursor = self.encode_cursor("p", records[0])
+
+        object_list = BoundRows(records, table=self.table) if self.table is not None else records
+        return KeysetPage(object_list, self, next_cursor, previous_cursor)
+
+    def fetch(self, queryset, limit, forward):
+        if not self.databases:
+            return list(queryset[:limit])
+        # each database returns its rows in order, the first ``limit`` of the merged rows are the page's
+        compare = functools.partial(self.compare, reverse=not forward)
+        rows = [list(queryset.using(alias)[:limit]) for alias in self.databases]
+        return list(itertools.islice(heapq.merge(*rows, key=functools.cmp_to_key(compare)), limit))
+
+    def compare(self, a, b, reverse=False):
+        for key in self.keys:
+            result = key.compare(key.value(a), key.value(b), reverse)
+            if result:
+                return result
+        return 0
+
+
+class CountQuerysetPaginator(Paginator):
+    """
+    Paginator that counts ``count_queryset`` instead of the paginated rows,
+    for rows carrying aggregates that do not change how many rows there are.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_queryset=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.count_queryset = count_queryset
+
+    @cached_property
+    def count(self):
+        if self.count_queryset is None:
+            return len(self.object_list)
+        return self.count_queryset.count()
@@ -0,0 +1,244 @@
+"""
+Monthly range partitioning of the check-in table on PostgreSQL.
+
+Partitions are named ``checkin_checkin_yYYYYmMM`` and cover one local
+calendar month of ``timestamp``. ``checkin_checkin_default`` catches rows
+outside every partition, so writes never fail when partitions run out.
+"""
+import datetime
+import gzip
+import re
+import time
+
+from django.conf import settings
+from django.db import (
+    OperationalError,
+    connection,
+    transaction,
+)
+from django.utils import timezone
+
+from checkin.models import (
+    CheckIn,
+    day_bounds,
+)
+
+
+TABLE = CheckIn._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_RE = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+# "CREATE [UNIQUE] INDEX <name> ON [ONLY] <table> <rest>", as pg_indexes.indexdef shows it
+INDEX_DEFINITION_RE = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )\S+ ON (?:ONLY )?\S+ (.*)$", re.DOTALL)
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def partition_name(month):
+    return f"{TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_bounds(month):
+    """Aware ``[start, end)`` of the local calendar month starting on ``month``."""
+    return day_bounds(month)[0], day_bounds(add_months(month, 1))[0]
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def get_partitions():
+    """Return ``{month: name}`` of the monthly partitions, and whether the default partition exists."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions, DEFAULT_PARTITION in names
+
+
+def create_partition(month):
+    """
+    Create the partition for ``month``. Rows of that month already in the
+    default partition are moved into it.
+    """
+    name = partition_name(month)
+    start, end = partition_bounds(month)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [DEFAULT_PARTITION])
+        has_default = cursor.fetchone()[0]
+        stranded = False
+        if has_default:
+            cursor.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {quote(DEFAULT_PARTITION)} "
+                f'WHERE "timestamp" >= %s AND "timestamp" < %s)',
+                [start, end],
+            )
+            stranded = cursor.fetchone()[0]
+        if stranded:
+            # the new partition's range must not match rows in the default partition
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(DEFAULT_PARTITION)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)", [start, end]
+        )
+        if stranded:
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+                f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+                f"INSERT INTO {quote(TABLE)} SELECT * FROM moved",
+                [start, end],
+            )
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(DEFAULT_PARTITION)} DEFAULT")
+    return name
+
+
+def create_future_partitions(months_ahead=None):
+    """Create the partitions from this month to ``months_ahead`` months ahead, return the new names."""
+    if months_ahead is None:
+        months_ahead = settings.CHECKIN_PARTITION_MONTHS_AHEAD
+    partitions, _ = get_partitions()
+    this_month = month_start(timezone.localdate())
+    return [
+        create_partition(month)
+        for month in (add_months(this_month, offset) for offset in range(months_ahead + 1))
+        if month not in partitions
+    ]
+
+
+def convert_to_partitioned(months_ahead=None):
+    """
+    Replace the check-in table with a partitioned copy, in one transaction.
+
+    Rows are copied and indexes built under an ``EXCLUSIVE`` lock, which
+    blocks writes but not reads. Only the final swap of the two tables takes
+    an ``ACCESS EXCLUSIVE`` lock, which blocks reads as well, and it only
+    changes the catalog. The primary key becomes ``(id, timestamp)``, as
+    PostgreSQL needs the partition key in every unique constraint.
+    """
+    if months_ahead is None:
+        months_ahead = settings.CHECKIN_PARTITION_MONTHS_AHEAD
+    new_table = f"{TABLE}_partitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(TABLE)} IN EXCLUSIVE MODE")
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [TABLE, f"{TABLE}_pkey"],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) "
+            "AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f'SELECT min("timestamp") FROM {quote(TABLE)}')
+        first_timestamp = cursor.fetchone()[0]
+
+        # index names are unique per schema, the new table's indexes get temporary names until the swap
+        renames = {temporary_name(TABLE + "_pkey"): TABLE + "_pkey"}
+        cursor.execute(
+            f"CREATE TABLE {quote(new_table)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(new_table)} ADD CONSTRAINT {quote(temporary_name(TABLE + '_pkey'))} "
+            'PRIMARY KEY (id, "timestamp")'
+        )
+        cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(new_table)} DEFAULT")
+        this_month = month_start(timezone.localdate())
+        month = month_start(timezone.localdate(first_timestamp)) if first_timestamp else this_month
+        while month <= add_months(this_month, months_ahead):
+            start, end = partition_bounds(month)
+            cursor.execute(
+                f"CREATE TABLE {quote(partition_name(month))} PARTITION OF {quote(new_table)} "
+                "FOR VALUES FROM (%s) TO (%s)",
+                [start, end],
+            )
+            month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(TABLE)}")
+        for name, definition in indexes:
+            cursor.execute(index_definition_for(definition, temporary_name(name), new_table))
+            renames[temporary_name(name)] = name
+        # foreign key names are unique per table only, the new table keeps them
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(new_table)} ADD CONSTRAINT {quote(name)} {definition}")
+
+        # the swap, reads wait from here to the commit
+        if sequence:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(new_table)}.id")
+        cursor.execute(f"DROP TABLE {quote(TABLE)}")
+        cursor.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(TABLE)}")
+        for temporary, name in renames.items():
+            cursor.execute(f"ALTER INDEX {quote(temporary)} RENAME TO {quote(name)}")
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {quote(TABLE)}")
+
+
+def temporary_name(name):
+    """Name of index ``name`` on the partitioned table while it is being built, within 63 characters."""
+    return f"{name[:59]}_new"
+
+
+def index_definition_for(definition, name, table):
+    """Rewrite the ``CREATE INDEX`` statement ``definition`` to create index ``name`` on ``table``."""
+    match = INDEX_DEFINITION_RE.match(definition)
+    if match is None:
+        raise ValueError(f"Unexpected index definition: {definition}")
+    return f"{match.group(1)}{quote(name)} ON {quote(table)} {match.group(2)}"
+
+
+def detach_partition(name, lock_timeout="5s", retries=10):
+    """
+    Detach partition ``name`` from the check-in table.
+
+    Detaching takes a short ``ACCESS EXCLUSIVE`` lock. ``DETACH ...
+    CONCURRENTLY`` is not possible while the default partition exists, so
+    the lock is taken with a ``lock_timeout`` and retried, and queries never
+    queue behind a waiting detach for longer than that.
+    """
+    for attempt in range(retries):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [lock_timeout])
+                cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+            return
+        except OperationalError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(min(2**attempt, 30))
+
+
+def archive_table(name, path):
+    """Write table ``name`` to ``path`` as gzipped CSV with a header row."""
+    with gzip.open(path, "wt") as f, connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {quote(name)} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+
+
+def drop_table(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE {quote(name)}")
@@ -0,0 +1,217 @@
+"""
+Chart data of the reports, computed in the database with a bounded size.
+
+Groupings by time only become a series of buckets without gaps. When the
+date range holds more than ``CHECKIN_REPORT_MAX_POINTS`` buckets of the
+requested size, the next coarser size is used (day, week, month, year).
+Other groupings keep their ``CHECKIN_REPORT_MAX_SLICES`` largest groups and
+sum the rest into "Other". `build_merged_chart_data` does the same over the
+daily totals of several databases.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import (
+    F,
+    Max,
+    Min,
+    Sum,
+    Window,
+)
+from django.db.models.functions import (
+    RowNumber,
+    TruncMonth,
+    TruncWeek,
+    TruncYear,
+)
+
+
+# grouping choice: (alias, expression over the daily totals)
+GROUPINGS = {
+    "tag__name": ("tag_name", F("tag__name")),
+    "user": ("username", F("user__username")),
+    "timestamp__date": ("day", F("date")),
+    "week": ("week", TruncWeek("date")),
+    "month": ("month", TruncMonth("date")),
+}
+
+# time buckets from fine to coarse: (alias, expression, step as a PostgreSQL interval and a SQLite modifier)
+TIME_BUCKETS = [
+    ("day", F("date"), "1 day", "+1 day"),
+    ("week", TruncWeek("date"), "1 week", "+7 days"),
+    ("month", TruncMonth("date"), "1 month", "+1 month"),
+    ("year", TruncYear("date"), "1 year", "+1 year"),
+]
+TIME_ALIASES = [alias for alias, _, _, _ in TIME_BUCKETS]
+
+
+def group_totals(totals, choices):
+    """Group the daily totals ``totals`` by the grouping ``choices``, summing ``total_hours``."""
+    fields = dict(GROUPINGS[choice] for choice in choices)
+    return totals.values(**fields).order_by(*fields).annotate(total_hours=Sum("hours"))
+
+
+def bucket_start(date, alias):
+    if alias == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    if alias == "month":
+        return date.replace(day=1)
+    if alias == "year":
+        return date.replace(month=1, day=1)
+    return date
+
+
+def count_buckets(start, end, alias):
+    first, last = bucket_start(start, alias), bucket_start(end, alias)
+    if alias == "day":
+        return (last - first).days + 1
+    if alias == "week":
+        return (last - first).days // 7 + 1
+    if alias == "month":
+        return (last.year - first.year) * 12 + last.month - first.month + 1
+    return last.year - first.year + 1
+
+
+def format_label(value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return str(value)
+
+
+def compile_sql(queryset):
+    return queryset.query.get_compiler(queryset.db).as_sql()
+
+
+def run_sql(using, sql, params):
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def build_chart_data(totals, choices, start=None, end=None):
+    """
+    Return ``{"type", "labels", "values", "bucket"}`` for chart.js from the
+    filtered daily totals ``totals``, grouped by ``choices``, covering
+    ``start`` to ``end`` (dates, default to the first and last day with data).
+    """
+    aliases = [GROUPINGS[choice][0] for choice in choices]
+    try:
+        if aliases and all(alias in TIME_ALIASES for alias in aliases):
+            # the finest requested bucket, the others would not split it further
+            return time_series(totals, min(aliases, key=TIME_ALIASES.index), start, end)
+        return top_groups(totals, choices)
+    except EmptyResultSet:
+        return {"type": "doughnut", "labels": [], "values": [], "bucket": None}
+
+
+def build_merged_chart_data(totals, choices, databases, start=None, end=None):
+    """`build_chart_data` over the daily totals ``totals`` of each of ``databases``, e.g. the shards."""
+    aliases = [GROUPINGS[choice][0] for choice in choices]
+    try:
+        if aliases and all(alias in TIME_ALIASES for alias in aliases):
+            alias = min(aliases, key=TIME_ALIASES.index)
+            if start is None or end is None:
+                bounds = [totals.using(db).aggregate(first=Min("date"), last=Max("date")) for db in databases]
+                firsts = [bound["first"] for bound in bounds if bound["first"] is not None]
+                lasts = [bound["last"] for bound in bounds if bound["last"] is not None]
+                start, end = start or min(firsts, default=None), end or max(lasts, default=None)
+            # the same range gives every database the same buckets
+            charts = [time_series(totals.using(db), alias, start, end) for db in databases]
+            return dict(charts[0], values=[sum(values) for values in zip(*(chart["values"] for chart in charts))])
+        return merge_top_groups(totals, choices, databases)
+    except EmptyResultSet:
+        return {"type": "doughnut", "labels": [], "values": [], "bucket": None}
+
+
+def merge_top_groups(totals, choices, databases):
+    """`top_groups` over several databases, summing every group of each in Python."""
+    limit = settings.CHECKIN_REPORT_MAX_SLICES
+    aliases = [GROUPINGS[choice][0] for choice in choices]
+    hours = defaultdict(Decimal)
+    for db in databases:
+        for row in group_totals(totals.using(db), choices):
+            hours[tuple(row[alias] for alias in aliases)] += row["total_hours"]
+    # largest first, then by the groups with NULLs last, like the window of `top_groups`
+    ranked = sorted(hours.items(), key=lambda item: (-item[1], [(value is None, value) for value in item[0]]))
+    labels = [" - ".join(format_label(value) for value in values) for values, _ in ranked[:limit]]
+    values = [float(total) for _, total in ranked[:limit]]
+    if len(ranked) > limit:
+        labels.append("Other")
+        values.append(float(sum(total for _, total in ranked[limit:])))
+    return {"type": "doughnut", "labels": labels, "values": values, "bucket": None}
+
+
+def time_series(totals, alias, start=None, end=None):
+    """Hours per time bucket from ``start`` to ``end``, with empty buckets as zero."""
+    if start is None or end is None:
+        bounds = totals.aggregate(first=Min("date"), last=Max("date"))
+        start, end = start or bounds["first"], end or bounds["last"]
+    if start is None or end is None or start > end:
+        return {"type": "bar", "labels": [], "values": [], "bucket": alias}
+
+    index = TIME_ALIASES.index(alias)
+    while index < len(TIME_BUCKETS) - 1 and count_buckets(start, end, alias) > settings.CHECKIN_REPORT_MAX_POINTS:
+        index += 1
+        alias = TIME_ALIASES[index]
+    _, expression, interval, modifier = TIME_BUCKETS[index]
+    first, last = bucket_start(start, alias), bucket_start(end, alias)
+
+    grouped = totals.values(bucket=expression).order_by().annotate(total_hours=Sum("hours"))
+    grouped_sql, grouped_params = compile_sql(grouped)
+    if connections[totals.db].vendor == "postgresql":
+        sql = (
+            f"SELECT buckets.bucket, COALESCE(grouped.total_hours, 0) "
+            f"FROM generate_series(%s::date, %s::date, %s::interval) AS buckets (bucket) "
+            f"LEFT JOIN ({grouped_sql}) AS grouped ON grouped.bucket::date = buckets.bucket::date "
+            f"ORDER BY buckets.bucket"
+        )
+        params = [first, last, interval, *grouped_params]
+    else:
+        sql = (
+            f"WITH RECURSIVE buckets (bucket) AS (SELECT date(%s) UNION ALL "
+            f"SELECT date(bucket, %s) FROM buckets WHERE bucket < date(%s)) "
+            f"SELECT buckets.bucket, COALESCE(grouped.total_hours, 0) "
+            f"FROM buckets LEFT JOIN ({grouped_sql}) AS grouped ON grouped.bucket = buckets.bucket "
+            f"ORDER BY buckets.bucket"
+        )
+        params = [first.isoformat(), modifier, last.isoformat(), *grouped_params]
+
+    rows = run_sql(totals.db, sql, params)
+    return {
+        "type": "bar",
+        "labels": [format_label(bucket) for bucket, _ in rows],
+        "values": [float(hours) for _, hours in rows],
+        "bucket": alias,
+    }
+
+
+def top_groups(totals, choices):
+    """Hours of the largest ``CHECKIN_REPORT_MAX_SLICES`` groups, the rest summed into "Other"."""
+    limit = settings.CHECKIN_REPORT_MAX_SLICES
+    aliases = [GROUPINGS[choice][0] for choice in choices]
+    grouped = group_totals(totals, choices).annotate(
+        rank=Window(RowNumber(), order_by=[Sum("hours").desc(), *[F(alias).asc() for alias in aliases]])
+    )
+    grouped_sql, grouped_params = compile_sql(grouped)
+    quote_name = connections[totals.db].ops.quote_name
+    rank, total_hours = quote_name("rank"), quote_name("total_hours")
+    columns = ", ".join(f"CASE WHEN {rank} <= %s THEN {quote_name(alias)} END" for alias in aliases)
+    sql = (
+        f"SELECT CASE WHEN {rank} <= %s THEN {rank} ELSE %s END AS slot, {columns}, SUM({total_hours}) "
+        f"FROM ({grouped_sql}) AS grouped GROUP BY {', '.join(str(n) for n in range(1, len(aliases) + 2))} "
+        f"ORDER BY 1"
+    )
+    rows = run_sql(totals.db, sql, [limit, limit + 1, *[limit] * len(aliases), *grouped_params])
+    return {
+        "type": "doughnut",
+        "labels": [
+            "Other" if slot > limit else " - ".join(format_label(value) for value in values)
+            for slot, *values, _ in rows
+        ],
+        "values": [float(row[-1]) for row in rows],
+        "bucket": None,
+    }
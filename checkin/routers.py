@@ -0,0 +1,104 @@
+"""
+Routing of read-only views to read replicas.
+
+Views with ``read_from_replica = True`` read from a replica while
+`checkin.middleware.ReplicaRoutingMiddleware` handles their request, unless
+the user wrote something within ``CHECKIN_REPLICA_PIN_SECONDS`` or every
+replica lags behind the primary by more than ``CHECKIN_REPLICA_MAX_LAG``.
+Everything else reads from and writes to ``default``, or to the user's shard
+(see `checkin.shards`).
+"""
+import contextvars
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    connections,
+)
+
+
+# Replica the current request reads from, copied into its worker threads
+current_replica = contextvars.ContextVar("checkin_current_replica", default=None)
+
+# Always read from the primary: a session is read right after it is written on login
+PRIMARY_ONLY_APPS = {"sessions"}
+
+# Seconds since the last replayed transaction, 0 when the replica replayed everything it received
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES if alias.startswith("replica_")]
+
+
+class ReplicaLagMonitor:
+    """Per-process replication lag of each replica, measured at most every ``interval`` seconds."""
+
+    def __init__(self):
+        self._lags = {}
+        self._lock = threading.Lock()
+
+    def get_lag(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._lags.get(alias, (None, None))
+        if checked_at is not None and now - checked_at < settings.CHECKIN_REPLICA_LAG_CHECK_INTERVAL:
+            return lag
+
+        lag = self.measure_lag(alias)
+        with self._lock:
+            self._lags[alias] = (now, lag)
+        return lag
+
+    def measure_lag(self, alias):
+        """Return the lag of ``alias`` in seconds, None when it cannot be reached."""
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            return 0.0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                return float(cursor.fetchone()[0])
+        except DatabaseError:
+            return None
+
+    def choose_replica(self):
+        """Return a random replica that is reachable and within ``CHECKIN_REPLICA_MAX_LAG``, or None."""
+        available = []
+        for alias in get_replicas():
+            lag = self.get_lag(alias)
+            if lag is not None and lag <= settings.CHECKIN_REPLICA_MAX_LAG:
+                available.append(alias)
+        return random.choice(available) if available else None
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = current_replica.get()
+        if alias is None or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # related objects come from where the instance came from
+            return instance._state.db
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return db == "default"
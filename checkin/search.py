@@ -0,0 +1,55 @@
+from django.db import connections
+from django.db.models import (
+    BooleanField,
+    F,
+    Func,
+    Q,
+    Value,
+)
+from django.db.models.expressions import RawSQL
+
+
+# pg_trgm and the FTS5 trigram tokenizer can only use their index for
+# terms of at least three characters
+MIN_INDEXED_TERM_LENGTH = 3
+
+
+class ILike(Func):
+    """``<expression> ILIKE <pattern>``, answered by the ``gin_trgm_ops`` index on PostgreSQL."""
+
+    arg_joiner = " ILIKE "
+    template = "%(expressions)s"
+    output_field = BooleanField()
+
+
+def fts_phrase(term):
+    """Quote ``term`` as a single FTS5 phrase."""
+    return '"%s"' % term.replace('"', '""')
+
+
+def activity_search_condition(term, using="default"):
+    """
+    Return a condition matching check-ins whose activity contains ``term``,
+    case-insensitively, using the search index of the ``using`` database.
+    """
+    connection = connections[using]
+    if len(term) >= MIN_INDEXED_TERM_LENGTH:
+        if connection.vendor == "postgresql":
+            pattern = "%%%s%%" % connection.ops.prep_for_like_query(term)
+            return Q(ILike(F("activity"), Value(pattern)))
+        if connection.vendor == "sqlite":
+            return Q(
+                pk__in=RawSQL(
+                    "SELECT rowid FROM checkin_checkin_fts WHERE checkin_checkin_fts MATCH %s",
+                    [fts_phrase(term)],
+                )
+            )
+    return Q(activity__icontains=term)
+
+
+def search_activity(queryset, term):
+    """Filter ``queryset`` to check-ins whose activity contains ``term``."""
+    term = term.strip()
+    if not term:
+        return queryset
+    return queryset.filter(activity_search_condition(term, using=queryset.db))
@@ -0,0 +1,405 @@
+"""
+Sharding of the check-in data by user across databases.
+
+With ``DATABASE_SHARD_URLS`` set, each user's check-ins, daily totals and
+tags live on one database: ``default`` or one of the ``shard_<n>`` aliases.
+`UserShard` rows on ``default`` record where every user lives, users without
+one live on ``default``. New users are spread over the shards by id, and
+``manage.py rebalance_shards`` moves users to even the shards out.
+
+Users and tags are written to ``default`` and copied to every shard, so
+check-ins keep their foreign keys and joins on each shard. Every shard hands
+out the ids of sharded rows from its own range (see `SHARD_ID_BITS`), so ids
+are unique across shards and rows keep them when they move. On SQLite, rows
+moved to a lower numbered shard push that shard's ids into the next range,
+use SQLite shards for local testing only.
+
+`ShardRouter` sends the queries of the sharded models to the shard of the
+instance's user, or to `current_shard`, which
+`checkin.middleware.ShardRoutingMiddleware` sets to the logged in user's
+shard. Code running outside a request, and the admin views over everyone's
+data, choose their shards with `use_shard` or ``using()``.
+"""
+import contextlib
+import contextvars
+import itertools
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connections,
+    transaction,
+)
+from django.db.models import Count
+
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    Tag,
+    UserShard,
+    UserTag,
+)
+from checkin.routers import current_replica
+
+
+# models whose rows live on the shard of their user
+SHARDED_MODELS = [CheckIn, DailyCheckInTotal, UserTag]
+# models written to default and copied to every shard
+MIRRORED_MODELS = [User, Tag]
+
+# shard n hands out the ids of sharded rows from n << SHARD_ID_BITS on
+SHARD_ID_BITS = 48
+
+SHARD_PREFIX = "shard_"
+
+# Shard the current request's user lives on, copied into its worker threads
+current_shard = contextvars.ContextVar("checkin_current_shard", default=None)
+
+
+def shard_number(alias):
+    return 0 if alias == DEFAULT_DB_ALIAS else int(alias.rpartition("_")[2])
+
+
+def get_shards():
+    """Return the aliases of the databases holding check-ins, ``default`` first."""
+    shards = [alias for alias in settings.DATABASES if alias.startswith(SHARD_PREFIX)]
+    return [DEFAULT_DB_ALIAS] + sorted(shards, key=shard_number)
+
+
+def is_sharded():
+    return any(alias.startswith(SHARD_PREFIX) for alias in settings.DATABASES)
+
+
+def get_read_databases():
+    """Return the databases to read everyone's check-ins from: the current replica or ``default``, then the shards."""
+    return [current_replica.get() or DEFAULT_DB_ALIAS] + get_shards()[1:]
+
+
+@contextlib.contextmanager
+def use_shard(alias):
+    """Route the sharded models to ``alias`` within the block, unless an instance says otherwise."""
+    token = current_shard.set(alias)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def user_shard_key(user_id):
+    return f"checkin:shard:{user_id}"
+
+
+def get_user_shard(user_id):
+    """Return ``(alias, moving)`` of the user's shard, cached until it changes."""
+    key = user_shard_key(user_id)
+    placement = cache.get(key)
+    if placement is None:
+        placement = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).values_list(
+            "alias", "moving"
+        ).first() or (DEFAULT_DB_ALIAS, False)
+        cache.set(key, placement, settings.CHECKIN_SHARD_CACHE_TIMEOUT)
+    return tuple(placement)
+
+
+def shard_for_user(user_id):
+    if user_id is None or not is_sharded():
+        return DEFAULT_DB_ALIAS
+    return get_user_shard(user_id)[0]
+
+
+def get_user_shards(user_ids):
+    """Return ``{user_id: alias}`` for ``user_ids`` with one query."""
+    placements = dict(
+        UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id__in=user_ids).values_list("user_id", "alias")
+    )
+    return {user_id: placements.get(user_id, DEFAULT_DB_ALIAS) for user_id in user_ids}
+
+
+def group_by_shard(objects, get_user_id=lambda obj: obj.user_id):
+    """Return ``{alias: [objects]}``, grouping ``objects`` by the shard of their user."""
+    objects = list(objects)
+    if not is_sharded():
+        return {DEFAULT_DB_ALIAS: objects} if objects else {}
+    shards = get_user_shards({get_user_id(obj) for obj in objects})
+    groups = {}
+    for obj in objects:
+        groups.setdefault(shards[get_user_id(obj)], []).append(obj)
+    return groups
+
+
+def set_user_shard(user_id, alias, moving=False):
+    UserShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user_id=user_id, defaults={"alias": alias, "moving": moving}
+    )
+    cache.delete(user_shard_key(user_id))
+
+
+def place_users(user_ids):
+    """Place the users of ``user_ids`` without a shard by id and copy them to every shard, for bulk inserted users."""
+    if not is_sharded():
+        return
+    user_ids = list(user_ids)
+    shards = get_shards()
+    placed = set(
+        UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id__in=user_ids).values_list("user_id", flat=True)
+    )
+    UserShard.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+        [
+            UserShard(user_id=user_id, alias=shards[user_id % len(shards)])
+            for user_id in user_ids
+            if user_id not in placed
+        ],
+        ignore_conflicts=True,
+    )
+    cache.delete_many([user_shard_key(user_id) for user_id in user_ids])
+    copy_rows(User, user_ids, shards[1:])
+
+
+def assign_shard(user_id):
+    """Place a new user on a shard chosen by id, return its alias."""
+    shards = get_shards()
+    alias = shards[user_id % len(shards)]
+    set_user_shard(user_id, alias)
+    return alias
+
+
+class ShardRouter:
+    """
+    Route the sharded models to their user's shard, reads of tags to the
+    current shard, where they are joined with the user's data, and
+    `UserShard` to ``default``. Everything on ``default`` is left to the
+    next router, which may read it from a replica.
+    """
+
+    sharded = {model._meta.label_lower for model in SHARDED_MODELS}
+    mirrored = {model._meta.label_lower for model in MIRRORED_MODELS}
+
+    def get_shard(self, model, hints):
+        instance = hints.get("instance")
+        if instance is not None:
+            if instance._meta.label_lower in self.sharded and instance._state.db:
+                return instance._state.db
+            if isinstance(instance, User):
+                return shard_for_user(instance.pk)
+            if hasattr(instance, "user_id"):
+                return shard_for_user(instance.user_id)
+        return current_shard.get()
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded():
+            return None
+        label = model._meta.label_lower
+        if label == "checkin.usershard":
+            return DEFAULT_DB_ALIAS
+        if label in self.sharded:
+            alias = self.get_shard(model, hints)
+        elif label == "checkin.tag":
+            instance = hints.get("instance")
+            alias = instance._state.db if instance is not None and instance._state.db else current_shard.get()
+        else:
+            return None
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded() or model._meta.label_lower not in self.sharded:
+            return None
+        return self.get_shard(model, hints) or DEFAULT_DB_ALIAS
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # shards get the whole schema, for the foreign keys and joins of the copied users and tags
+        if db.startswith(SHARD_PREFIX):
+            return True
+        return None
+
+
+def copy_rows(model, pks, databases, batch_size=2000):
+    """Insert the rows of ``model`` with primary keys ``pks`` from ``default`` into ``databases`` where missing."""
+    rows = model._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__in=pks) if pks is not None else None
+    if rows is None:
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).order_by("pk")
+    for batch in chunked(rows.iterator(chunk_size=batch_size), batch_size):
+        for alias in databases:
+            model._base_manager.using(alias).bulk_create(batch, ignore_conflicts=True)
+
+
+def save_on_shards(instance):
+    """Write ``instance``, as saved on ``default``, to every shard."""
+    model = type(instance)
+    values = {field.attname: getattr(instance, field.attname) for field in model._meta.concrete_fields}
+    for alias in get_shards()[1:]:
+        # updates the copy or inserts it, and runs the save signals on the shard
+        model(**values).save(using=alias)
+
+
+def delete_on_shards(model, pk):
+    """Delete the copies of a row of ``model`` deleted on ``default``, with whatever cascades on each shard."""
+    for alias in get_shards()[1:]:
+        model._base_manager.using(alias).filter(pk=pk).delete()
+
+
+def reserve_id_range(alias):
+    """Make the shard ``alias`` hand out the ids of the sharded rows from its own range."""
+    start = shard_number(alias) << SHARD_ID_BITS
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = model._meta.db_table
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f"SELECT last_value FROM {sequence}")
+                if cursor.fetchone()[0] < start:
+                    cursor.execute("SELECT setval(%s, %s, false)", [sequence, start])
+            elif connection.vendor == "sqlite":
+                # AUTOINCREMENT continues after the larger of sqlite_sequence and the largest id
+                cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s", [start - 1, table, start - 1]
+                )
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                    [table, start - 1, table],
+                )
+
+
+def prepare_shard(alias):
+    """Copy the users and tags to the migrated shard ``alias`` and reserve its id range."""
+    for model in MIRRORED_MODELS:
+        copy_rows(model, None, [alias])
+    reserve_id_range(alias)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_shard_sizes():
+    """Return ``{alias: {user_id: check-in count}}`` of every shard."""
+    return {
+        alias: dict(
+            CheckIn.objects.using(alias)
+            .order_by()
+            .values("user_id")
+            .annotate(count=Count("id"))
+            .values_list("user_id", "count")
+        )
+        for alias in get_shards()
+    }
+
+
+def get_most_active_user():
+    """Return the user with the most check-ins on any shard, or the first user when there are none."""
+    counts = []
+    for alias in get_shards():
+        top = (
+            CheckIn.objects.using(alias)
+            .order_by()
+            .values("user_id")
+            .annotate(count=Count("id"))
+            .order_by("-count")
+            .values_list("count", "user_id")
+            .first()
+        )
+        if top is not None:
+            counts.append(top)
+    if not counts:
+        return User.objects.order_by("pk").first()
+    return User.objects.get(pk=max(counts)[1])
+
+
+def plan_rebalance(sizes, max_moves=None):
+    """
+    Return ``{user_id: target alias}`` moves that even out the check-ins of
+    the shards in ``sizes`` (see `get_shard_sizes`).
+
+    Repeatedly moves the largest user of the fullest shard that still fits in
+    the gap to the emptiest shard, until no user fits or ``max_moves`` is reached.
+    """
+    loads = {alias: sum(users.values()) for alias, users in sizes.items()}
+    users = {alias: sorted(shard_users.items(), key=lambda item: -item[1]) for alias, shard_users in sizes.items()}
+    moves = {}
+    while max_moves is None or len(moves) < max_moves:
+        source = max(loads, key=loads.get)
+        target = min(loads, key=loads.get)
+        gap = loads[source] - loads[target]
+        # moving a user smaller than the gap brings both shards closer to each other
+        movable = [(user_id, count) for user_id, count in users[source] if 0 < count < gap and user_id not in moves]
+        if not movable:
+            break
+        user_id, count = movable[0]
+        users[source].remove((user_id, count))
+        users[target].append((user_id, count))
+        loads[source] -= count
+        loads[target] += count
+        moves[user_id] = target
+    return moves
+
+
+def copy_user_rows(user_id, source, target, batch_size=2000):
+    """Copy a user's check-ins, daily totals and tags from ``source`` to ``target``, return the check-ins copied."""
+    copy_rows(User, [user_id], [target])
+    tag_ids = set(UserTag.objects.using(source).filter(user_id=user_id).values_list("tag_id", flat=True))
+    copy_rows(Tag, tag_ids, [target])
+
+    copied = {}
+    with transaction.atomic(using=target):
+        for model in SHARDED_MODELS:
+            copied[model] = 0
+            rows = model.objects.using(source).filter(user_id=user_id).order_by("pk")
+            for batch in chunked(rows.iterator(chunk_size=batch_size), batch_size):
+                for row in batch:
+                    # keep the modification times, the API's ETags are made of them
+                    row.update_modified = False
+                model.objects.using(target).bulk_create(batch)
+                copied[model] += len(batch)
+    return copied[CheckIn]
+
+
+def delete_user_rows(user_id, alias):
+    """Delete a user's check-ins, daily totals and tags on ``alias``, without loading them."""
+    connection = connections[alias]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        for model in reversed(SHARDED_MODELS):
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)} WHERE user_id = %s", [user_id]
+            )
+
+
+def move_users(moves, batch_size=2000, log=None):
+    """
+    Move the users of ``moves`` (``{user_id: target alias}``) with their data
+    to their target shards.
+
+    The users' writes are refused while they move. After marking them, the
+    move waits ``CHECKIN_SHARD_MOVE_GRACE`` seconds for the requests that read
+    the old placement to finish, then copies each user's rows, points the
+    user to the target and deletes the rows on the source.
+    """
+    sources = get_user_shards(list(moves))
+    moves = {user_id: target for user_id, target in moves.items() if sources[user_id] != target}
+    for user_id in moves:
+        set_user_shard(user_id, sources[user_id], moving=True)
+    if moves:
+        time.sleep(settings.CHECKIN_SHARD_MOVE_GRACE)
+
+    for user_id, target in moves.items():
+        source = sources[user_id]
+        start = time.monotonic()
+        try:
+            copied = copy_user_rows(user_id, source, target, batch_size)
+        except BaseException:
+            set_user_shard(user_id, source)
+            raise
+        set_user_shard(user_id, target)
+        delete_user_rows(user_id, source)
+        if log is not None:
+            elapsed = time.monotonic() - start
+            log(f"user {user_id}: {copied} check-ins moved from {source} to {target} in {elapsed:.1f}s")
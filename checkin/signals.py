@@ -0,0 +1,174 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connection,
+    transaction,
+)
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from checkin import (
+    partitions,
+    shards,
+)
+from checkin.cache import (
+    bump_global_data_version,
+    bump_user_data_versions,
+    invalidate_auth_user,
+    tag_ids,
+)
+from checkin.metrics import record_query
+from checkin.models import (
+    CheckIn,
+    CheckInSnapshot,
+    DailyCheckInTotal,
+    Tag,
+    UserTag,
+)
+
+
+def record_checkin_changes(added=(), removed=(), using=None):
+    """
+    Update the daily totals and the users' tags for check-ins that were added
+    and removed.
+
+    Both arguments are iterables of objects with ``user_id``, ``tag_id``,
+    ``timestamp`` and ``hours``: check-ins or their snapshots. Code that writes
+    check-ins without going through ``save()``/``delete()`` (e.g. ``bulk_create``)
+    must call this inside the same transaction.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    tag_deltas = defaultdict(lambda: [0, None])
+    for sign, checkins in ((1, added), (-1, removed)):
+        for checkin in checkins:
+            date = timezone.localdate(checkin.timestamp)
+            delta = deltas[(checkin.user_id, checkin.tag_id, date)]
+            delta[0] += sign * Decimal(checkin.hours)
+            delta[1] += sign
+            tag_delta = tag_deltas[(checkin.user_id, checkin.tag_id)]
+            tag_delta[0] += sign
+            if sign > 0 and (tag_delta[1] is None or date > tag_delta[1]):
+                tag_delta[1] = date
+
+    DailyCheckInTotal.objects.using(using).apply_deltas(deltas)
+    UserTag.objects.using(using).apply_deltas(tag_deltas)
+
+    user_ids = {user_id for user_id, _, _ in deltas}
+    transaction.on_commit(lambda: bump_user_data_versions(user_ids), using=using)
+
+
+@receiver(pre_save, sender=CheckIn)
+def load_checkin_snapshot(sender, instance, raw, using, **kwargs):
+    """Read the stored values of an edited check-in that was not loaded from the database."""
+    if raw or instance.pk is None or hasattr(instance, "_snapshot"):
+        return
+
+    stored = CheckIn.objects.using(using).filter(pk=instance.pk).values_list(*CheckInSnapshot._fields).first()
+    if stored is not None:
+        instance._snapshot = CheckInSnapshot(*stored)
+
+
+@receiver(post_save, sender=CheckIn)
+def update_totals_on_checkin_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+
+    snapshot = getattr(instance, "_snapshot", None)
+    record_checkin_changes(
+        added=[instance],
+        removed=[snapshot] if snapshot is not None and not created else [],
+        using=using,
+    )
+    instance._snapshot = instance.get_snapshot()
+
+
+@receiver(post_delete, sender=CheckIn)
+def update_totals_on_checkin_delete(sender, instance, using, **kwargs):
+    record_checkin_changes(removed=[getattr(instance, "_snapshot", instance)], using=using)
+
+
+@receiver(pre_delete, sender=Tag)
+def move_totals_of_deleted_tag(sender, instance, using, **kwargs):
+    """Check-ins of a deleted tag are kept untagged, move their totals along with them."""
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for total in DailyCheckInTotal.objects.using(using).filter(tag=instance):
+        deltas[(total.user_id, None, total.date)][0] += total.hours
+        deltas[(total.user_id, None, total.date)][1] += total.checkin_count
+        deltas[(total.user_id, total.tag_id, total.date)] = [-total.hours, -total.checkin_count]
+
+    DailyCheckInTotal.objects.using(using).apply_deltas(deltas)
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_tag_ids_on_rename(sender, instance, created, using, **kwargs):
+    if not created:
+        UserTag.objects.using(using).filter(tag=instance).update(name=instance.name)
+        transaction.on_commit(tag_ids.invalidate, using=using)
+        transaction.on_commit(bump_global_data_version, using=using)
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_ids_on_delete(sender, instance, using, **kwargs):
+    transaction.on_commit(tag_ids.invalidate, using=using)
+    transaction.on_commit(bump_global_data_version, using=using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, using, **kwargs):
+    # the pk of a deleted user is cleared before the transaction commits
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_auth_user(user_id), using=using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Tag)
+def copy_to_shards(sender, instance, created, raw, using, **kwargs):
+    """Users and tags are written to default, copy them to every shard and place new users on one."""
+    if raw or using != DEFAULT_DB_ALIAS or not shards.is_sharded():
+        return
+    if created and sender is User:
+        shards.assign_shard(instance.pk)
+    transaction.on_commit(lambda: shards.save_on_shards(instance), using=using)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Tag)
+def delete_from_shards(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS or not shards.is_sharded():
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: shards.delete_on_shards(sender, pk), using=using)
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    """Let the request metrics and the benchmark count the queries of every connection and thread."""
+    if record_query not in connection.execute_wrappers:
+        # outermost, so execute_wrapper() context managers keep popping their own wrappers
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(post_migrate)
+def create_checkin_partitions(sender, using, **kwargs):
+    """Keep the partitions of the coming months ready on every deploy, when the check-in table is partitioned."""
+    if sender.name == "checkin" and using == connection.alias and partitions.is_partitioned():
+        partitions.create_future_partitions()
+
+
+@receiver(post_migrate)
+def prepare_checkin_shard(sender, using, **kwargs):
+    """Copy the users and tags to a migrated shard and move its ids into the shard's range, see `checkin.shards`."""
+    if sender.name == "checkin" and using in shards.get_shards()[1:]:
+        shards.prepare_shard(using)
@@ -1,10 +1,64 @@
 import django_tables2 as tables
-from django.db.models import Sum
 from django.urls import reverse
-from django.utils.html import format_html
+from django.utils.formats import (
+    date_format,
+    localize,
+)
+from django.utils.html import (
+    conditional_escape,
+    format_html,
+)
+from django.utils.safestring import mark_safe
+from django.utils.timezone import template_localtime
+
+
+class RenderedRowsMixin:
+    """
+    Table mixin for the ``checkin/table.html`` template, which outputs the rows
+    rendered here in one pass instead of looping over every cell in the
+    template. Cell ``td`` attributes are computed once per column, so they
+    cannot depend on the record.
+    """
+
+    def rendered_rows(self):
+        columns = list(self.columns)
+        cell_tags = [format_html("<td {}>", column.attrs["td"].as_html()) for column in columns]
+        localized = [column.localize for column in columns]
+        html = []
+        for row in self.paginated_rows:
+            html.append(format_html("<tr {}>", row.attrs.as_html()))
+            for cell_tag, use_l10n, (_, cell) in zip(cell_tags, localized, row.items()):
+                # what {{ cell }}, {{ cell|localize }} and {{ cell|unlocalize }} output
+                html.extend((cell_tag, conditional_escape(localize(template_localtime(cell), use_l10n)), "</td>"))
+            html.append("</tr>")
+        return mark_safe("".join(html))
+
+
+class DeleteButtonColumn(tables.Column):
+    """Delete button of a check-in, formatted in Python rather than by rendering a template per row."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("accessor", "pk")
+        kwargs.setdefault("orderable", False)
+        super().__init__(**kwargs)
+
+    def render(self, record):
+        return format_html(
+            '<a href="{}" class="btn btn-danger"><i class="bi bi-trash"></i></a>', record.get_delete_url()
+        )
+
+
+class LocalDateColumn(tables.Column):
+    """
+    Date of a datetime in the current timezone, like ``DateColumn`` but
+    without compiling a template for every row.
+    """
+
+    def render(self, value):
+        return date_format(template_localtime(value), "SHORT_DATE_FORMAT")
 
 
-class TodayCheckInTable(tables.Table):
+class TodayCheckInTable(RenderedRowsMixin, tables.Table):
     """Table for listing users check-ins for the day."""
 
     checkin_display = tables.Column(
@@ -16,31 +70,29 @@ class TodayCheckInTable(tables.Table):
     class Meta:
         fields = ("checkin_display",)
         empty_text = "No check-ins today."
+        template_name = "checkin/table.html"
 
 
-class MyCheckInTable(tables.Table):
+class MyCheckInTable(RenderedRowsMixin, tables.Table):
     """Table for listing all of a users check-ins."""
 
     hours = tables.Column()
-    tag = tables.Column()
+    tag = tables.Column(order_by=("tag__name",))
     activity = tables.Column()
-    timestamp = tables.DateColumn(verbose_name="Date")
-    delete = tables.TemplateColumn(
-        verbose_name="Action",
-        template_name="checkin/delete_checkin_button.html",
-        orderable=False,
-    )
+    timestamp = LocalDateColumn(verbose_name="Date")
+    delete = DeleteButtonColumn(verbose_name="Action")
 
     class Meta:
         fields = ("hours", "tag", "activity", "timestamp", "delete")
         empty_text = "No check-ins found."
         per_page = 10
+        template_name = "checkin/keyset_table.html"
 
 
 class AdminCheckInTable(MyCheckInTable):
     """Table for check in admin view"""
 
-    user = tables.Column()
+    user = tables.Column(order_by=("user__username",))
 
     class Meta(MyCheckInTable.Meta):
         fields = ("user",) + MyCheckInTable.Meta.fields
@@ -52,13 +104,6 @@ class AdminUserTable(tables.Table):
     username = tables.Column()
     total_hours = tables.Column()
 
-    def order_total_hours(self, queryset, is_descending):
-        """Annotate total hours when ordering"""
-        queryset = queryset.annotate(total_hours=Sum("checkins__hours")).order_by(
-            ("-" if is_descending else "") + "total_hours"
-        )
-        return (queryset, True)
-
     def render_username(self, record):
         """
         Render a link to CheckInListAdminView that filters for user
@@ -1,17 +1,41 @@
+from django.conf import settings
 from django.urls import path
 
-from checkin import views
+from checkin import (
+    api,
+    views,
+)
 
 
 app_name = "checkin"
 
+
+def concurrent_view(view_class):
+    """Serve ``view_class`` as an async view when deployed with ASGI and ``CHECKIN_ASYNC_VIEWS``."""
+    if settings.CHECKIN_ASYNC_VIEWS:
+        return view_class.as_async_view()
+    return view_class.as_view()
+
+
 urlpatterns = [
     path("", views.HomeView.as_view(), name="HomeView"),
     path("register/", views.RegisterView.as_view(), name="RegisterView"),
-    path("checkin/", views.CheckinHomeView.as_view(), name="CheckinHomeView"),
+    path("checkin/", concurrent_view(views.CheckinHomeView), name="CheckinHomeView"),
+    path("checkin/batch/", concurrent_view(views.CheckinBatchView), name="CheckinBatchView"),
     path("checkin/my/", views.MyCheckinView.as_view(), name="MyCheckinView"),
-    path("checkin/my/reports/", views.MyReportsView.as_view(), name="MyReportsView"),
+    path("checkin/my/export/", views.MyCheckinExportView.as_view(), name="MyCheckinExportView"),
+    path("checkin/my/reports/", concurrent_view(views.MyReportsView), name="MyReportsView"),
     path("checkin/delete/<int:pk>/", views.DeleteCheckinView.as_view(), name="DeleteCheckinView"),
     path("checkin-admin/checkins/", views.CheckInListAdminView.as_view(), name="CheckInListAdminView"),
+    path("checkin-admin/checkins/export/", views.CheckInExportAdminView.as_view(), name="CheckInExportAdminView"),
+    path("checkin-admin/reports/", concurrent_view(views.ReportsAdminView), name="ReportsAdminView"),
     path("checkin-admin/users/", views.UserListAdminView.as_view(), name="UserListAdminView"),
+    path("checkin/jobs/<int:pk>/", views.JobDetailView.as_view(), name="JobDetailView"),
+    path("checkin/jobs/<int:pk>/status/", views.JobStatusView.as_view(), name="JobStatusView"),
+    path("checkin/jobs/<int:pk>/download/", views.JobDownloadView.as_view(), name="JobDownloadView"),
+    path("metrics/", views.MetricsView.as_view(), name="MetricsView"),
+    path("api/checkins/", api.CheckInListApiView.as_view(), name="CheckInListApiView"),
+    path("api/checkins/<int:pk>/", api.CheckInDetailApiView.as_view(), name="CheckInDetailApiView"),
+    path("api/reports/", api.ReportsApiView.as_view(), name="ReportsApiView"),
+    path("api/tags/", api.TagAutocompleteApiView.as_view(), name="TagAutocompleteApiView"),
 ]
@@ -1,6 +1,8 @@
-import datetime
-from collections import OrderedDict
+import asyncio
+from functools import update_wrapper
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
@@ -8,25 +10,74 @@ from django.contrib.auth.mixins import (
 )
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView
+from django.db import close_old_connections
 from django.db.models import Sum
-from django.shortcuts import redirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+)
+from django.shortcuts import (
+    get_object_or_404,
+    redirect,
+)
 from django.urls import reverse
+from django.utils import timezone
 from django.views.generic import (
     CreateView,
     DeleteView,
+    DetailView,
     FormView,
+    View,
 )
 from django_filters.views import FilterView
 from django_tables2 import SingleTableMixin
 
+from checkin.cache import get_or_compute_user_data
+from checkin.exports import (
+    ADMIN_EXPORT_COLUMNS,
+    EXPORT_COLUMNS,
+    EXPORT_CONTENT_TYPES,
+    export_response,
+)
 from checkin.filters import (
     CheckInAdminFilter,
+    CheckInAdminReportsFilter,
     CheckInFilter,
     CheckInReportsFilter,
     UserAdminFilter,
 )
-from checkin.forms import CheckInForm
-from checkin.models import CheckIn
+from checkin.forms import (
+    CheckInBatchForm,
+    CheckInForm,
+)
+from checkin.jobs import (
+    enqueue_admin_report,
+    enqueue_export,
+    get_query,
+    get_result_path,
+)
+from checkin.metrics import (
+    registry,
+    render_prometheus,
+)
+from checkin.models import (
+    CheckIn,
+    DailyCheckInTotal,
+    Job,
+)
+from checkin.paginators import (
+    CountQuerysetPaginator,
+    KeysetPaginator,
+    estimate_count,
+)
+from checkin.reports import build_chart_data
+from checkin.shards import (
+    get_read_databases,
+    get_shards,
+    is_sharded,
+)
 from checkin.tables import (
     AdminCheckInTable,
     AdminUserTable,
@@ -39,6 +90,8 @@ class BaseViewMixin:
     """Base view mixin to add page title into context"""
 
     page_title = "Check-In"
+    # read from a replica when one is configured, see checkin/routers.py
+    read_from_replica = False
 
     def get_context_data(self, *args, **kwargs):
         ctx = super().get_context_data(*args, **kwargs)
@@ -58,6 +111,136 @@ class SuperUserRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
         return self.request.user.is_superuser
 
 
+class KeysetPaginationMixin:
+    """
+    Table view mixin that paginates with `KeysetPaginator`, newest check-ins
+    first unless the table is sorted otherwise.
+    """
+
+    keyset_ordering = ("-timestamp",)
+    estimate_count = True
+    # list the check-ins of every shard, see checkin/shards.py
+    all_shards = False
+
+    def get_databases(self):
+        return get_read_databases() if self.all_shards and is_sharded() else None
+
+    def get_table_pagination(self, table):
+        return {
+            "paginator_class": KeysetPaginator,
+            "ordering": self.keyset_ordering,
+            "estimate_count": self.estimate_count,
+            "databases": self.get_databases(),
+            # the cursor is not an integer, so the request config leaves it alone
+            "page": self.request.GET.get(table.prefixed_page_field, KeysetPaginator.first_page),
+        }
+
+
+def run_in_worker_thread(func, *args, **kwargs):
+    """Run ``func`` in a thread of the executor, with that thread's own database connection."""
+
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # worker threads outlive requests, apply CONN_MAX_AGE like a request would
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+class ConcurrentQueriesMixin:
+    """
+    View mixin for views whose GET runs independent queries.
+
+    `get_concurrent_queries` returns ``{name: callable}``, views read the
+    results with `get_query_result`. Under the sync view they run one after
+    the other when asked for. The view returned by `as_async_view` runs them
+    all at once, each in its own thread and connection, before dispatching.
+
+    The async view dispatches and renders in an executor thread as well.
+    Django 3.2 runs all ``thread_sensitive`` code of a process on one thread,
+    so that would serialize the requests again.
+    """
+
+    def get_concurrent_queries(self):
+        return {}
+
+    def get_query_result(self, name):
+        results = getattr(self, "query_results", {})
+        if name not in results:
+            return self.get_concurrent_queries()[name]()
+        return results[name]
+
+    def can_run_concurrent_queries(self):
+        return self.request.method == "GET" and self.request.user.is_authenticated
+
+    def dispatch_and_render(self, request, *args, **kwargs):
+        response = self.dispatch(request, *args, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        if await run_in_worker_thread(self.can_run_concurrent_queries):
+            queries = self.get_concurrent_queries()
+            results = await asyncio.gather(*[run_in_worker_thread(query) for query in queries.values()])
+            self.query_results = dict(zip(queries, results))
+        return await run_in_worker_thread(self.dispatch_and_render, request, *args, **kwargs)
+
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        """Return an async view for ASGI deployments, see ``CHECKIN_ASYNC_VIEWS``."""
+        # validates initkwargs
+        cls.as_view(**initkwargs)
+
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        update_wrapper(view, cls, updated=())
+        update_wrapper(view, cls.dispatch, assigned=())
+        return view
+
+
+class CheckInExportMixin:
+    """
+    Filter view mixin that streams the filtered check-ins as CSV or NDJSON
+    (``?format=ndjson``) instead of rendering a page. Exports estimated at
+    ``CHECKIN_JOB_EXPORT_MIN_ROWS`` rows or more are written by a background
+    job instead, and the user is sent to its page.
+    """
+
+    export_columns = EXPORT_COLUMNS
+    export_filename = "checkins"
+    # see checkin.jobs.EXPORT_SCOPES
+    export_scope = "my"
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "csv")
+        if export_format not in EXPORT_CONTENT_TYPES:
+            export_format = "csv"
+
+        filterset = self.get_filterset(self.get_filterset_class())
+        if not filterset.is_bound or filterset.is_valid() or not self.get_strict():
+            queryset = filterset.qs
+        else:
+            queryset = filterset.queryset.none()
+
+        databases = self.get_databases()
+        estimated = (
+            sum(estimate_count(queryset.using(db)) for db in databases) if databases else estimate_count(queryset)
+        )
+        if estimated >= settings.CHECKIN_JOB_EXPORT_MIN_ROWS:
+            return redirect(enqueue_export(request.user, self.export_scope, get_query(request), export_format))
+        return export_response(
+            queryset.order_by("timestamp", "pk"), self.export_columns, export_format, self.export_filename, databases
+        )
+
+
 class HomeView(BaseViewMixin, LoginView):
     """Homepage that serves as login page."""
 
@@ -85,7 +268,7 @@ class RegisterView(BaseViewMixin, CreateView):
         return reverse("checkin:HomeView")
 
 
-class CheckinHomeView(BaseViewMixin, LoginRequiredMixin, SingleTableMixin, FormView):
+class CheckinHomeView(BaseViewMixin, LoginRequiredMixin, ConcurrentQueriesMixin, SingleTableMixin, FormView):
     """Homepage for logged-in users."""
 
     template_name = "checkin/home.html"
@@ -95,14 +278,31 @@ class CheckinHomeView(BaseViewMixin, LoginRequiredMixin, SingleTableMixin, FormV
 
     @property
     def queryset(self):
-        return CheckIn.objects.filter(
-            user=self.request.user,
-            timestamp__date=datetime.date.today(),
-        ).select_related("tag")
+        return (
+            CheckIn.objects.filter(
+                user=self.request.user,
+            )
+            .for_date(timezone.localdate())
+            .select_related("tag")
+        )
 
     def get_queryset(self):
         return self.queryset
 
+    def get_concurrent_queries(self):
+        return {
+            "today": lambda: list(self.get_queryset()),
+            "total_today": lambda: get_or_compute_user_data(
+                self.request.user.pk,
+                "total_today",
+                {"date": timezone.localdate().isoformat()},
+                lambda: self.queryset.aggregate(total_today=Sum("hours"))["total_today"] or 0,
+            ),
+        }
+
+    def get_table_data(self):
+        return self.get_query_result("today")
+
     def get_success_url(self):
         return reverse("checkin:CheckinHomeView")
 
@@ -119,14 +319,26 @@ class CheckinHomeView(BaseViewMixin, LoginRequiredMixin, SingleTableMixin, FormV
         ctx = super().get_context_data(*args, **kwargs)
         ctx.update(
             {
-                "total_today": self.queryset.aggregate(total_today=Sum("hours"))["total_today"] or 0,
+                "total_today": self.get_query_result("total_today"),
             }
         )
 
         return ctx
 
 
-class MyCheckinView(BaseViewMixin, LoginRequiredMixin, SingleTableMixin, FilterView):
+class CheckinBatchView(CheckinHomeView):
+    """Homepage variant that takes several check-ins in one submission."""
+
+    page_title = "Check-In App | Batch"
+    form_class = CheckInBatchForm
+
+    def get_context_data(self, *args, **kwargs):
+        ctx = super().get_context_data(*args, **kwargs)
+        ctx["batch_mode"] = True
+        return ctx
+
+
+class MyCheckinView(BaseViewMixin, LoginRequiredMixin, KeysetPaginationMixin, SingleTableMixin, FilterView):
     """View to list all of logged in user's check-ins"""
 
     template_name = "checkin/my_checkins.html"
@@ -142,43 +354,86 @@ class MyCheckinView(BaseViewMixin, LoginRequiredMixin, SingleTableMixin, FilterV
         ).select_related("tag")
 
 
-class MyReportsView(BaseViewMixin, LoginRequiredMixin, FilterView):
+class MyCheckinExportView(CheckInExportMixin, MyCheckinView):
+    """Export of the logged in user's filtered check-ins."""
+
+
+class MyReportsView(BaseViewMixin, LoginRequiredMixin, ConcurrentQueriesMixin, FilterView):
     """View to show basic reports for a users check-ins."""
 
     template_name = "checkin/my_reports.html"
-    model = CheckIn
+    model = DailyCheckInTotal
     filterset_class = CheckInReportsFilter
     page_title = "Check-In | Reports"
+    read_from_replica = True
 
     @property
     def queryset(self):
-        return CheckIn.objects.filter(
+        return DailyCheckInTotal.objects.filter(
             user=self.request.user,
         )
 
+    def get_concurrent_queries(self):
+        return {"chart_data": self.get_chart_data}
+
+    def get_chart_data(self):
+        """Return the chart data of the filtered and grouped daily totals, None without a grouping."""
+        if "grouping" not in self.request.GET:
+            return None
+        filterset = self.get_filterset(self.get_filterset_class())
+        if not filterset.is_valid() and self.get_strict():
+            return build_chart_data(filterset.queryset.none(), filterset.form.cleaned_data.get("grouping", []))
+        return get_or_compute_user_data(
+            self.request.user.pk,
+            "chart_data",
+            self.request.GET,
+            lambda: self._build_chart_data(filterset),
+        )
+
     def get_context_data(self, *args, **kwargs):
         ctx = super().get_context_data(*args, **kwargs)
         ctx["has_grouping_query"] = "grouping" in self.request.GET
         if ctx["has_grouping_query"]:
-            object_list = ctx["object_list"]
-            ctx["chart_data"] = self._build_chart_data(object_list)
+            ctx["chart_data"] = self.get_query_result("chart_data")
 
         return ctx
 
-    def _build_chart_data(self, object_list):
-        """Format object_list data to be accepted by chart.js."""
-        items = OrderedDict()
-        for record in object_list.all():
-            label = " - ".join([str(val) for key, val in record.items() if key != "total_hours"])
-            items.update(
-                {
-                    label: float(record["total_hours"].normalize()),
-                }
-            )
-        return {
-            "labels": [key for key in items.keys()],
-            "values": [value for value in items.values()],
-        }
+    def _build_chart_data(self, filterset):
+        """Chart.js data of the filtered daily totals, bounded in size, see `checkin.reports`."""
+        start, end = filterset.get_date_range()
+        return build_chart_data(filterset.get_totals(), filterset.form.cleaned_data.get("grouping", []), start, end)
+
+
+class ReportsAdminView(SuperUserRequiredMixin, MyReportsView):
+    """Reports over all users' check-ins."""
+
+    filterset_class = CheckInAdminReportsFilter
+    page_title = "Check-In | All Reports"
+
+    @property
+    def queryset(self):
+        return DailyCheckInTotal.objects.all()
+
+    def can_run_concurrent_queries(self):
+        return super().can_run_concurrent_queries() and self.request.user.is_superuser
+
+    def get_chart_data(self):
+        """
+        Return the chart data computed by a background job, None until the
+        job is done. The job is in the ``job`` context variable.
+        """
+        if "grouping" not in self.request.GET:
+            return None
+        filterset = self.get_filterset(self.get_filterset_class())
+        if not filterset.is_valid() and self.get_strict():
+            return build_chart_data(filterset.queryset.none(), filterset.form.cleaned_data.get("grouping", []))
+        self.job = enqueue_admin_report(self.request.user, get_query(self.request))
+        return self.job.result if self.job.status == Job.DONE else None
+
+    def get_context_data(self, *args, **kwargs):
+        ctx = super().get_context_data(*args, **kwargs)
+        ctx["job"] = getattr(self, "job", None)
+        return ctx
 
 
 class DeleteCheckinView(BaseViewMixin, LoginRequiredMixin, DeleteView):
@@ -191,6 +446,16 @@ class DeleteCheckinView(BaseViewMixin, LoginRequiredMixin, DeleteView):
             queryset = queryset.filter(user=self.request.user)
         return queryset
 
+    def get_object(self, queryset=None):
+        if not self.request.user.is_superuser or not is_sharded():
+            return super().get_object(queryset)
+        # ids are unique across the shards, the check-in is on one of them
+        for alias in get_shards():
+            checkin = self.get_queryset().using(alias).filter(pk=self.kwargs["pk"]).first()
+            if checkin is not None:
+                return checkin
+        raise Http404("No check-in found matching the query")
+
     def get_success_url(self):
         if self.request.user.is_superuser:
             return reverse("checkin:CheckInListAdminView")
@@ -198,7 +463,7 @@ class DeleteCheckinView(BaseViewMixin, LoginRequiredMixin, DeleteView):
             return reverse("checkin:MyCheckinView")
 
 
-class CheckInListAdminView(BaseViewMixin, SuperUserRequiredMixin, SingleTableMixin, FilterView):
+class CheckInListAdminView(BaseViewMixin, SuperUserRequiredMixin, KeysetPaginationMixin, SingleTableMixin, FilterView):
     """Admin view for listing all check-ins"""
 
     template_name = "checkin/admin_checkins.html"
@@ -206,10 +471,20 @@ class CheckInListAdminView(BaseViewMixin, SuperUserRequiredMixin, SingleTableMix
     table_class = AdminCheckInTable
     model = CheckIn
     filterset_class = CheckInAdminFilter
+    read_from_replica = True
+    all_shards = True
 
     @property
     def queryset(self):
-        return CheckIn.objects.all().select_related("tag")
+        return CheckIn.objects.all().select_related("tag", "user")
+
+
+class CheckInExportAdminView(CheckInExportMixin, CheckInListAdminView):
+    """Admin export of all filtered check-ins."""
+
+    export_columns = ADMIN_EXPORT_COLUMNS
+    export_filename = "all-checkins"
+    export_scope = "admin"
 
 
 class UserListAdminView(BaseViewMixin, SuperUserRequiredMixin, SingleTableMixin, FilterView):
@@ -220,10 +495,75 @@ class UserListAdminView(BaseViewMixin, SuperUserRequiredMixin, SingleTableMixin,
     table_class = AdminUserTable
     model = User
     filterset_class = UserAdminFilter
+    read_from_replica = True
 
     @property
     def queryset(self):
+        # total_hours is annotated by the filterset, within the filtered date range
         return User.objects.all()
 
+    def get_table_data(self):
+        if is_sharded():
+            return self.filterset.get_users_with_totals(get_read_databases())
+        return super().get_table_data()
+
+    def get_table_pagination(self, table):
+        paginate = super().get_table_pagination(table)
+        paginate.update(
+            {
+                "paginator_class": CountQuerysetPaginator,
+                # the users of a sharded database are a list, counted by its length
+                "count_queryset": None if is_sharded() else self.filterset.get_count_queryset(),
+            }
+        )
+        return paginate
+
+
+class JobDetailView(BaseViewMixin, LoginRequiredMixin, DetailView):
+    """Progress of one of the user's background jobs, polled through `JobStatusView`."""
+
+    template_name = "checkin/job_detail.html"
+    page_title = "Check-In | Job"
+
     def get_queryset(self):
-        return self.queryset.annotate(total_hours=Sum("checkins__hours"))
+        return Job.objects.filter(user=self.request.user)
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    """Status and progress of one of the user's background jobs as JSON."""
+
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(Job, pk=self.kwargs["pk"], user=request.user)
+        return JsonResponse(
+            {
+                "status": job.status,
+                "progress": job.progress,
+                "finished": job.is_finished,
+                "error": (job.error.strip().splitlines() or [None])[-1],
+            }
+        )
+
+
+class JobDownloadView(LoginRequiredMixin, View):
+    """File written by one of the user's finished export jobs."""
+
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(Job, pk=self.kwargs["pk"], user=request.user, kind="export", status=Job.DONE)
+        try:
+            result_file = open(get_result_path(job), "rb")
+        except FileNotFoundError:
+            raise Http404("The export has expired.")
+        return FileResponse(
+            result_file, as_attachment=True, filename=job.result["filename"], content_type=job.result["content_type"]
+        )
+
+
+class MetricsView(SuperUserRequiredMixin, View):
+    """Request and SQL metrics of all workers in the Prometheus text format."""
+
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            render_prometheus(registry.collect()), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
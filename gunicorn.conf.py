@@ -0,0 +1,47 @@
+"""
+Production gunicorn settings, read by ``gunicorn -c gunicorn.conf.py``.
+
+Requests mostly wait on the database, so each worker process runs
+GUNICORN_THREADS threads that share a pool of DATABASE_POOL_SIZE database
+connections (see timetracker/pooled_postgresql). The database sees at most
+GUNICORN_WORKERS * DATABASE_POOL_SIZE connections per instance.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# pending connections beyond the busy threads, queued by the kernel
+backlog = 2048
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then to bound memory growth
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = "-"
+
+# the workers write their request metrics here for /metrics/ to merge, a new directory per server start
+if not os.environ.get("CHECKIN_METRICS_DIR"):
+    os.environ["CHECKIN_METRICS_DIR"] = tempfile.mkdtemp(prefix="checkin-metrics-")
+    created_metrics_dir = os.environ["CHECKIN_METRICS_DIR"]
+else:
+    created_metrics_dir = None
+
+
+def worker_exit(server, worker):
+    # keep the requests a recycled worker served since its last flush
+    from checkin.metrics import registry
+
+    if registry.directory:
+        registry.flush()
+
+
+def on_exit(server):
+    if created_metrics_dir:
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
@@ -0,0 +1,52 @@
+"""
+PostgreSQL backend that keeps connections in a bounded per-process pool.
+
+Use it with ``CONN_MAX_AGE = 0``: Django closes the connection of a thread at
+the end of every request, which returns it to the pool, so the threads of a
+worker share ``POOL["MAX_SIZE"]`` connections instead of holding one each.
+``POOL`` in the database settings takes the keyword arguments of
+`ConnectionPool` in upper case.
+"""
+import os
+import threading
+
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+from timetracker.pooled_postgresql.pool import ConnectionPool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def open_connection(conn_params, options):
+    connection = psycopg2.connect(**conn_params)
+    if "isolation_level" in options and options["isolation_level"] != connection.isolation_level:
+        connection.set_session(isolation_level=options["isolation_level"])
+    # as in DatabaseWrapper.get_new_connection()
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_pool(self):
+        with _pools_lock:
+            pool = _pools.get(self.alias)
+            # a pool inherited from the parent process shares its sockets
+            if pool is None or pool.pid != os.getpid():
+                settings = {key.lower(): value for key, value in self.settings_dict.get("POOL", {}).items()}
+                conn_params = self.get_connection_params()
+                options = self.settings_dict["OPTIONS"]
+                pool = _pools[self.alias] = ConnectionPool(lambda: open_connection(conn_params, options), **settings)
+        return pool
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool().get()
+        self.isolation_level = self.settings_dict["OPTIONS"].get("isolation_level", connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool().put(self.connection)
@@ -0,0 +1,128 @@
+import collections
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of at most ``max_size`` open connections.
+
+    `get` hands out the most recently returned idle connection, or opens one
+    while fewer than ``max_size`` are open, or waits up to ``timeout`` seconds
+    for one to be returned. Connections idle for ``check_interval`` seconds
+    are checked with a round trip before they are handed out, connections
+    idle for ``max_idle`` seconds are closed, and connections older than
+    ``max_lifetime`` seconds are closed when they are returned.
+    """
+
+    def __init__(self, connect, max_size=4, timeout=10.0, max_idle=300.0, max_lifetime=3600.0, check_interval=30.0):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        # process the connections belong to
+        self.pid = os.getpid()
+        # (connection, returned at), most recently returned last
+        self._idle = collections.deque()
+        self._opened_at = {}
+        # connections being opened outside the lock
+        self._opening = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        """Open connections, idle or in use."""
+        return len(self._opened_at) + self._opening
+
+    def get(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                self._close_idle()
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise psycopg2.OperationalError(
+                            f"No database connection available within {self.timeout}s, "
+                            f"all {self.max_size} connections of the pool are in use."
+                        )
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection, returned_at = None, None
+                    self._opening += 1
+
+            if connection is None:
+                return self._open()
+            if time.monotonic() - returned_at < self.check_interval or self._is_alive(connection):
+                return connection
+            self._discard(connection)
+
+    def put(self, connection):
+        """Return ``connection``, rolling back an open transaction."""
+        if not connection.closed and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+        expired = time.monotonic() - self._opened_at.get(connection, 0) >= self.max_lifetime
+        if connection.closed or expired:
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close(self):
+        """Close the idle connections, connections in use are closed when they are returned."""
+        with self._condition:
+            idle, self._idle = self._idle, collections.deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _open(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._opened_at[connection] = time.monotonic()
+        return connection
+
+    def _is_alive(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._opened_at.pop(connection, None)
+            self._condition.notify()
+
+    def _close_idle(self):
+        """Close connections idle for longer than ``max_idle``, called with the lock held."""
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] >= self.max_idle:
+            connection, _ = self._idle.popleft()
+            connection.close()
+            self._opened_at.pop(connection, None)
@@ -1,4 +1,16 @@
+import os
+
 import dj_database_url
 
 
-DATABASES = {"default": dj_database_url.config(conn_max_age=600)}
+# Connections come from a bounded pool per process and go back to it at the
+# end of every request, see timetracker/pooled_postgresql
+DATABASES = {"default": dj_database_url.config(engine="timetracker.pooled_postgresql", conn_max_age=0)}
+DATABASES["default"]["POOL"] = {
+    "MAX_SIZE": int(os.environ.get("DATABASE_POOL_SIZE", 4)),
+    # seconds a request waits for a connection before it fails
+    "TIMEOUT": float(os.environ.get("DATABASE_POOL_TIMEOUT", 10)),
+    "MAX_IDLE": float(os.environ.get("DATABASE_POOL_MAX_IDLE", 300)),
+    "MAX_LIFETIME": float(os.environ.get("DATABASE_POOL_MAX_LIFETIME", 3600)),
+    "CHECK_INTERVAL": float(os.environ.get("DATABASE_POOL_CHECK_INTERVAL", 30)),
+}
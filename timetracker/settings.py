@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 import os
 from pathlib import Path
 
+import dj_database_url
 import environ
 
 
@@ -54,12 +55,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "checkin.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "checkin.middleware.AsyncWhiteNoiseMiddleware",
+    "checkin.middleware.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "checkin.middleware.ShardRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -70,8 +74,18 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # compiled templates are kept per process in every environment, DEBUG included,
+            # runserver's autoreloader clears them when a template changes
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -100,6 +114,54 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, as database URLs. Reports and admin
+# lists read from them, see checkin/routers.py. Tests run them as mirrors of
+# the default database.
+DATABASE_REPLICA_URLS = env.list("DATABASE_REPLICA_URLS", default=[])
+
+# Further databases the users' check-ins, daily totals and tags are spread
+# over, as database URLs, see checkin/shards.py. Migrate default first, then
+# every shard with "migrate --database shard_<n>". Keep the shards listed in
+# the same order, a shard's number decides the range of its ids.
+DATABASE_SHARD_URLS = env.list("DATABASE_SHARD_URLS", default=[])
+
+DATABASE_ROUTERS = ["checkin.shards.ShardRouter", "checkin.routers.ReplicaRouter"]
+
+# Seconds a browser keeps reading from the primary after a write, and the
+# replication lag in seconds above which a replica is not used, checked every
+# CHECKIN_REPLICA_LAG_CHECK_INTERVAL seconds per process. Keep the pin longer
+# than the maximum lag plus the check interval.
+CHECKIN_REPLICA_PIN_SECONDS = env.int("CHECKIN_REPLICA_PIN_SECONDS", 5)
+CHECKIN_REPLICA_MAX_LAG = env.float("CHECKIN_REPLICA_MAX_LAG", 2.0)
+CHECKIN_REPLICA_LAG_CHECK_INTERVAL = env.float("CHECKIN_REPLICA_LAG_CHECK_INTERVAL", 1.0)
+
+# Seconds a user's shard is cached, and seconds a move waits after refusing
+# the writes of the users it moves, for requests that already looked up
+# their shard. Keep the grace longer than the slowest write request.
+CHECKIN_SHARD_CACHE_TIMEOUT = env.int("CHECKIN_SHARD_CACHE_TIMEOUT", 60 * 60)
+CHECKIN_SHARD_MOVE_GRACE = env.float("CHECKIN_SHARD_MOVE_GRACE", 5.0)
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Use a cache shared by all workers (e.g. memcached, redis, file or database)
+# in production so invalidations reach every process.
+
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# Sessions are read from the cache and written to both the cache and the
+# database, and the user of a request is cached by CachedModelBackend, so a
+# request with a warm cache loads neither. Set SESSION_ENGINE to
+# django.contrib.sessions.backends.signed_cookies to keep sessions in the
+# cookie instead.
+SESSION_ENGINE = env.str("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+
+AUTHENTICATION_BACKENDS = ["checkin.backends.CachedModelBackend"]
+
+# Seconds a user is cached for. Saving or deleting the user drops it
+# earlier, this bounds how long changes made without save() can go unseen.
+CHECKIN_AUTH_USER_CACHE_TIMEOUT = env.int("CHECKIN_AUTH_USER_CACHE_TIMEOUT", 60 * 60)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -151,6 +213,62 @@ LOGOUT_URL = "/logout/"
 
 DJANGO_TABLES2_TEMPLATE = "django_tables2/bootstrap4.html"
 
+# Number of tag name -> id entries each process keeps in memory
+CHECKIN_TAG_CACHE_SIZE = env.int("CHECKIN_TAG_CACHE_SIZE", 1024)
+
+# Seconds cached report and dashboard data is kept. Entries are invalidated by
+# data versions, this only lets unreachable old versions expire.
+CHECKIN_USER_DATA_CACHE_TIMEOUT = env.int("CHECKIN_USER_DATA_CACHE_TIMEOUT", 60 * 60 * 24)
+
+# Report charts show at most CHECKIN_REPORT_MAX_POINTS time buckets, longer
+# date ranges use coarser buckets, and at most CHECKIN_REPORT_MAX_SLICES
+# groups plus one for all the others.
+CHECKIN_REPORT_MAX_POINTS = env.int("CHECKIN_REPORT_MAX_POINTS", 200)
+CHECKIN_REPORT_MAX_SLICES = env.int("CHECKIN_REPORT_MAX_SLICES", 10)
+
+# Per-view request latency, query counts and the slowest SQL statements,
+# served to superusers at /metrics/. Every worker writes its metrics to
+# CHECKIN_METRICS_DIR so the endpoint can merge them, use a directory that
+# the gunicorn workers of one instance share and that is emptied on deploys.
+# gunicorn.conf.py creates one per server start when it is not set.
+CHECKIN_METRICS_ENABLED = env.bool("CHECKIN_METRICS_ENABLED", True)
+CHECKIN_METRICS_DIR = env.str("CHECKIN_METRICS_DIR", None)
+CHECKIN_METRICS_FLUSH_INTERVAL = env.int("CHECKIN_METRICS_FLUSH_INTERVAL", 10)
+CHECKIN_METRICS_TOP_STATEMENTS = env.int("CHECKIN_METRICS_TOP_STATEMENTS", 20)
+
+# Serve the dashboard and report views as async views that run their
+# independent queries concurrently. Only useful when served over ASGI, e.g.
+# gunicorn timetracker.asgi -k uvicorn.workers.UvicornWorker
+CHECKIN_ASYNC_VIEWS = env.bool("CHECKIN_ASYNC_VIEWS", False)
+
+# Monthly partitions of the check-in table to keep ready ahead of time, once
+# it is partitioned with `manage.py partition_checkins convert` (PostgreSQL)
+CHECKIN_PARTITION_MONTHS_AHEAD = env.int("CHECKIN_PARTITION_MONTHS_AHEAD", 3)
+
+# Directory for check-ins moved out of the check-in table by
+# `manage.py checkin_cold_storage archive`, and the age in days from which
+# whole months are moved by default
+CHECKIN_COLD_STORAGE_DIR = env.str("CHECKIN_COLD_STORAGE_DIR", None)
+CHECKIN_COLD_STORAGE_AFTER_DAYS = env.int("CHECKIN_COLD_STORAGE_AFTER_DAYS", 365)
+
+# Background jobs run by `manage.py run_workers`, see checkin/jobs.py.
+# Exports estimated at CHECKIN_JOB_EXPORT_MIN_ROWS rows or more and the
+# reports over all users are handed to the workers. Export files are written
+# to CHECKIN_JOB_RESULT_DIR, which the web and worker processes must share.
+# Finished jobs are reused for the same request and deleted with their files
+# after CHECKIN_JOB_RESULT_TIMEOUT seconds; results over all users' data are
+# only reused for CHECKIN_JOB_SHARED_RESULT_MAX_AGE seconds. A running job
+# whose worker sent no heartbeat for CHECKIN_JOB_STALE_AFTER seconds is
+# given to another worker, up to CHECKIN_JOB_MAX_ATTEMPTS times.
+CHECKIN_JOB_WORKERS = env.int("CHECKIN_JOB_WORKERS", 2)
+CHECKIN_JOB_POLL_INTERVAL = env.float("CHECKIN_JOB_POLL_INTERVAL", 1.0)
+CHECKIN_JOB_RESULT_DIR = env.str("CHECKIN_JOB_RESULT_DIR", os.path.join(BASE_DIR, "job-results"))
+CHECKIN_JOB_RESULT_TIMEOUT = env.int("CHECKIN_JOB_RESULT_TIMEOUT", 60 * 60 * 24)
+CHECKIN_JOB_SHARED_RESULT_MAX_AGE = env.int("CHECKIN_JOB_SHARED_RESULT_MAX_AGE", 60 * 5)
+CHECKIN_JOB_STALE_AFTER = env.int("CHECKIN_JOB_STALE_AFTER", 60)
+CHECKIN_JOB_MAX_ATTEMPTS = env.int("CHECKIN_JOB_MAX_ATTEMPTS", 3)
+CHECKIN_JOB_EXPORT_MIN_ROWS = env.int("CHECKIN_JOB_EXPORT_MIN_ROWS", 100000)
+
 
 env = env.str("ENV", "dev")
 
@@ -158,3 +276,15 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 if env == "prod":
     from .prod_settings import *
+
+for index, url in enumerate(DATABASE_REPLICA_URLS, 1):
+    replica = dj_database_url.parse(url, conn_max_age=DATABASES["default"].get("CONN_MAX_AGE", 0))
+    if "POOL" in DATABASES["default"]:
+        replica.update(ENGINE=DATABASES["default"]["ENGINE"], POOL=DATABASES["default"]["POOL"])
+    DATABASES[f"replica_{index}"] = dict(replica, TEST={"MIRROR": "default"})
+
+for index, url in enumerate(DATABASE_SHARD_URLS, 1):
+    shard = dj_database_url.parse(url, conn_max_age=DATABASES["default"].get("CONN_MAX_AGE", 0))
+    if "POOL" in DATABASES["default"]:
+        shard.update(ENGINE=DATABASES["default"]["ENGINE"], POOL=DATABASES["default"]["POOL"])
+    DATABASES[f"shard_{index}"] = shard